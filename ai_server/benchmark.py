@@ -0,0 +1,687 @@
+"""Benchmarks and accuracy checks for the AI server.
+
+Usage:
+    python benchmark.py geo [--rows N]
+    python benchmark.py inference [--rows N] [--requests N]
+    python benchmark.py parity [--rows N]
+    python benchmark.py cache [--rows N]
+    python benchmark.py communities [--edges N] [--rings N]
+    python benchmark.py structuring [--accounts N]
+    python benchmark.py parallel [--rows N] [--communities N]
+    python benchmark.py velocity [--rows N] [--cards N]
+    python benchmark.py retrain [--rows N] [--new N]
+    python benchmark.py profile [--rows N,N,...] [--output results.json] [--datasets DIR]
+"""
+import argparse
+import itertools
+import json
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# Maximum relative error against geopy's geodesic, per distance mode
+GEO_TOLERANCE = {
+    'haversine': 0.006,
+    'ellipsoidal': 0.0002
+}
+
+
+def make_transactions(rows: int, seed: int = 42, fraud_rate: float = 0.05) -> pd.DataFrame:
+    """Synthetic transactions in the training CSV layout"""
+    rng = np.random.default_rng(seed)
+    cards = rng.integers(10**15, 10**16, size=max(10, rows // 50))
+    merchants = np.array([f"fraud_Merchant {i}" for i in range(max(10, min(800, rows // 20)))])
+    categories = np.array(['grocery_pos', 'gas_transport', 'shopping_net', 'shopping_pos',
+                           'misc_net', 'misc_pos', 'entertainment', 'food_dining',
+                           'personal_care', 'health_fitness', 'kids_pets', 'home', 'travel'])
+    start = pd.Timestamp('2025-01-01').value // 10**9
+    unix_time = np.sort(rng.integers(start, start + 180 * 86400, size=rows))
+    lat = rng.uniform(25, 48, rows)
+    long = rng.uniform(-123, -70, rows)
+    is_fraud = (rng.random(rows) < fraud_rate).astype(int)
+    # Fraud skews towards larger amounts so the model has something to learn
+    amt = np.round(rng.gamma(2.0, 35.0, rows) * np.where(is_fraud, 6, 1), 2)
+    return pd.DataFrame({
+        'trans_date_trans_time': pd.to_datetime(unix_time, unit='s').strftime('%Y-%m-%d %H:%M:%S'),
+        'cc_num': rng.choice(cards, rows),
+        'merchant': rng.choice(merchants, rows),
+        'category': rng.choice(categories, rows),
+        'amt': amt,
+        'gender': rng.choice(['M', 'F'], rows),
+        'zip': rng.integers(10000, 99999, rows),
+        'lat': lat,
+        'long': long,
+        'city_pop': rng.integers(100, 2_000_000, rows),
+        'dob': pd.to_datetime(rng.integers(-1262304000, 1104537600, rows), unit='s').strftime('%Y-%m-%d'),
+        'trans_num': [f"{i:032x}" for i in rng.integers(0, 2**63, rows)],
+        'unix_time': unix_time,
+        'merch_lat': lat + rng.normal(0, 0.7, rows),
+        'merch_long': long + rng.normal(0, 0.7, rows),
+        'is_fraud': is_fraud
+    })
+
+
+def make_transfers(rows: int, seed: int = 42, fraud_rate: float = 0.05) -> pd.DataFrame:
+    """Synthetic account-to-account transfers in the synthetic_fraud_data.csv layout"""
+    rng = np.random.default_rng(seed)
+    accounts = np.array([f"{i:08x}" for i in rng.integers(0, 2**32, size=max(10, rows // 20))])
+    locations = np.array(['USA', 'UK', 'Germany', 'France', 'India', 'Australia', 'Canada', 'UAE'])
+    start = pd.Timestamp('2025-01-01').value // 10**9
+    timestamps = pd.to_datetime(np.sort(rng.integers(start, start + 180 * 86400, size=rows)), unit='s')
+    is_fraud = (rng.random(rows) < fraud_rate).astype(int)
+    mac = rng.integers(0, 256, size=(rows, 6))
+    return pd.DataFrame({
+        'Transaction_ID': [f"{a:08x}-{b:03x}" for a, b in zip(rng.integers(0, 2**32, rows), rng.integers(0, 4096, rows))],
+        'Sender_account': rng.choice(accounts, rows),
+        'Receiver_account': rng.choice(accounts, rows),
+        'Amount': rng.gamma(2.0, 400.0, rows) * np.where(is_fraud, 4, 1),
+        'Sender_bank_location': rng.choice(locations, rows),
+        'Receiver_bank_location': rng.choice(locations, rows),
+        'Device_MAC': [':'.join(f"{b:02x}" for b in row) for row in mac],
+        'Timestamp': timestamps.strftime('%-m/%-d/%Y %H:%M'),
+        'Is_fraud': is_fraud
+    })
+
+
+def bench_inference(args) -> bool:
+    """Compiled single-row scoring vs the sklearn pipeline, and compiled size"""
+    from main import CompiledFraudModel, build_feature_frame, build_fraud_pipeline, model_feature_columns
+
+    features = model_feature_columns()
+    data = build_feature_frame(make_transactions(args.rows))
+    start = time.perf_counter()
+    pipeline = build_fraud_pipeline().fit(data[features], data['is_fraud'])
+    print(f"fit on {args.rows} rows in {time.perf_counter() - start:.2f} s")
+
+    start = time.perf_counter()
+    compiled = CompiledFraudModel(pipeline)
+    print(f"compile in {(time.perf_counter() - start) * 1000:.1f} ms")
+    print(f"{len(compiled.left)} nodes: compiled arrays {compiled.nbytes / 2**20:.1f} MiB, "
+          f"pickled pipeline {len(pickle.dumps(pipeline)) / 2**20:.1f} MiB")
+
+    requests = build_feature_frame(make_transactions(args.requests, seed=7))[features]
+    rows = [requests.iloc[[i]] for i in range(len(requests))]
+
+    timings = {}
+    for name, model in [('sklearn pipeline', pipeline), ('compiled', compiled)]:
+        model.predict_proba(rows[0])  # warm-up
+        latencies = []
+        for row in rows:
+            start = time.perf_counter()
+            model.predict_proba(row)
+            latencies.append(time.perf_counter() - start)
+        timings[name] = np.array(latencies) * 1000
+        p50, p99 = np.percentile(timings[name], [50, 99])
+        print(f"{name:<17} single-row p50 {p50:8.3f} ms  p99 {p99:8.3f} ms")
+    speedup = np.median(timings['sklearn pipeline']) / np.median(timings['compiled'])
+    print(f"speedup (p50): {speedup:.1f}x")
+
+    expected = np.vstack([pipeline.predict_proba(row) for row in rows])
+    actual = np.vstack([compiled.predict_proba(row) for row in rows])
+    max_diff = float(np.max(np.abs(expected - actual)))
+    ok = max_diff <= 1e-12
+    print(f"max |Δp| over {len(rows)} rows: {max_diff:.2e} {'✅' if ok else '🚨'}")
+    return ok
+
+
+def plant_rings(data: pd.DataFrame, rings: int, seed: int = 0, ring_txns: int = 30, noise: int = 5):
+    """Add structuring rings to a make_transactions frame: 4-8 cards that
+    keep paying the same 1-2 mule merchants. Ring cards also shop at
+    ordinary merchants and the mules get some ordinary traffic, so rings
+    are wired into the rest of the graph. Returns (frame, account sets)."""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(data['trans_date_trans_time'].min())
+    span = (pd.Timestamp(data['trans_date_trans_time'].max()) - start).total_seconds()
+    cards, merchants = data['cc_num'].unique(), data['merchant'].unique()
+    frames, truth = [data], []
+    for ring in range(rings):
+        members = np.arange(rng.integers(4, 9)) + 10**12 + ring * 100
+        mules = np.array([f"fraud_Mule {ring}-{j}" for j in range(rng.integers(1, 3))])
+        truth.append({str(card) for card in members} | set(mules))
+        senders = np.concatenate([rng.choice(members, ring_txns), np.repeat(members, noise), rng.choice(cards, noise)])
+        receivers = np.concatenate([rng.choice(mules, ring_txns), rng.choice(merchants, noise * len(members)),
+                                    rng.choice(mules, noise)])
+        rows = data.sample(len(senders), replace=True, random_state=seed + ring).reset_index(drop=True)
+        rows['cc_num'] = senders
+        rows['merchant'] = receivers
+        rows['amt'] = np.round(rng.uniform(500, 990, len(rows)), 2)
+        rows['is_fraud'] = (np.arange(len(rows)) < ring_txns).astype(int)
+        rows['trans_date_trans_time'] = (start + pd.to_timedelta(rng.uniform(0, span, len(rows)), unit='s')).strftime('%Y-%m-%d %H:%M:%S')
+        frames.append(rows)
+    return pd.concat(frames, ignore_index=True), truth
+
+
+def request_payloads(data: pd.DataFrame) -> list:
+    """Training rows as API payloads: request field names, half of them
+    nested under transaction_data like the NestJS caller sends them"""
+    payloads = []
+    for record in data.to_dict('records'):
+        payload = {
+            'cardNum': record.pop('cc_num'),
+            'amount': record.pop('amt'),
+            'transactionId': record.pop('trans_num')
+        }
+        nested = dict(list(record.items())[::2])
+        payload.update({k: v for k, v in record.items() if k not in nested})
+        payload['transaction_data'] = nested
+        payloads.append(payload)
+    return payloads
+
+
+def serve_one_by_one(payloads: list):
+    """Feature rows as the detector builds them: one request at a time,
+    velocity read from a VelocityStore that then observes the row"""
+    from main import VelocityStore, build_request_features
+
+    store = VelocityStore()
+    rows = []
+    for payload in payloads:
+        row = build_request_features([payload], velocity=store)
+        store.observe(row)
+        rows.append(row)
+    return pd.concat(rows, ignore_index=True)
+
+
+def bench_parity(args) -> bool:
+    """Training and serving must build identical feature rows
+    (the assertions live in tests/test_feature_parity.py)"""
+    from main import build_feature_frame, model_feature_columns
+
+    data = make_transactions(args.rows)
+    features = model_feature_columns()
+    training = build_feature_frame(data.copy())[features]
+    start = time.perf_counter()
+    serving = serve_one_by_one(request_payloads(data))[features]
+    elapsed = time.perf_counter() - start
+
+    try:
+        pd.testing.assert_frame_equal(training, serving, check_dtype=False, rtol=1e-9)
+    except AssertionError as e:
+        print(f"🚨 Training and serving features differ:\n{e}")
+        return False
+    print(f"✅ {len(features)} features identical for {args.rows} rows in training and "
+          f"store-backed serving ({elapsed / args.rows * 1000:.2f} ms/request)")
+    return True
+
+
+def bench_cache(args) -> bool:
+    """Cold-start CSV parsing vs loading the columnar sidecar"""
+    from main import _pyarrow, read_csv_cached
+
+    if _pyarrow() is None:
+        print("🚨 pyarrow is not installed - the columnar cache is disabled")
+        return False
+
+    read_kwargs = {'dtype': {'cc_num': 'str', 'trans_num': 'str'}, 'low_memory': False}
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, 'transactions.csv')
+        make_transactions(args.rows).to_csv(csv_path, index=False)
+
+        start = time.perf_counter()
+        raw = pd.read_csv(csv_path, **read_kwargs)
+        csv_time = time.perf_counter() - start
+        start = time.perf_counter()
+        built = read_csv_cached(csv_path, **read_kwargs)
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        cached = read_csv_cached(csv_path, **read_kwargs)
+        cached_time = time.perf_counter() - start
+
+        print(f"pd.read_csv        {args.rows} rows in {csv_time * 1000:8.1f} ms, "
+              f"{raw.memory_usage(deep=True).sum() / 2**20:6.1f} MiB")
+        print(f"parse + build      {args.rows} rows in {build_time * 1000:8.1f} ms")
+        print(f"columnar cache     {args.rows} rows in {cached_time * 1000:8.1f} ms, "
+              f"{cached.memory_usage(deep=True).sum() / 2**20:6.1f} MiB ({csv_time / cached_time:.0f}x)")
+
+    try:
+        pd.testing.assert_frame_equal(built, cached)
+    except AssertionError as e:
+        print(f"🚨 Cached frame differs from the parsed CSV:\n{e}")
+        return False
+    print("✅ Cached frame identical to the parsed CSV")
+    return True
+
+
+def bench_communities(args) -> bool:
+    """Label propagation at scale; planted rings must come back intact"""
+    from main import LabelPropagation
+
+    rng = np.random.default_rng(42)
+    cards, merchants = max(100, args.edges // 200), max(50, args.edges // 2000)
+    senders = rng.integers(0, cards, args.edges)
+    receivers = cards + rng.integers(0, merchants, args.edges)
+
+    # Rings: 4 cards that keep paying the same 2 merchants; with --connected
+    # their cards also shop at ordinary merchants and the mules get ordinary traffic
+    base = cards + merchants
+    ring_senders, ring_receivers, rings = [], [], []
+    for ring in range(args.rings):
+        members = base + ring * 6 + np.arange(6)
+        rings.append(set(members.tolist()))
+        ring_senders.append(rng.choice(members[:4], 30))
+        ring_receivers.append(rng.choice(members[4:], 30))
+        if args.connected:
+            ring_senders += [np.repeat(members[:4], 5), rng.integers(0, cards, 5)]
+            ring_receivers += [cards + rng.integers(0, merchants, 20), rng.choice(members[4:], 5)]
+    senders = np.concatenate([senders] + ring_senders)
+    receivers = np.concatenate([receivers] + ring_receivers)
+    n_nodes = base + args.rings * 6
+
+    lpa = LabelPropagation()
+    start = time.perf_counter()
+    lpa.fit(senders, receivers, np.ones(len(senders)), n_nodes)
+    fit_time = time.perf_counter() - start
+    print(f"fit      {len(senders)} edges, {n_nodes} accounts in {fit_time * 1000:8.1f} ms")
+
+    for _ in range(500):
+        lpa.add_edge(int(rng.integers(0, cards)), int(cards + rng.integers(0, merchants)))
+    start = time.perf_counter()
+    lpa.refresh(n_nodes)
+    print(f"refresh  500 new edges in {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+    found = {frozenset(members.tolist()) for members in lpa.groups().values()}
+    intact = sum(frozenset(ring) in found for ring in rings)
+    # Best Jaccard overlap of each ring with a detected group
+    overlap = np.mean([max(len(ring & group) / len(ring | group) for group in found) for ring in rings])
+    if args.connected:
+        ok = overlap >= 0.7
+    else:
+        # An isolated ring may split along its merchants, but must never absorb outsiders
+        leaked = [group for group in found if len(group) <= 6 and not any(group <= ring for ring in rings)]
+        ok = not leaked and all(any(group <= ring for group in found) for ring in rings)
+    print(f"{intact}/{args.rings} rings recovered whole, mean overlap {overlap:.2f}, "
+          f"converged {lpa.converged} {'✅' if ok else '🚨'}")
+    return ok
+
+
+def bench_structuring(args) -> bool:
+    """Vectorized structuring scan vs the per-account loop it replaced"""
+    from main import STRUCTURING_PARAMS, StructuringScan
+
+    rng = np.random.default_rng(42)
+    edges = args.accounts * 3
+    senders = rng.integers(0, args.accounts, edges)
+    receivers = args.accounts + rng.integers(0, 5000, edges)
+    # About 1% of accounts split a large sum across several receivers within hours
+    amounts = np.where(senders % 100 == 0, rng.uniform(1000, 1800, edges), rng.gamma(2.0, 60.0, edges))
+    start_ns = pd.Timestamp('2025-01-01').value
+    hours = np.where(senders % 100 == 0, rng.uniform(0, 6, edges), rng.uniform(0, 24 * 90, edges))
+    times = start_ns + (hours * 3.6e12).astype(np.int64)
+    df = pd.DataFrame({'Sender_account': senders, 'Receiver_account': receivers,
+                       'Amount': amounts, 'DateTime': pd.to_datetime(times)})
+
+    start = time.perf_counter()
+    scan = StructuringScan.from_frame(df)
+    flagged = scan.accounts[scan.flagged]
+    scan_time = time.perf_counter() - start
+    print(f"vectorized scan  {args.accounts} accounts, {edges} edges in {scan_time * 1000:8.1f} ms, "
+          f"{len(flagged)} flagged")
+
+    # Reference: the old graph loop over each account's latest edge per receiver
+    start = time.perf_counter()
+    latest = {}
+    for sender, receiver, amount, ts in zip(senders.tolist(), receivers.tolist(), amounts.tolist(), times.tolist()):
+        latest.setdefault(sender, {})[receiver] = (amount, ts)
+    reference = []
+    for sender, out in latest.items():
+        if len(out) < STRUCTURING_PARAMS['min_split']:
+            continue
+        edge_amounts = [a for a, _ in out.values()]
+        edge_times = [t for _, t in out.values()]
+        if ((max(edge_times) - min(edge_times)) / 3.6e12 < STRUCTURING_PARAMS['max_time_window'] and
+                max(edge_amounts) / min(edge_amounts) < STRUCTURING_PARAMS['amount_variation'] and
+                sum(edge_amounts) > STRUCTURING_PARAMS['min_total_amount']):
+            reference.append(sender)
+    loop_time = time.perf_counter() - start
+    print(f"python loop      {args.accounts} accounts, {edges} edges in {loop_time * 1000:8.1f} ms "
+          f"({loop_time / scan_time:.0f}x)")
+
+    ok = sorted(reference) == flagged.tolist()
+    print(f"{'✅' if ok else '🚨'} flagged accounts {'match' if ok else 'differ from'} the loop")
+    return ok
+
+
+def bench_parallel(args) -> bool:
+    """detect_smurfing across process-pool sizes; output must not change"""
+    import main
+    from main import PARALLEL_PARAMS, SmurfingDetector
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = make_transactions(args.rows)
+        csv_path = os.path.join(tmp, 'transactions.csv')
+        json_path = os.path.join(tmp, 'communities.json')
+        data.to_csv(csv_path, index=False)
+        cards = np.array_split(np.sort(data['cc_num'].astype(str).unique()), args.communities)
+        with open(json_path, 'w') as f:
+            json.dump({'fraud_communities': {
+                str(i): {'Members': members.tolist()} for i, members in enumerate(cards)
+            }}, f)
+        detector = SmurfingDetector(csv_path, json_path)
+
+    def run(workers):
+        PARALLEL_PARAMS.update(enabled=workers > 0, workers=workers or None, min_rows=0)
+        if main._community_executor is not None:
+            main._community_executor.shutdown()
+            main._community_executor = None
+        if workers:
+            detector._community_results = {}
+            detector.detect_smurfing()  # start the pool outside the timing
+        detector._community_results = {}
+        start = time.perf_counter()
+        results = detector.detect_smurfing()
+        return time.perf_counter() - start, json.dumps(results, sort_keys=True, default=str)
+
+    baseline, expected = run(0)
+    print(f"sequential        {args.communities} communities, {args.rows} rows in {baseline * 1000:8.1f} ms")
+    ok = True
+    workers = 1
+    while True:
+        elapsed, output = run(workers)
+        ok &= output == expected
+        print(f"pool {workers:>2} workers   {args.communities} communities, {args.rows} rows in {elapsed * 1000:8.1f} ms "
+              f"({baseline / elapsed:4.1f}x) {'✅' if output == expected else '🚨 output differs'}")
+        if workers >= (os.cpu_count() or 1):
+            break
+        workers = min(workers * 2, os.cpu_count())
+    return ok
+
+
+def bench_velocity(args) -> bool:
+    """Bulk velocity features vs streaming the same rows through VelocityStore"""
+    from main import VELOCITY_COLUMNS, CardVelocity, VelocityStore, velocity_feature_frame
+
+    data = make_transactions(args.rows)
+    # Few cards, so windows fill up and the per-card ring buffer wraps
+    data['cc_num'] = np.random.default_rng(3).integers(0, args.cards, args.rows)
+    data['trans_date_trans_time'] = pd.to_datetime(data['trans_date_trans_time'])
+
+    start = time.perf_counter()
+    bulk = velocity_feature_frame(data['cc_num'], data['trans_date_trans_time'], data['amt'], data['merchant'])
+    elapsed = time.perf_counter() - start
+    print(f"bulk       {args.rows} rows in {elapsed * 1000:8.1f} ms ({elapsed / args.rows * 1e6:.2f} µs/row)")
+
+    store = VelocityStore()
+    streamed, read_time, write_time = [], 0.0, 0.0
+    for i in range(args.rows):
+        row = data.iloc[i:i + 1]
+        start = time.perf_counter()
+        streamed.append(store.features(row).to_numpy()[0])
+        read_time += time.perf_counter() - start
+        start = time.perf_counter()
+        store.observe(row)
+        write_time += time.perf_counter() - start
+    print(f"streaming  features {read_time / args.rows * 1e6:.1f} µs/txn, "
+          f"observe {write_time / args.rows * 1e6:.1f} µs/txn, {len(store)} cards held")
+
+    # The per-card ring buffer update on its own, without DataFrame handling
+    cards = VelocityStore()
+    rows = list(VelocityStore._rows(data))
+    start = time.perf_counter()
+    for card, time_ns, amount, merchant, _ in rows:
+        state = cards.cards.setdefault(card, CardVelocity())
+        state.features(time_ns)
+        state.observe(time_ns, amount, merchant)
+    elapsed = time.perf_counter() - start
+    print(f"ring buffer features + observe {elapsed / args.rows * 1e6:.1f} µs/txn")
+
+    diff = np.abs(np.vstack(streamed) - bulk[VELOCITY_COLUMNS].to_numpy())
+    max_diff = float(diff.max())
+    ok = max_diff <= 1e-6
+    print(f"max |Δ| over {len(VELOCITY_COLUMNS)} features: {max_diff:.2e} {'✅' if ok else '🚨'}")
+    if not ok:
+        print(pd.Series(diff.max(axis=0), index=VELOCITY_COLUMNS).to_string())
+    return ok
+
+
+def bench_retrain(args) -> bool:
+    """Wall time and holdout AUC of each retraining mode after new rows arrive"""
+    from main import (RETRAIN_MODES, _holdout_auc, build_feature_frame, fit_fraud_model,
+                      load_model_file, model_feature_columns, select_training_rows)
+
+    columns = model_feature_columns() + ['is_fraud']
+    data = build_feature_frame(make_transactions(args.rows + args.new))
+    holdout = build_feature_frame(make_transactions(args.holdout, seed=11))
+
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        base_path = os.path.join(tmp, 'base.pkl')
+        base = fit_fraud_model(data.iloc[:args.rows][columns], base_path)
+        os.replace(base['path'], base_path)
+        base_auc = _holdout_auc(load_model_file(base_path), holdout[columns[:-1]], holdout['is_fraud'])
+        print(f"base model      {args.rows:>8} rows  {base['seconds']:7.2f} s  holdout AUC {base_auc:.4f}")
+
+        for mode in RETRAIN_MODES:
+            model_path = os.path.join(tmp, f'{mode}.pkl')
+            with open(base_path, 'rb') as src, open(model_path, 'wb') as dst:
+                dst.write(src.read())
+            start = time.perf_counter()
+            snapshot = select_training_rows(data, mode)[columns].copy()
+            result = fit_fraud_model(snapshot, model_path, mode)
+            elapsed = time.perf_counter() - start
+            auc = _holdout_auc(load_model_file(result['path']), holdout[columns[:-1]], holdout['is_fraud'])
+            ok &= auc is not None and result['mode'] == mode
+            print(f"{mode:<15} {result['rows']:>8} rows  {elapsed:7.2f} s  holdout AUC {auc:.4f}")
+    return ok
+
+
+def _environment() -> dict:
+    """Enough context to compare result files across releases and machines"""
+    import sklearn
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'created': pd.Timestamp.now(tz='UTC').isoformat(),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'versions': {'numpy': np.__version__, 'pandas': pd.__version__, 'sklearn': sklearn.__version__}
+    }
+
+
+class StageRecorder:
+    """Times stages and, unless disabled, measures their peak traced memory.
+
+    tracemalloc slows Python-heavy code several times over, so memory comes
+    from a separate traced run of the stage (at most 10 calls for
+    per-request stages) and never skews the timings.
+    """
+
+    def __init__(self, rows: int, memory: bool):
+        self.rows = rows
+        self.memory = memory
+        self.results = []
+
+    def stage(self, name: str, fn, calls: int = 1):
+        """Run fn() once, or `calls` times for per-request stages; returns the last result"""
+        latencies = []
+        for _ in range(calls):
+            start = time.perf_counter()
+            result = fn()
+            latencies.append(time.perf_counter() - start)
+
+        peak = None
+        if self.memory:
+            tracemalloc.start()
+            for _ in range(min(calls, 10)):
+                fn()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        record = {'rows': self.rows, 'stage': name, 'seconds': float(np.sum(latencies)), 'calls': calls,
+                  'peak_mb': round(peak / 2**20, 2) if peak is not None else None}
+        line = f"{self.rows:>9} rows  {name:<18} {record['seconds']:9.3f} s"
+        if calls > 1:
+            p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+            record.update(p50_ms=round(p50, 4), p95_ms=round(p95, 4), p99_ms=round(p99, 4))
+            line += f"  p50 {p50:7.3f} ms  p99 {p99:7.3f} ms"
+        if peak is not None:
+            line += f"  peak {record['peak_mb']:9.1f} MiB"
+        print(line)
+        self.results.append(record)
+        return result
+
+
+def bench_profile(args) -> bool:
+    """Per-stage time and peak memory of training and serving at several scales"""
+    from main import (CompiledFraudModel, TransactionLog, VelocityStore, build_feature_frame,
+                      build_fraud_pipeline, build_request_features, model_feature_columns)
+
+    features = model_feature_columns()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            rec = StageRecorder(rows, args.memory)
+            csv_path = os.path.join(tmp, f'transactions_{rows}.csv')
+
+            # Data preparation
+            data = rec.stage('generate', lambda: make_transactions(rows))
+            rec.stage('csv_write', lambda: data.to_csv(csv_path, index=False))
+            data = rec.stage('csv_read', lambda: pd.read_csv(csv_path, dtype={'cc_num': 'str', 'trans_num': 'str'},
+                                                             low_memory=False))
+            raw = data
+            data = rec.stage('feature_frame', lambda: build_feature_frame(raw.copy()))
+            if args.datasets:
+                os.makedirs(args.datasets, exist_ok=True)
+                data.to_csv(os.path.join(args.datasets, f'transactions_{rows}.csv'), index=False)
+                make_transfers(rows).to_csv(os.path.join(args.datasets, f'transfers_{rows}.csv'), index=False)
+
+            # Training, one pipeline step at a time
+            pipeline = build_fraud_pipeline()
+            if args.trees:
+                pipeline.set_params(classifier__n_estimators=args.trees)
+            X, y = data[features], data['is_fraud']
+            X_t = rec.stage('preprocessor_fit', lambda: pipeline.named_steps['preprocessor'].fit_transform(X, y))
+            X_r, y_r = rec.stage('smote', lambda: pipeline.named_steps['smote'].fit_resample(X_t, y))
+            rec.stage('forest_fit', lambda: pipeline.named_steps['classifier'].fit(X_r, y_r))
+            compiled = rec.stage('compile', lambda: CompiledFraudModel(pipeline))
+
+            # Serving, one request at a time
+            payloads = make_transactions(args.requests, seed=7).to_dict('records')
+            velocity = rec.stage('velocity_seed', lambda: VelocityStore.from_frame(data))
+            single = build_request_features(payloads[:1], velocity=velocity)
+            remaining = itertools.cycle(payloads)
+            rec.stage('preprocess', lambda: build_request_features([next(remaining)], velocity=velocity),
+                      calls=args.requests)
+            rec.stage('predict_compiled', lambda: compiled.predict_proba(single[features]), calls=args.requests)
+            rec.stage('predict_pipeline', lambda: pipeline.predict_proba(single[features]), calls=args.requests)
+
+            log = TransactionLog(csv_path)
+            record = single.assign(is_fraud=0, fraud_probability=0.0).to_dict('records')
+            rec.stage('log_append', lambda: log.append(record), calls=args.requests)
+            rec.stage('log_compact', log.compact)
+            results += rec.results
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'profile', 'environment': _environment(), 'trees': args.trees,
+                       'memory_tracing': args.memory, 'results': results}, f, indent=2)
+        print(f"📄 Wrote {len(results)} stage results to {args.output}")
+    return True
+
+
+def bench_geo(args) -> bool:
+    """Compare geo_distance with geopy's geodesic for accuracy and speed"""
+    from geopy.distance import geodesic
+    from main import geo_distance
+
+    rng = np.random.default_rng(42)
+    lat1, lat2 = rng.uniform(-89, 89, (2, args.rows))
+    lon1, lon2 = rng.uniform(-180, 180, (2, args.rows))
+
+    start = time.perf_counter()
+    reference = np.array([
+        geodesic((a, b), (c, d)).km for a, b, c, d in zip(lat1, lon1, lat2, lon2)
+    ])
+    geopy_time = time.perf_counter() - start
+    print(f"geopy geodesic   {args.rows} rows in {geopy_time * 1000:9.2f} ms")
+
+    passed = True
+    for mode, tolerance in GEO_TOLERANCE.items():
+        start = time.perf_counter()
+        distance = geo_distance(lat1, lon1, lat2, lon2, mode=mode)
+        elapsed = time.perf_counter() - start
+        rel_error = np.max(np.abs(distance - reference) / reference)
+        ok = rel_error <= tolerance
+        passed &= ok
+        print(f"{mode:<16} {args.rows} rows in {elapsed * 1000:9.2f} ms "
+              f"({geopy_time / elapsed:7.0f}x), max rel error {rel_error:.2e} "
+              f"(tolerance {tolerance:.0e}) {'✅' if ok else '🚨'}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    geo = sub.add_parser('geo', help='validate the vectorized distance kernel against geopy')
+    geo.add_argument('--rows', type=int, default=20000)
+    geo.set_defaults(func=bench_geo)
+
+    inference = sub.add_parser('inference', help='compiled vs sklearn single-row scoring')
+    inference.add_argument('--rows', type=int, default=50000, help='training rows')
+    inference.add_argument('--requests', type=int, default=300, help='single-row requests to time')
+    inference.set_defaults(func=bench_inference)
+
+    parity = sub.add_parser('parity', help='check training and serving build the same features')
+    parity.add_argument('--rows', type=int, default=2000)
+    parity.set_defaults(func=bench_parity)
+
+    cache = sub.add_parser('cache', help='CSV parsing vs the columnar sidecar cache')
+    cache.add_argument('--rows', type=int, default=200000)
+    cache.set_defaults(func=bench_cache)
+
+    communities = sub.add_parser('communities', help='label propagation on a large synthetic graph')
+    communities.add_argument('--edges', type=int, default=2000000)
+    communities.add_argument('--rings', type=int, default=20)
+    communities.add_argument('--connected', action='store_true', help='wire rings into the ordinary traffic')
+    communities.set_defaults(func=bench_communities)
+
+    structuring = sub.add_parser('structuring', help='vectorized structuring scan vs the per-account loop')
+    structuring.add_argument('--accounts', type=int, default=1000000)
+    structuring.set_defaults(func=bench_structuring)
+
+    parallel = sub.add_parser('parallel', help='detect_smurfing scaling with the process pool')
+    parallel.add_argument('--rows', type=int, default=400000)
+    parallel.add_argument('--communities', type=int, default=16)
+    parallel.set_defaults(func=bench_parallel)
+
+    velocity = sub.add_parser('velocity', help='bulk vs streaming per-card velocity features')
+    velocity.add_argument('--rows', type=int, default=20000)
+    velocity.add_argument('--cards', type=int, default=50)
+    velocity.set_defaults(func=bench_velocity)
+
+    retrain = sub.add_parser('retrain', help='full vs incremental retraining cost and AUC')
+    retrain.add_argument('--rows', type=int, default=50000, help='history the current model was trained on')
+    retrain.add_argument('--new', type=int, default=2000, help='rows appended since')
+    retrain.add_argument('--holdout', type=int, default=20000)
+    retrain.set_defaults(func=bench_retrain)
+
+    profile = sub.add_parser('profile', help='time and peak memory of each training and serving stage')
+    profile.add_argument('--rows', type=lambda v: [int(r) for r in v.split(',')], default=[10000, 100000],
+                         help='comma-separated scales, e.g. 10000,100000,1000000,10000000')
+    profile.add_argument('--requests', type=int, default=200, help='single-row calls per serving stage')
+    profile.add_argument('--trees', type=int, default=None, help='override n_estimators for large scales')
+    profile.add_argument('--no-memory', dest='memory', action='store_false',
+                         help='skip the traced re-run of each stage that measures peak memory')
+    profile.add_argument('--output', help='write results as JSON')
+    profile.add_argument('--datasets', help='also write the generated CSVs (both layouts) here')
+    profile.set_defaults(func=bench_profile)
+
+    args = parser.parse_args()
+    sys.exit(0 if args.func(args) else 1)
+
+
+if __name__ == '__main__':
+    main()
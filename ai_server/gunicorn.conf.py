@@ -0,0 +1,28 @@
+# Production serving: gunicorn -c gunicorn.conf.py main:app
+#
+# The app is imported once in the master with AI_SERVER_PRELOAD=1, so the
+# training data, model and transaction graph are loaded before forking and
+# shared copy-on-write by every worker instead of being rebuilt per worker.
+#
+# Each worker accepts connections on `threads` threads; scoring itself runs
+# on main.py's bounded executor (AI_SERVER_SCORING_THREADS, AI_SERVER_MAX_QUEUE),
+# which answers 503 once it is saturated. Keep `threads` above
+# scoring threads + queue so overload turns into fast 503s rather than
+# connections waiting in the listen backlog.
+import os
+
+os.environ.setdefault('AI_SERVER_PRELOAD', '1')
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+# Card velocity features are served from per-process state, so a second
+# worker would see only part of each card's traffic and serve features that
+# differ from training. Several workers need AI_SERVER_VELOCITY=0.
+velocity = os.getenv('AI_SERVER_VELOCITY', '1') != '0'
+workers = int(os.getenv('WEB_CONCURRENCY', '1' if velocity else '2'))
+if velocity and workers > 1:
+    raise RuntimeError(f"WEB_CONCURRENCY={workers} with velocity features on: "
+                       "serve them from one worker or set AI_SERVER_VELOCITY=0")
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '32'))
+preload_app = True
+timeout = 120
@@ -1,26 +1,34 @@
+import asyncio
+import hashlib
+import io
 import json
 import re
 import pandas as pd
-from flask import Flask, request, jsonify
-from langchain_groq import ChatGroq
-from langchain.schema import SystemMessage, HumanMessage
+from flask import Flask, request, jsonify, copy_current_request_context, g
 from dotenv import load_dotenv
 import os
 import base64
+import gc
 from flask_cors import CORS
-import joblib
-from datetime import datetime
-from geopy.distance import geodesic
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
-from sklearn.compose import ColumnTransformer
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
-from imblearn.over_sampling import SMOTE
-from imblearn.pipeline import Pipeline as ImbPipeline
-import networkx as nx
 import numpy as np
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta 
+import threading
+import bisect
+import time
+import functools
+import multiprocessing
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# sklearn, imblearn, joblib, networkx and httpx are imported where they
+# are used, so importing this module (and booting a worker) stays cheap.
 
 # Load environment variables
 load_dotenv()
@@ -29,6 +37,420 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
+# ==================================================================
+# LATENCY METRICS
+# ==================================================================
+# Per-stage and per-route latency histograms, exported by /metrics in the
+# Prometheus text format. Counts are per process: under gunicorn each
+# worker reports its own.
+METRICS_PARAMS = {
+    'buckets': tuple(round(1e-4 * 1.5 ** k, 6) for k in range(33)),  # 0.1 ms .. ~43 s
+    'quantiles': (0.5, 0.95, 0.99)
+}
+
+class LatencyHistogram:
+    """Fixed-bucket histogram: one bisect and three increments per observation"""
+
+    def __init__(self, buckets: Tuple[float, ...] = METRICS_PARAMS['buckets']):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q: float, counts: Optional[List[int]] = None) -> float:
+        """Estimate like Prometheus' histogram_quantile: linear within the bucket"""
+        counts = counts if counts is not None else self.snapshot()[0]
+        rank = q * sum(counts)
+        cumulative = 0
+        for i, n in enumerate(counts):
+            if n and cumulative + n >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / n
+            cumulative += n
+        return 0.0
+
+class LatencyMetrics:
+    """A family of latency histograms keyed by one label"""
+
+    def __init__(self, name: str, label: str, description: str):
+        self.name = name
+        self.label = label
+        self.description = description
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: str, seconds: float):
+        histogram = self._histograms.get(value)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(value, LatencyHistogram())
+        histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, value: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(value, time.perf_counter() - started)
+
+    def render(self) -> List[str]:
+        """Prometheus text lines: the histogram plus estimated quantile gauges"""
+        histogram_lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        quantile_lines = [f"# HELP {self.name}_quantile p50/p95/p99 of {self.name}, estimated from its buckets",
+                          f"# TYPE {self.name}_quantile gauge"]
+        for value, histogram in sorted(self._histograms.items()):
+            counts, total, count = histogram.snapshot()
+            labels = f'{self.label}="{value}"'
+            cumulative = 0
+            for bound, n in zip(histogram.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                histogram_lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            histogram_lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            histogram_lines.append(f'{self.name}_count{{{labels}}} {count}')
+            for q in METRICS_PARAMS['quantiles']:
+                quantile_lines.append(f'{self.name}_quantile{{{labels},quantile="{q}"}} '
+                                      f'{histogram.quantile(q, counts):.6f}')
+        return histogram_lines + quantile_lines
+
+REQUEST_SECONDS = LatencyMetrics('ai_server_request_seconds', 'route',
+                                 'End-to-end request latency, including time queued for a scoring thread')
+STAGE_SECONDS = LatencyMetrics('ai_server_stage_seconds', 'stage',
+                               'Time spent in each processing stage')
+
+def timed(stage: str):
+    """Context manager recording one stage's duration"""
+    return STAGE_SECONDS.time(stage)
+
+# ==================================================================
+# GEO DISTANCE
+# ==================================================================
+GEO_PARAMS = {
+    'distance_mode': 'ellipsoidal',  # 'ellipsoidal' (WGS-84) or 'haversine' (sphere)
+    'earth_radius_km': 6371.0088,    # mean radius used by the haversine mode
+    'wgs84_a': 6378137.0,
+    'wgs84_f': 1 / 298.257223563
+}
+KM_PER_MILE = 1.609344
+
+def geo_distance(lat1, lon1, lat2, lon2, mode: Optional[str] = None, unit: str = 'km'):
+    """Vectorized distance between coordinate arrays (decimal degrees).
+
+    'haversine' treats the earth as a sphere and is within 0.6% of geopy's
+    geodesic. 'ellipsoidal' uses Lambert's formula on the WGS-84 ellipsoid and
+    is within 0.02% of geodesic (under a metre for hops below 100 km).
+    NaN inputs give NaN distances. `python benchmark.py geo` checks both.
+    """
+    mode = mode or GEO_PARAMS['distance_mode']
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+
+    if mode == 'haversine':
+        sigma = _central_angle(lat1, lon1, lat2, lon2)
+        km = GEO_PARAMS['earth_radius_km'] * sigma
+    elif mode == 'ellipsoidal':
+        a, f = GEO_PARAMS['wgs84_a'], GEO_PARAMS['wgs84_f']
+        # Reduced latitudes, then the spherical angle between them
+        beta1 = np.arctan((1 - f) * np.tan(lat1))
+        beta2 = np.arctan((1 - f) * np.tan(lat2))
+        sigma = _central_angle(beta1, lon1, beta2, lon2)
+        
+        P = (beta1 + beta2) / 2
+        Q = (beta2 - beta1) / 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            X = (sigma - np.sin(sigma)) * np.sin(P) ** 2 * np.cos(Q) ** 2 / np.cos(sigma / 2) ** 2
+            Y = (sigma + np.sin(sigma)) * np.cos(P) ** 2 * np.sin(Q) ** 2 / np.sin(sigma / 2) ** 2
+            meters = a * (sigma - f / 2 * (X + Y))
+        km = np.where(sigma == 0, 0.0, meters / 1000)
+    else:
+        raise ValueError(f"Unknown distance mode: {mode}")
+
+    return km / KM_PER_MILE if unit == 'miles' else km
+
+def _central_angle(lat1, lon1, lat2, lon2):
+    """Great-circle angle (radians) via the haversine formula"""
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+# ==================================================================
+# COLUMNAR CACHE
+# ==================================================================
+# Typed Feather sidecar next to each source CSV, so a cold start maps
+# columns from disk instead of re-parsing text. pyarrow is optional:
+# without it every load reads the CSV.
+CACHE_PARAMS = {
+    'enabled': True,
+    'suffix': '.feather',
+    'memory_map': True,  # share cached pages between worker processes
+    'categorical': ['merchant', 'category', 'state', 'gender'],
+    'timestamps': ['trans_date_trans_time'],  # datetime64[ns] (int64 on disk)
+    'float32': ['amt', 'amount']
+}
+
+def apply_column_types(df: pd.DataFrame) -> pd.DataFrame:
+    """Compact dtypes for the cached columns, in place"""
+    for column in CACHE_PARAMS['categorical']:
+        if column in df and df[column].dtype == object:
+            df[column] = df[column].astype('category')
+    for column in CACHE_PARAMS['timestamps']:
+        if column in df and not pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = pd.to_datetime(df[column], errors='coerce')
+    for column in CACHE_PARAMS['float32']:
+        if column in df and pd.api.types.is_numeric_dtype(df[column]):
+            df[column] = df[column].astype(np.float32)
+    return df
+
+def concat_compact(frame: pd.DataFrame, rows: pd.DataFrame) -> pd.DataFrame:
+    """pd.concat that keeps categorical, string and narrow numeric columns
+    in their dtype instead of widening them to object/int64/float64"""
+    for column in frame.columns.intersection(rows.columns):
+        dtype = frame[column].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            new = pd.Index(rows[column].dropna().unique()).difference(dtype.categories)
+            if len(new):
+                frame[column] = frame[column].cat.add_categories(new)
+            rows[column] = pd.Categorical(rows[column], categories=frame[column].cat.categories)
+        elif isinstance(dtype, pd.StringDtype) or (dtype.kind in 'if' and rows[column].dtype.kind == dtype.kind):
+            rows[column] = rows[column].astype(dtype)
+    return pd.concat([frame, rows], ignore_index=True)
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+    except ImportError:
+        return None
+    return pyarrow
+
+def _cache_key(csv_path: str, read_kwargs: Dict) -> str:
+    """Identifies the source file version and how it was parsed"""
+    stat = os.stat(csv_path)
+    return json.dumps({
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'read_kwargs': read_kwargs,
+        'types': {k: CACHE_PARAMS[k] for k in ('categorical', 'timestamps', 'float32')}
+    }, sort_keys=True, default=str)
+
+def read_csv_cached(csv_path: str, **read_kwargs) -> pd.DataFrame:
+    """pd.read_csv backed by the columnar sidecar cache.
+
+    The sidecar is used only while the CSV's mtime and size (and the read
+    options) match what it was built from; otherwise the CSV is parsed and
+    the sidecar rebuilt. Either way the frame has the CACHE_PARAMS dtypes.
+    """
+    pa = _pyarrow() if CACHE_PARAMS['enabled'] else None
+    cache_path = csv_path + CACHE_PARAMS['suffix']
+    key = _cache_key(csv_path, read_kwargs)
+    
+    if pa is not None and os.path.exists(cache_path):
+        try:
+            table = pa.feather.read_table(cache_path, memory_map=CACHE_PARAMS['memory_map'])
+            if (table.schema.metadata or {}).get(b'source') == key.encode():
+                print(f"✅ Loaded {table.num_rows} rows from columnar cache {cache_path}")
+                return table.to_pandas(split_blocks=True)
+            print(f"ℹ️ Columnar cache {cache_path} is stale - reading CSV")
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable columnar cache {cache_path}: {e}")
+    
+    df = apply_column_types(pd.read_csv(csv_path, **read_kwargs))
+    if pa is not None:
+        write_columnar_cache(df, cache_path, key)
+    return df
+
+def write_columnar_cache(df: pd.DataFrame, cache_path: str, key: str):
+    """Write the sidecar atomically; failures only cost the next cold start"""
+    pa = _pyarrow()
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'source': key.encode()})
+        # Uncompressed so the file can be memory-mapped without decoding
+        pa.feather.write_feather(table, tmp_path, compression='uncompressed')
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        print(f"⚠️ Could not write columnar cache {cache_path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# ==================================================================
+# COMMUNITY DETECTION
+# ==================================================================
+COMMUNITY_PARAMS = {
+    'enabled': True,        # detect communities when there is no community JSON
+    'max_iterations': 30,
+    'min_size': 3,          # smaller groups are not reported
+    'max_size': 200,        # larger groups are ordinary traffic, not a ring
+    'min_cohesion': 0.4,    # share of members' transfer weight that stays inside the group
+    'resolution': 0.5,      # weight of the modularity penalty in label votes (0: plain label propagation)
+    'max_communities': 50,  # highest fraud rate first
+    'refresh_every': 500    # new edges buffered before an incremental refresh
+}
+
+class LabelPropagation:
+    """Weighted label propagation on a sparse, symmetric account graph.
+
+    The adjacency is a SciPy CSR matrix over AccountCodec ids, so a round
+    over millions of edges is a few vectorized array operations. New edges
+    are buffered and folded in by `refresh`, which re-propagates outwards
+    from the accounts they touch instead of starting over.
+
+    Card→merchant graphs are bipartite, where synchronous updates make the
+    two sides swap labels forever; senders and receivers therefore update
+    in alternate half-steps, each against the other side's fixed labels.
+    
+    Votes are modularity-corrected (LPAm): joining a label costs the
+    account's weight times the label's total weight over the graph's. Plain
+    label propagation lets the biggest label win every close vote, so on a
+    connected graph everything, rings included, ends up in one community
+    too large to report.
+    """
+
+    def __init__(self, params: Dict = COMMUNITY_PARAMS):
+        self.params = params
+        self.adjacency = None
+        self.labels = np.zeros(0, dtype=np.int64)
+        self.is_sender = np.zeros(0, dtype=bool)
+        self.degree = np.zeros(0, dtype=np.float64)
+        self.converged = True
+        self._pending: List[Tuple[int, int, float]] = []
+
+    @staticmethod
+    def _symmetric(senders, receivers, weights, n_nodes: int):
+        from scipy import sparse
+        matrix = sparse.coo_matrix(
+            (np.asarray(weights, dtype=np.float64),
+             (np.asarray(senders, dtype=np.int64), np.asarray(receivers, dtype=np.int64))),
+            shape=(n_nodes, n_nodes)
+        ).tocsr()  # repeat transfers are summed into one weight
+        return (matrix + matrix.T).tocsr()
+
+    def _update_degree(self):
+        self.degree = np.asarray(self.adjacency.sum(axis=1)).ravel()
+
+    def fit(self, senders, receivers, weights, n_nodes: int) -> np.ndarray:
+        """Label every account from scratch"""
+        self.adjacency = self._symmetric(senders, receivers, weights, n_nodes)
+        self.labels = np.arange(n_nodes, dtype=np.int64)
+        self.is_sender = np.zeros(n_nodes, dtype=bool)
+        self.is_sender[np.asarray(senders, dtype=np.int64)] = True
+        self._pending = []
+        self._update_degree()
+        self._propagate(np.ones(n_nodes, dtype=bool))
+        return self.labels
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def add_edge(self, sender: int, receiver: int, weight: float = 1.0):
+        self._pending.append((sender, receiver, weight))
+
+    def take_pending(self) -> List[tuple]:
+        """Hand over the buffered edges, e.g. to a refresh on another thread"""
+        pending, self._pending = self._pending, []
+        return pending
+
+    def refresh(self, n_nodes: int, edges: Optional[List[tuple]] = None) -> np.ndarray:
+        """Fold in the buffered edges (or `edges`) and re-propagate around them"""
+        edges = self.take_pending() if edges is None else edges
+        if not edges:
+            return self.labels
+        senders, receivers, weights = (np.array(column) for column in zip(*edges))
+        
+        if n_nodes > len(self.labels):
+            # Accounts seen for the first time start in their own community
+            self.adjacency.resize((n_nodes, n_nodes))
+            self.labels = np.concatenate([self.labels, np.arange(len(self.labels), n_nodes)])
+            self.is_sender = np.concatenate([self.is_sender, np.zeros(n_nodes - len(self.is_sender), dtype=bool)])
+        self.adjacency = (self.adjacency + self._symmetric(senders, receivers, weights, n_nodes)).tocsr()
+        self.is_sender[senders] = True
+        self._update_degree()
+        
+        dirty = np.zeros(n_nodes, dtype=bool)
+        dirty[senders] = True
+        dirty[receivers] = True
+        self._propagate(dirty)
+        return self.labels
+
+    def _propagate(self, dirty: np.ndarray):
+        """Move dirty accounts to their neighbours' heaviest label until stable"""
+        from scipy import sparse
+        adjacency, labels, n = self.adjacency, self.labels, len(self.labels)
+        degree, total = self.degree, max(self.degree.sum(), 1.0)
+        resolution = self.params['resolution']
+        for step in range(2 * self.params['max_iterations']):
+            if not dirty.any():
+                break
+            movers = np.flatnonzero(dirty & (self.is_sender == (step % 2 == 0)))
+            if not len(movers):
+                continue
+            dirty[movers] = False
+            
+            # Re-key each mover's neighbours by label; summing duplicates
+            # gives the total edge weight per (mover, label)
+            rows = adjacency[movers]
+            votes = sparse.csr_matrix((rows.data, labels[rows.indices], rows.indptr), shape=(len(movers), n))
+            votes.sum_duplicates()
+            owner = np.repeat(np.arange(len(movers)), np.diff(votes.indptr))
+            current = votes.indices == labels[movers][owner]
+            
+            # Modularity penalty: the mover's weight times the label's weight
+            # (without the mover itself), shifted by the mover's weight so
+            # every candidate stays positive for the sparse argmax
+            label_weight = np.bincount(labels, weights=degree, minlength=n)[votes.indices]
+            mover_weight = degree[movers][owner]
+            votes.data += mover_weight - resolution * mover_weight * (label_weight - current * mover_weight) / total
+            votes.data += current * 1e-6 * mover_weight  # near-ties keep the current label
+            
+            has_edges = np.diff(votes.indptr) > 0
+            nodes = movers[has_edges]
+            new = np.asarray(votes.argmax(axis=1)).ravel()[has_edges]
+            changed = nodes[new != labels[nodes]]
+            labels[nodes] = new
+            if len(changed):
+                dirty[adjacency[changed].indices] = True
+        
+        self.converged = not dirty.any()
+        if not self.converged:
+            print(f"⚠️ Label propagation stopped after {self.params['max_iterations']} rounds "
+                  f"with {int(dirty.sum())} accounts still changing")
+
+    def groups(self) -> Dict[int, np.ndarray]:
+        """Account ids per label, skipping accounts without any edge"""
+        nodes = np.flatnonzero(np.diff(self.adjacency.indptr))
+        if not len(nodes):
+            return {}
+        nodes = nodes[np.argsort(self.labels[nodes], kind='stable')]
+        labels = self.labels[nodes]
+        starts = np.r_[0, np.flatnonzero(np.diff(labels)) + 1]
+        return {int(labels[start]): members for start, members in zip(starts, np.split(nodes, starts[1:]))}
+
+    def cohesion(self) -> np.ndarray:
+        """Per label, the share of its members' edge weight that stays inside it"""
+        coo = self.adjacency.tocoo()
+        source = self.labels[coo.row]
+        inside = np.bincount(source, weights=coo.data * (source == self.labels[coo.col]), minlength=len(self.labels))
+        total = np.bincount(source, weights=coo.data, minlength=len(self.labels))
+        return np.divide(inside, total, out=np.zeros_like(inside), where=total > 0)
+
+
 # ==================================================================
 # SMURFING DETECTION CONFIGURATION
 # ==================================================================
@@ -39,6 +461,11 @@ STRUCTURING_PARAMS = {
     'min_total_amount': 3000
 }
 
+def to_timestamp(value) -> pd.Timestamp:
+    """Parse one transaction time; NaT (not None) when missing or unparseable"""
+    timestamp = pd.to_datetime(value, errors='coerce')
+    return pd.NaT if timestamp is None or pd.isna(timestamp) else timestamp
+
 
 # ==================================================================
 # SMURFING DETECTOR CLASS
@@ -54,13 +481,448 @@ SMURFING_PARAMS = {
     'high_risk_merchants': ['electronics', 'jewelry', 'crypto']
 }
 
+class AccountCodec:
+    """Interns account and merchant names as dense integer ids.
+
+    Frames, the graph and the per-account indexes work on the ids; names
+    are decoded only when a result is returned to the caller.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def encode(self, name) -> int:
+        """Id for `name`, assigning the next one if it is new"""
+        name = str(name)
+        code = self._ids.get(name)
+        if code is None:
+            code = self._ids[name] = len(self._names)
+            self._names.append(name)
+        return code
+
+    def encode_many(self, names) -> List[int]:
+        return [self.encode(name) for name in names]
+
+    def encode_series(self, values: pd.Series) -> np.ndarray:
+        """Vectorized encode of a column without missing values; only the
+        distinct values go through the dict"""
+        codes, uniques = pd.factorize(values)
+        ids = np.fromiter((self.encode(u) for u in uniques), dtype=np.int32, count=len(uniques))
+        return ids[codes]
+
+    def decode(self, code) -> str:
+        return self._names[code]
+
+    def decode_many(self, codes) -> List[str]:
+        return [self._names[code] for code in codes]
+
+
+class AccountHistory:
+    """Per-account transaction history kept sorted by time.
+
+    Window lookups bisect the timestamp list, so a query costs
+    O(log n + window) instead of a scan over the whole frame. Accounts and
+    counterparties are AccountCodec ids.
+    """
+
+    def __init__(self):
+        self._times: Dict[int, List[int]] = {}
+        self._amounts: Dict[int, List[float]] = {}
+        self._counterparties: Dict[int, List[int]] = {}
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, key_col: str, counterparty_col: str) -> 'AccountHistory':
+        """Bulk-build from a transaction frame (rows without a time are skipped)"""
+        history = cls()
+        frame = df.dropna(subset=[key_col, 'DateTime'])
+        if frame.empty:
+            return history
+        
+        codes, keys = pd.factorize(frame[key_col])
+        keys = np.asarray(keys).tolist()
+        times = frame['DateTime'].values.astype('datetime64[ns]').astype(np.int64)
+        order = np.lexsort((times, codes))
+        codes, times = codes[order], times[order]
+        amounts = frame['Amount'].to_numpy(dtype=np.float64)[order]
+        counterparties = frame[counterparty_col].to_numpy()[order]
+        
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(codes)) + 1, [len(codes)]))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            key = keys[codes[start]]
+            history._times[key] = times[start:end].tolist()
+            history._amounts[key] = amounts[start:end].tolist()
+            history._counterparties[key] = counterparties[start:end].tolist()
+        return history
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._times
+
+    def add(self, key: int, time_ns: int, amount: float, counterparty: int):
+        """Insert one transaction, keeping the time order"""
+        times = self._times.setdefault(key, [])
+        pos = bisect.bisect_right(times, time_ns)
+        times.insert(pos, time_ns)
+        self._amounts.setdefault(key, []).insert(pos, amount)
+        self._counterparties.setdefault(key, []).insert(pos, counterparty)
+
+    def window(self, key: int, start_ns: int, end_ns: int, include_end: bool = True):
+        """Times, amounts and counterparties with start_ns <= time <= end_ns
+        (or time < end_ns when include_end is False)"""
+        times = self._times.get(key)
+        if not times:
+            return [], [], []
+        lo = bisect.bisect_left(times, start_ns)
+        hi = (bisect.bisect_right if include_end else bisect.bisect_left)(times, end_ns)
+        return times[lo:hi], self._amounts[key][lo:hi], self._counterparties[key][lo:hi]
+
+
+class StructuringScan:
+    """Transaction_Splitting stats for every sender in one pass.
+
+    Takes the latest transfer on each sender→receiver edge, lays the edges
+    out CSR-style (sorted by sender, receivers in first-seen order) and
+    computes split count, min/max/total amount and time window per sender
+    with segmented reductions, so no account is visited in Python unless
+    it is flagged. `update` folds a new transfer into its sender's segment
+    only, so the scan survives writes without being rebuilt.
+    """
+
+    def __init__(self, senders: np.ndarray, receivers: np.ndarray, amounts: np.ndarray,
+                 times_ns: np.ndarray, params: Dict = STRUCTURING_PARAMS):
+        self.params = params
+        order = np.argsort(senders, kind='stable')
+        senders, self.receivers = senders[order], receivers[order]
+        self.amounts, self.times = amounts[order], times_ns[order]
+        self._edges: Dict[int, Dict[int, tuple]] = {}
+        self._updated: Dict[int, tuple] = {}
+        
+        starts = np.flatnonzero(np.r_[True, senders[1:] != senders[:-1]]) if len(senders) else np.zeros(0, dtype=np.int64)
+        self.accounts = senders[starts]
+        self.indptr = np.r_[starts, len(senders)]
+        self.split_count = np.diff(self.indptr)
+        if not len(starts):
+            self.flagged = np.zeros(0, dtype=bool)
+            return
+        
+        (self.total, self.min_amount, self.max_amount,
+         self.window_hours, self.flagged) = self._segment_stats(self.amounts, self.times, starts, self.split_count)
+
+    def _segment_stats(self, amounts: np.ndarray, times: np.ndarray, starts: np.ndarray, split_count: np.ndarray):
+        """Total, min, max, window and flag per segment"""
+        params = self.params
+        total = np.add.reduceat(amounts, starts)
+        min_amount = np.minimum.reduceat(amounts, starts)
+        max_amount = np.maximum.reduceat(amounts, starts)
+        missing_time = np.logical_or.reduceat(times == np.iinfo(np.int64).min, starts)
+        window_hours = (np.maximum.reduceat(times, starts) - np.minimum.reduceat(times, starts)) / 3.6e12
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = max_amount / min_amount
+        flagged = (
+            (split_count >= params['min_split']) &
+            ~missing_time &
+            (window_hours < params['max_time_window']) &
+            (min_amount != 0) &
+            (ratio < params['amount_variation']) &
+            (total > params['min_total_amount'])
+        )
+        return total, min_amount, max_amount, window_hours, flagged
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, params: Dict = STRUCTURING_PARAMS) -> 'StructuringScan':
+        """Latest transfer per edge, as the graph's `amount`/`timestamp` hold them"""
+        senders = df['Sender_account'].to_numpy(dtype=np.int64)
+        receivers = df['Receiver_account'].to_numpy(dtype=np.int64)
+        width = int(receivers.max()) + 1 if len(receivers) else 1
+        edge_ids, edges = pd.factorize(senders * width + receivers)
+        last = np.full(len(edges), -1, dtype=np.int64)
+        np.maximum.at(last, edge_ids, np.arange(len(edge_ids)))
+        
+        edges = np.asarray(edges, dtype=np.int64)
+        return cls(
+            edges // width, edges % width,
+            df['Amount'].to_numpy(dtype=np.float64)[last],
+            df['DateTime'].to_numpy(dtype='datetime64[ns]').view(np.int64)[last],
+            params
+        )
+
+    def _position(self, account: int) -> int:
+        """Index of `account` in the CSR layout, or -1"""
+        i = int(np.searchsorted(self.accounts, account))
+        return i if i < len(self.accounts) and self.accounts[i] == account else -1
+
+    def update(self, sender: int, receiver: int, amount: float, time_ns: int):
+        """Make (amount, time_ns) the latest transfer on sender→receiver.
+
+        Only the sender's own edges are re-reduced; missing times are
+        passed as the NaT sentinel, as `from_frame` stores them.
+        """
+        edges = self._edges.get(sender)
+        if edges is None:
+            edges = {}
+            i = self._position(sender)
+            if i >= 0:
+                lo, hi = self.indptr[i], self.indptr[i + 1]
+                edges = dict(zip(self.receivers[lo:hi].tolist(),
+                                 zip(self.amounts[lo:hi].tolist(), self.times[lo:hi].tolist())))
+            self._edges[sender] = edges
+        edges[receiver] = (float(amount), int(time_ns))
+        
+        amounts = np.fromiter((a for a, _ in edges.values()), dtype=np.float64, count=len(edges))
+        times = np.fromiter((t for _, t in edges.values()), dtype=np.int64, count=len(edges))
+        stats = self._segment_stats(amounts, times, np.zeros(1, dtype=np.int64), np.array([len(edges)]))
+        self._updated[sender] = (len(edges),) + tuple(stat[0] for stat in stats)
+
+    def cases(self, members: List[int], decode=str) -> List[Dict]:
+        """Cases for the flagged members, in member order"""
+        keys = np.asarray(members, dtype=np.int64)
+        pos = np.searchsorted(self.accounts, keys)
+        pos[pos >= len(self.accounts)] = 0
+        hit = (self.accounts[pos] == keys) & self.flagged[pos] if len(self.accounts) else np.zeros(len(keys), dtype=bool)
+        if self._updated:
+            hit |= np.fromiter((k in self._updated for k in keys.tolist()), dtype=bool, count=len(keys))
+        
+        cases = []
+        for account, i in zip(keys[hit].tolist(), pos[hit].tolist()):
+            if account in self._updated:
+                split_count, total, min_amount, max_amount, window_hours, flagged = self._updated[account]
+                receivers = list(self._edges[account])
+            else:
+                split_count, total, min_amount, max_amount, window_hours, flagged = (
+                    self.split_count[i], self.total[i], self.min_amount[i],
+                    self.max_amount[i], self.window_hours[i], self.flagged[i]
+                )
+                receivers = self.receivers[self.indptr[i]:self.indptr[i + 1]].tolist()
+            if not flagged:
+                continue
+            
+            total = float(total)
+            cases.append({
+                "pattern_type": "Transaction_Splitting",
+                "main_account": decode(account),
+                "split_count": int(split_count),
+                "total_amount": total,
+                "time_window_hours": round(float(window_hours), 2),
+                "amount_range": f"{min_amount:.2f}-{max_amount:.2f}",
+                "destination_accounts": [decode(r) for r in receivers],
+                "suspicion_score": min(100, round((total/self.params['min_total_amount'])*20))
+            })
+        return cases
+
+
+class SmurfingStream:
+    """Sliding-window Classic_Smurfing detector.
+
+    Keeps, per receiver, a time-ordered deque of the transfers inside
+    `max_time_window` together with running totals and a distinct-sender
+    counter, so each incoming transaction is checked in O(1) amortized time.
+    A burst is reported once, as the largest window seen while it lasted.
+    The burst still growing is kept as bounds into the receiver's push log
+    (end sequence number and eviction cutoff) and only copied out once it
+    can no longer grow, so a qualifying push never copies the window.
+    Accounts are AccountCodec ids; `decode` turns them back into names
+    when a case is formatted.
+    """
+
+    def __init__(self, params: Dict = SMURFING_PARAMS, decode=str):
+        self.params = params
+        self.decode = decode
+        self.window_ns = int(params['max_time_window'] * 3600 * 1e9)
+        self._windows: Dict[int, deque] = {}
+        self._senders: Dict[int, Counter] = {}
+        self._totals: Dict[int, float] = {}
+        self._oversized: Dict[int, int] = {}
+        # Push log per receiver: (time, sender, amount) and the running max time,
+        # trimmed from the front; `_log_base` is the sequence number of entry 0
+        self._log: Dict[int, List[tuple]] = {}
+        self._log_latest: Dict[int, List[int]] = {}
+        self._log_base: Dict[int, int] = {}
+        # Growing burst per receiver: (end seq, cutoff, transaction count, last time);
+        # `cases` holds the bursts already copied out
+        self._open: Dict[int, tuple] = {}
+        self.cases: Dict[int, List[tuple]] = {}
+
+    @classmethod
+    def replay(cls, df: pd.DataFrame, params: Dict = SMURFING_PARAMS, decode=str) -> 'SmurfingStream':
+        """Feed a transaction frame through the stream in time order"""
+        stream = cls(params, decode)
+        frame = df.dropna(subset=['Sender_account', 'Receiver_account', 'DateTime'])
+        frame = frame.sort_values('DateTime', kind='stable')
+        for receiver, sender, time_ns, amount in zip(
+                frame['Receiver_account'].tolist(),
+                frame['Sender_account'].tolist(),
+                frame['DateTime'].values.astype('datetime64[ns]').astype(np.int64).tolist(),
+                frame['Amount'].astype(float).tolist()):
+            stream.push(receiver, sender, time_ns, amount)
+        return stream
+
+    def _evict(self, receiver: int, now_ns: int):
+        window = self._windows[receiver]
+        senders = self._senders[receiver]
+        while window and window[0][0] < now_ns - self.window_ns:
+            _, sender, amount = window.popleft()
+            self._totals[receiver] -= amount
+            if amount >= self.params['max_amount']:
+                self._oversized[receiver] -= 1
+            senders[sender] -= 1
+            if not senders[sender]:
+                del senders[sender]
+
+    def _qualifies(self, count: int, distinct_senders: int, oversized: int) -> bool:
+        return (count >= self.params['min_transactions'] and
+                oversized == 0 and
+                distinct_senders >= self.params['min_senders'])
+
+    def push(self, receiver: int, sender: int, time_ns: int, amount: float) -> Optional[Dict]:
+        """Add a transaction; returns the Classic_Smurfing case it completes, if any"""
+        if receiver not in self._windows:
+            self._windows[receiver] = deque()
+            self._senders[receiver] = Counter()
+            self._totals[receiver] = 0.0
+            self._oversized[receiver] = 0
+            self._log[receiver] = []
+            self._log_latest[receiver] = []
+            self._log_base[receiver] = 0
+        window = self._windows[receiver]
+        
+        latest = max(time_ns, window[-1][0]) if window else time_ns
+        self._evict(receiver, latest)
+        if window and time_ns < window[-1][0]:
+            # Late arrival: keep the deque time-ordered, drop it if already expired
+            if time_ns < window[-1][0] - self.window_ns:
+                return None
+            pos = bisect.bisect_right([entry[0] for entry in window], time_ns)
+            window.insert(pos, (time_ns, sender, amount))
+        else:
+            window.append((time_ns, sender, amount))
+        self._totals[receiver] += amount
+        self._senders[receiver][sender] += 1
+        if amount >= self.params['max_amount']:
+            self._oversized[receiver] += 1
+        log = self._log[receiver]
+        log.append((time_ns, sender, amount))
+        self._log_latest[receiver].append(latest)
+        cutoff = latest - self.window_ns
+        
+        case = None
+        if self._qualifies(len(window), len(self._senders[receiver]), self._oversized[receiver]):
+            # A burst keeps its largest window; only its bounds are stored
+            bounds = (self._log_base[receiver] + len(log), cutoff, len(window), latest)
+            burst = self._open.get(receiver)
+            if burst is not None and burst[3] >= window[0][0]:
+                if len(window) >= burst[2]:
+                    self._open[receiver] = bounds
+            else:
+                self._close(receiver)
+                self.cases.setdefault(receiver, [])
+                self._open[receiver] = bounds
+                case = self._case(receiver, *self._snapshot(receiver, *bounds[:2]))
+        if len(log) > 2 * len(window) + 64:
+            self._trim(receiver, cutoff)
+        return case
+
+    def _snapshot(self, receiver: int, end: int, cutoff: int) -> tuple:
+        """(entries, senders) of the window that ended at push `end` with eviction `cutoff`"""
+        log, base = self._log[receiver], self._log_base[receiver]
+        # A transfer pushed while the running max time was below the cutoff can't be in the window
+        start = bisect.bisect_left(self._log_latest[receiver], cutoff)
+        entries = sorted((entry for entry in log[start:end - base] if entry[0] >= cutoff),
+                         key=lambda entry: entry[0])
+        senders = tuple(dict.fromkeys(entry[1] for entry in log[start:end - base] if entry[0] >= cutoff))
+        return tuple(entries), senders
+
+    def _close(self, receiver: int):
+        """Copy the open burst of `receiver` out of the log into `cases`"""
+        burst = self._open.pop(receiver, None)
+        if burst is not None:
+            self.cases[receiver].append(self._snapshot(receiver, *burst[:2]))
+
+    def _trim(self, receiver: int, cutoff: int):
+        """Drop log entries no open burst or future window can contain"""
+        burst = self._open.get(receiver)
+        if burst is not None and burst[3] < cutoff:
+            # Nothing later can join a burst that ended before the cutoff
+            self._close(receiver)
+            burst = None
+        keep = bisect.bisect_left(self._log_latest[receiver], burst[1] if burst is not None else cutoff)
+        del self._log[receiver][:keep]
+        del self._log_latest[receiver][:keep]
+        self._log_base[receiver] += keep
+
+    def peek(self, receiver: int, sender: Optional[int], time_ns: int, amount: float) -> Optional[Dict]:
+        """The case the transaction would complete, without recording it"""
+        window = self._windows.get(receiver) or ()
+        latest = max(time_ns, window[-1][0]) if window else time_ns
+        if time_ns < latest - self.window_ns:
+            return None
+        # Same eviction and ordering as push, on a copy: the stored window is untouched
+        entries = [entry for entry in window if entry[0] >= latest - self.window_ns]
+        entries.insert(bisect.bisect_right([entry[0] for entry in entries], time_ns), (time_ns, sender, amount))
+        senders = list(dict.fromkeys(entry[1] for entry in entries if entry[1] is not None))
+        oversized = sum(entry[2] >= self.params['max_amount'] for entry in entries)
+        
+        if not self._qualifies(len(entries), len(senders), oversized):
+            return None
+        return self._case(receiver, entries, senders)
+
+    def _case(self, receiver: int, entries, senders) -> Dict:
+        times = [entry[0] for entry in entries]
+        amounts = [entry[2] for entry in entries]
+        first, last = pd.Timestamp(min(times)), pd.Timestamp(max(times))
+        return {
+            "pattern_type": "Classic_Smurfing",
+            "receiver": self.decode(receiver),
+            "transaction_count": len(entries),
+            "total_amount": sum(amounts),
+            "time_window_hours": round((last - first).total_seconds()/3600, 2),
+            "average_amount": round(np.mean(amounts), 2),
+            "senders": [self.decode(s) for s in senders],
+            "first_transaction": first.strftime("%Y-%m-%d %H:%M"),
+            "last_transaction": last.strftime("%Y-%m-%d %H:%M"),
+            "suspicion_score": min(100, round((sum(amounts)/self.params['max_amount'])*100))
+        }
+
+    def window_size(self, receiver: int) -> int:
+        return len(self._windows.get(receiver, ()))
+
+    def all_cases(self, receivers: Optional[set] = None) -> List[Dict]:
+        """Recorded cases, optionally only for some receivers"""
+        cases = []
+        for receiver, snapshots in self.cases.items():
+            if receivers is not None and receiver not in receivers:
+                continue
+            if receiver in self._open:
+                snapshots = [*snapshots, self._snapshot(receiver, *self._open[receiver][:2])]
+            cases.extend(self._case(receiver, entries, senders) for entries, senders in snapshots)
+        return cases
+
+
 class SmurfingDetector:
     def __init__(self, csv_file_path: str, json_file_path: Optional[str] = None):
         self.csv_file_path = csv_file_path
         self.json_file_path = json_file_path
-        self.df = None
+        self._df = None
+        self._tail = []
+        self._sender_last_time = {}
+        self._lock = threading.RLock()
         self.graph = None
         self.community_data = None
+        self.accounts = AccountCodec()
+        self._community_member_ids: Dict[str, List[int]] = {}
+        self._account_communities: Dict[int, List[str]] = {}
+        self._community_rows: Dict[str, List[int]] = {}
+        self._community_results: Dict[str, Dict] = {}
+        self._streaming_results = None
+        self.label_propagation = None
+        self._refresh_thread = None
+        self._structuring_scan = None
+        self._added_ids = TTLCache(IDEMPOTENCY_PARAMS['max_entries'], IDEMPOTENCY_PARAMS['ttl'])
+        self.smurfing_stream = SmurfingStream(decode=self.accounts.decode)
+        self._sender_history = AccountHistory()
         self._initialize()
 
     def _initialize(self):
@@ -70,7 +932,10 @@ class SmurfingDetector:
             if self.df is not None:
                 print("✅ Data loaded successfully")
                 self.graph = self._build_transaction_graph()
+                self.smurfing_stream = SmurfingStream.replay(self.df, decode=self.accounts.decode)
+                self._sender_history = AccountHistory.from_frame(self.df, 'Sender_account', 'Receiver_account')
                 self.community_data = self._load_community_data()
+                self._index_communities()
         except Exception as e:
             print(f"🚨 Initialization failed: {str(e)}")
 
@@ -88,7 +953,7 @@ class SmurfingDetector:
                 'transactionId': 'str'
             }
             
-            df = pd.read_csv(
+            df = read_csv_cached(
                 self.csv_file_path,
                 dtype=dtype_spec,
                 parse_dates=['trans_date_trans_time'],
@@ -106,7 +971,8 @@ class SmurfingDetector:
                 'DateTime': df.get('trans_date_trans_time'),
                 'Sender_bank_location': df.get('state', 'unknown'),
                 'Receiver_bank_location_lat': df.get('merch_lat', 0.0),
-                'Payment_type': df.get('category', 'unknown')
+                'Payment_type': df.get('category', 'unknown'),
+                'Is_fraud': df.get('is_fraud', 0)
             })
 
             # Type conversion and validation
@@ -127,39 +993,243 @@ class SmurfingDetector:
                 '|'.join(SMURFING_PARAMS['high_risk_merchants'])
             ).astype(int)
 
-            return processed_df.dropna(subset=['Sender_account', 'Receiver_account', 'Amount'])
+            processed_df = processed_df.dropna(subset=['Sender_account', 'Receiver_account', 'Amount'])
+            
+            # Accounts and merchants are integer ids from here on; names are
+            # decoded only in results
+            for column in ('Sender_account', 'Receiver_account'):
+                processed_df[column] = self.accounts.encode_series(processed_df[column])
+            for column in ('Sender_bank_location', 'Payment_type'):
+                processed_df[column] = processed_df[column].astype('category')
+            processed_df['HighRiskMerchant'] = processed_df['HighRiskMerchant'].astype(np.int8)
+            processed_df['Is_fraud'] = pd.to_numeric(processed_df['Is_fraud'], errors='coerce').fillna(0).astype(np.int8)
+            if _pyarrow() is not None:
+                # One Arrow buffer instead of a Python object per id
+                processed_df['Transaction_ID'] = processed_df['Transaction_ID'].astype('string[pyarrow]')
+            return processed_df.reset_index(drop=True)
 
         except Exception as e:
             print(f"🚨 Data loading failed: {str(e)}")
             return None
 
-    def _build_transaction_graph(self) -> nx.DiGraph:
-        """Build transaction graph with amount and temporal patterns"""
+    def _index_communities(self):
+        """Build the account→community index and each community's row positions.
+
+        Both are kept current by `_record_transaction`, so `detect_smurfing`
+        never scans the whole frame per community. Cached results survive
+        for communities whose members did not change.
+        """
+        df = self.df
+        index = self._build_community_index(self.community_data, df['Sender_account'].to_numpy(),
+                                            df['Receiver_account'].to_numpy())
+        self._install_community_index(self.community_data, *index)
+
+    def _build_community_index(self, community_data: Dict, senders: np.ndarray, receivers: np.ndarray):
+        """(member ids, account→communities, row positions) for the given rows"""
+        member_ids = {
+            str(comm_id): self.accounts.encode_many(comm_data.get('Members', []))
+            for comm_id, comm_data in community_data.get('fraud_communities', {}).items()
+        }
+        account_communities = {}
+        for comm_id, members in member_ids.items():
+            for member in dict.fromkeys(members):
+                account_communities.setdefault(member, []).append(comm_id)
+        
+        # (row, community) hits for either party in one join instead of an isin per community
+        pairs = pd.DataFrame(
+            [(member, comm_id) for member, comm_ids in account_communities.items() for comm_id in comm_ids],
+            columns=['account', 'community_id']
+        )
+        parties = pd.DataFrame({
+            'account': np.concatenate([senders, receivers]),
+            'row': np.tile(np.arange(len(senders)), 2)
+        })
+        hits = parties.merge(pairs, on='account').drop_duplicates(['community_id', 'row']).sort_values('row')
+        rows = {comm_id: group.tolist() for comm_id, group in hits.groupby('community_id')['row']}
+        return member_ids, account_communities, {comm_id: rows.get(comm_id, []) for comm_id in member_ids}
+
+    def _install_community_index(self, community_data: Dict, member_ids: Dict, account_communities: Dict,
+                                 rows: Dict):
+        """Swap in a new index; cached results survive where members are unchanged"""
+        previous_members = self._community_member_ids
+        self.community_data = community_data
+        self._community_member_ids = member_ids
+        self._account_communities = account_communities
+        self._community_rows = rows
+        self._community_results = {
+            comm_id: result for comm_id, result in self._community_results.items()
+            if previous_members.get(comm_id) == member_ids.get(comm_id)
+        }
+
+    def row_count(self) -> int:
+        """Number of transactions, without folding in the pending tail"""
+        return (0 if self._df is None else len(self._df)) + len(self._tail)
+
+    @property
+    def df(self) -> Optional[pd.DataFrame]:
+        """Transaction frame; rows added since the last access are folded in lazily"""
+        with self._lock:
+            if self._tail:
+                tail, self._tail = self._tail, []
+                new_rows = pd.DataFrame(tail)
+                self._df = new_rows if self._df is None else concat_compact(self._df, new_rows)
+            return self._df
+
+    @df.setter
+    def df(self, df: Optional[pd.DataFrame]):
+        self._df = df
+
+    def _build_transaction_graph(self) -> 'nx.DiGraph':
+        """Build transaction graph with amount and temporal patterns.
+
+        Repeat sender→receiver transfers are aggregated onto one edge
+        (count, total/min/max amount, first/last time); `amount`, `timestamp`,
+        `time_diff` and `payment_type` describe the latest transfer.
+        """
+        import networkx as nx
         G = nx.DiGraph()
         
-        for _, row in self.df.iterrows():
-            try:
-                sender = str(row['Sender_account'])
-                receiver = str(row['Receiver_account'])
-                
-                G.add_node(sender, type='account', 
-                          bank=row.get('Sender_bank_location', 'unknown'))
-                G.add_node(receiver, type='merchant', 
-                          risk=row.get('HighRiskMerchant', 0))
-                
-                G.add_edge(sender, receiver,
-                          amount=float(row['Amount']),
-                          timestamp=row['DateTime'],
-                          time_diff=float(row['TimeSinceLastTx']),
-                          payment_type=row.get('Payment_type', 'unknown'))
-            except Exception as e:
-                continue
-                
+        df = self.df
+        senders = df.groupby('Sender_account', sort=False)['Sender_bank_location'].last()
+        receivers = df.groupby('Receiver_account', sort=False)['HighRiskMerchant'].last()
+        G.add_nodes_from((node, {'type': 'account', 'bank': bank}) for node, bank in senders.items())
+        G.add_nodes_from((node, {'type': 'merchant', 'risk': int(risk)}) for node, risk in receivers.items())
+        
+        edges = df.groupby(['Sender_account', 'Receiver_account'], sort=False).agg(
+            count=('Amount', 'size'),
+            total_amount=('Amount', 'sum'),
+            min_amount=('Amount', 'min'),
+            max_amount=('Amount', 'max'),
+            first_time=('DateTime', 'min'),
+            last_time=('DateTime', 'max'),
+            amount=('Amount', 'last'),
+            timestamp=('DateTime', 'last'),
+            time_diff=('TimeSinceLastTx', 'last'),
+            payment_type=('Payment_type', 'last')
+        )
+        G.add_edges_from(
+            (sender, receiver, attrs)
+            for (sender, receiver), attrs in zip(edges.index, edges.to_dict('records'))
+        )
+        
+        self._sender_last_time = df.groupby('Sender_account', sort=False)['DateTime'].max().to_dict()
+        
         print(f"✅ Built graph with {G.number_of_nodes()} nodes and {G.number_of_edges()} edges")
         return G
 
+    def add_transaction(self, transaction: Dict) -> bool:
+        """Record a new transaction in the graph and frame without a rebuild"""
+        if self.graph is None:
+            return False
+        
+        sender = transaction.get('Sender_account')
+        receiver = transaction.get('Receiver_account')
+        if sender is None or receiver is None or pd.isna(sender) or pd.isna(receiver):
+            return False
+        
+        # Parse everything up front: nothing below may fail half-way through
+        # the graph, window and frame updates
+        amount = float(pd.to_numeric(transaction.get('Amount', 0), errors='coerce') or 0)
+        timestamp = to_timestamp(transaction.get('DateTime'))
+        payment_type = transaction.get('Payment_type', 'unknown')
+        is_fraud = pd.to_numeric(transaction.get('Is_fraud'), errors='coerce')
+        is_fraud = 0 if is_fraud is None or pd.isna(is_fraud) else int(is_fraud)
+        txn_id = transaction.get('Transaction_ID')
+        if txn_id is not None and pd.isna(txn_id):
+            txn_id = None
+        
+        with self._lock:
+            # A retried transaction is already in the graph and windows
+            if txn_id is not None and txn_id in self._added_ids:
+                print(f"♻️ Transaction {txn_id} already recorded, not adding it again")
+                return False
+            sender, receiver = self.accounts.encode(sender), self.accounts.encode(receiver)
+            self._record_transaction(sender, receiver, amount, timestamp, payment_type, is_fraud, transaction)
+            if txn_id is not None:
+                self._added_ids.set(txn_id, True)
+        return True
+
+    def _record_transaction(self, sender: int, receiver: int, amount: float, timestamp: pd.Timestamp,
+                            payment_type: str, is_fraud: int, transaction: Dict):
+        """Apply one transaction to the graph, histories and frame tail.
+        `timestamp` is NaT (never None) when the time is unknown."""
+        if not pd.isna(timestamp):
+            case = self.smurfing_stream.push(receiver, sender, timestamp.value, amount)
+            if case:
+                print(f"🚩 Classic smurfing burst into {case['receiver']}: "
+                      f"{case['transaction_count']} transfers from {len(case['senders'])} senders")
+            self._sender_history.add(sender, timestamp.value, amount, receiver)
+        
+        last_time = self._sender_last_time.get(sender)
+        time_diff = 0.0
+        if last_time is not None and not pd.isna(last_time) and not pd.isna(timestamp):
+            time_diff = (timestamp - last_time).total_seconds()
+        if not pd.isna(timestamp) and (last_time is None or pd.isna(last_time) or timestamp > last_time):
+            self._sender_last_time[sender] = timestamp
+        
+        receiver_name = self.accounts.decode(receiver).lower()
+        high_risk = int(any(term in receiver_name for term in SMURFING_PARAMS['high_risk_merchants']))
+        if sender not in self.graph:
+            self.graph.add_node(sender, type='account',
+                                bank=transaction.get('Sender_bank_location', 'unknown'))
+        if receiver not in self.graph:
+            self.graph.add_node(receiver, type='merchant', risk=high_risk)
+        
+        edge = self.graph.get_edge_data(sender, receiver)
+        if edge is None:
+            self.graph.add_edge(sender, receiver,
+                                count=1, total_amount=amount,
+                                min_amount=amount, max_amount=amount,
+                                first_time=timestamp, last_time=timestamp,
+                                amount=amount, timestamp=timestamp,
+                                time_diff=time_diff, payment_type=payment_type)
+        else:
+            edge['count'] += 1
+            edge['total_amount'] += amount
+            edge['min_amount'] = min(edge['min_amount'], amount)
+            edge['max_amount'] = max(edge['max_amount'], amount)
+            if not pd.isna(timestamp):
+                edge['first_time'] = timestamp if pd.isna(edge['first_time']) else min(edge['first_time'], timestamp)
+                edge['last_time'] = timestamp if pd.isna(edge['last_time']) else max(edge['last_time'], timestamp)
+            edge.update(amount=amount, timestamp=timestamp,
+                        time_diff=time_diff, payment_type=payment_type)
+        
+        # Only communities containing either party see a new row
+        row = self.row_count()
+        for comm_id in dict.fromkeys(self._account_communities.get(sender, []) +
+                                     self._account_communities.get(receiver, [])):
+            self._community_rows[comm_id].append(row)
+            self._community_results.pop(comm_id, None)
+        self._streaming_results = None
+        if self._structuring_scan is not None:
+            self._structuring_scan.update(sender, receiver, amount, timestamp.value)
+        
+        self._tail.append({
+            'Sender_account': sender,
+            'Receiver_account': receiver,
+            'Amount': amount,
+            'Transaction_ID': transaction.get('Transaction_ID'),
+            'DateTime': timestamp,
+            'Sender_bank_location': transaction.get('Sender_bank_location', 'unknown'),
+            'Receiver_bank_location_lat': transaction.get('Receiver_bank_location_lat', 0.0),
+            'Payment_type': payment_type,
+            'TimeSinceLastTx': time_diff,
+            'HighRiskMerchant': high_risk,
+            'Is_fraud': is_fraud
+        })
+        
+        if self.label_propagation is not None:
+            self.label_propagation.add_edge(sender, receiver)
+            if self.label_propagation.pending >= COMMUNITY_PARAMS['refresh_every']:
+                self._start_community_refresh()
+
     def detect_smurfing_enhanced(self, transaction: Dict) -> List[Dict]:
-        """Enhanced detection with columns matching your CSV"""
+        """Score one candidate transaction against the precomputed account state.
+
+        The candidate is never added to `self.df`; it is compared with the
+        receiver's and sender's recent history, and only communities that
+        contain either party are reported.
+        """
         # Required fields based on your CSV columns
         required_fields = ['Amount']
         missing_fields = [field for field in required_fields if field not in transaction]
@@ -169,38 +1239,31 @@ class SmurfingDetector:
 
         try:
             # Convert to proper types
-            # trans_time = pd.to_datetime(transaction['trans_date_trans_time'])
             amount = float(transaction['Amount'])
-            # card_num = str(transaction['cardNum'])
-            # merchant = str(transaction['merchant'])
+            trans_time = pd.to_datetime(transaction.get('DateTime'), errors='coerce')
+            if pd.isna(trans_time):
+                trans_time = pd.Timestamp.now()
+            sender = transaction.get('Sender_account')
+            receiver = transaction.get('Receiver_account')
+            has_sender = sender is not None and not pd.isna(sender)
+            has_receiver = receiver is not None and not pd.isna(receiver)
 
-            # Store original data
-            original_df = self.df.copy() if self.df is not None else None
-            
             try:
-                # Create new transaction record matching CSV structure
-                new_txn = pd.DataFrame([{
-                    # 'trans_date_trans_time': trans_time,
-                    # 'cardNum': card_num,
-                    # 'merchant': merchant,
-                    'Amount': amount,
-                    # Include optional fields if available
-                    'category': transaction.get('category', 'unknown'),
-                    'transactionId': transaction.get('transactionId', ''),
-                    'merch_lat': float(transaction.get('merch_lat', 0)),
-                    'merch_long': float(transaction.get('merch_long', 0))
-                }])
-
-                # Temporarily add to dataset
-                self.df = pd.concat([original_df, new_txn], ignore_index=True) if original_df is not None else new_txn
-
-                # Run analyses (rest of your existing code)
-                community_results = self.detect_smurfing()
-                behavioral_results = self._detect_behavioral_patterns(
-                    # sender=card_num,
-                    amount=amount,
-                    # transaction_time=trans_time
-                )
+                with self._lock:
+                    sender = self.accounts.encode(sender) if has_sender else None
+                    receiver = self.accounts.encode(receiver) if has_receiver else None
+                    with timed('candidate_scan'):
+                        candidate_cases = self._evaluate_candidate(sender, receiver, amount, trans_time)
+                    with timed('behavioral_analysis'):
+                        behavioral_results = self._detect_behavioral_patterns(
+                            sender=sender,
+                            amount=amount,
+                            transaction_time=trans_time
+                        )
+                    community_ids = list(dict.fromkeys(
+                        self._account_communities.get(sender, []) + self._account_communities.get(receiver, [])
+                    ))
+                    community_results = self.detect_smurfing(community_ids) if community_ids else []
 
                 return [{
                     **comm,
@@ -208,18 +1271,70 @@ class SmurfingDetector:
                     "enhanced_suspicion_score": min(1.0, 
                         comm.get('suspicion_score', 0) + 
                         behavioral_results.get('behavioral_score', 0)),
-                    # "transaction_time": trans_time.isoformat()
-                } for comm in community_results]
+                    "transaction_time": trans_time.isoformat()
+                } for comm in [candidate_cases] + community_results]
 
             except Exception as e:
                 return self._error_response(f"Analysis failed: {str(e)}")
-            finally:
-                # Restore original data
-                self.df = original_df
 
         except Exception as e:
             return self._error_response(f"Invalid data: {str(e)}")
 
+    def streaming_cases(self) -> List[Dict]:
+        """Classic_Smurfing bursts found by the live stream so far (cached
+        until the next transaction)"""
+        with self._lock:
+            if self._streaming_results is None:
+                self._streaming_results = self.smurfing_stream.all_cases()
+            return self._streaming_results
+
+    def _evaluate_candidate(self, sender: Optional[int], receiver: Optional[int],
+                            amount: float, trans_time: pd.Timestamp) -> Dict:
+        """Smurfing/structuring checks for the windows the candidate would land in"""
+        now_ns = trans_time.value
+        smurfing, structuring = [], []
+        window_count = 0
+        
+        # Receiver side: many senders feeding one account
+        if receiver is not None:
+            case = self.smurfing_stream.peek(receiver, sender, now_ns, amount)
+            window_count += self.smurfing_stream.window_size(receiver) + 1
+            if case:
+                smurfing.append(case)
+        
+        # Sender side: one account splitting funds across receivers
+        if sender is not None:
+            start_ns = now_ns - int(STRUCTURING_PARAMS['max_time_window'] * 3600 * 1e9)
+            times, amounts, receivers = self._sender_history.window(sender, start_ns, now_ns)
+            times, amounts = times + [now_ns], amounts + [amount]
+            receivers = receivers + ([receiver] if receiver is not None else [])
+            window_count += len(times)
+            destinations = list(dict.fromkeys(receivers))
+            
+            if (len(destinations) >= STRUCTURING_PARAMS['min_split'] and min(amounts) > 0 and
+                    max(amounts)/min(amounts) < STRUCTURING_PARAMS['amount_variation'] and
+                    sum(amounts) > STRUCTURING_PARAMS['min_total_amount']):
+                structuring.append({
+                    "pattern_type": "Transaction_Splitting",
+                    "main_account": self.accounts.decode(sender),
+                    "split_count": len(destinations),
+                    "total_amount": sum(amounts),
+                    "time_window_hours": round((max(times) - min(times)) / 3.6e12, 2),
+                    "amount_range": f"{min(amounts):.2f}-{max(amounts):.2f}",
+                    "destination_accounts": self.accounts.decode_many(destinations),
+                    "suspicion_score": min(100, round((sum(amounts)/STRUCTURING_PARAMS['min_total_amount'])*20))
+                })
+        
+        scores = [case['suspicion_score'] for case in smurfing + structuring]
+        return {
+            "community_id": "candidate_window",
+            "smurfing_cases": smurfing,
+            "structuring_cases": structuring,
+            "member_count": len({sender, receiver} - {None}),
+            "transaction_count": window_count,
+            "suspicion_score": max(scores) / 100 if scores else 0.0
+        }
+
     def _error_response(self, message: str) -> List[Dict]:
         """Standardized error response"""
         return [{
@@ -236,7 +1351,7 @@ class SmurfingDetector:
             "timestamp": datetime.now().isoformat()
         }]
     
-    def _detect_behavioral_patterns(self, sender: str, amount: float, transaction_time: pd.Timestamp) -> Dict:
+    def _detect_behavioral_patterns(self, sender: Optional[int], amount: float, transaction_time: pd.Timestamp) -> Dict:
         """Detect behavioral patterns with robust error handling"""
         patterns = {
             "behavioral_score": 0.0,
@@ -248,29 +1363,25 @@ class SmurfingDetector:
         }
 
         try:
-            if self.df is None or sender not in self.df['Sender_account'].values:
+            if sender is None or sender not in self._sender_history:
                 return patterns
 
-            # Get sender's history (last 30 days)
-            history = self.df[
-                (self.df['Sender_account'] == sender) &
-                (self.df['DateTime'] < transaction_time) &
-                (self.df['DateTime'] >= transaction_time - timedelta(days=30))
-            ]
+            # Get sender's history (last 30 days) from the per-sender index
+            now_ns = transaction_time.value
+            times, amounts, merchants = self._sender_history.window(
+                sender, now_ns - int(timedelta(days=30).total_seconds() * 1e9), now_ns, include_end=False
+            )
 
             # Amount structuring detection
             for min_amt, max_amt in [(900,1000), (4500,5000), (9000,10000)]:
                 if min_amt <= amount <= max_amt:
-                    similar = history[
-                        (history['Amount'] >= min_amt) & 
-                        (history['Amount'] <= max_amt)
-                    ]
+                    similar = [a for a in amounts if min_amt <= a <= max_amt]
                     if len(similar) > 0:
                         patterns['amount_flags'].append(f"amount_{min_amt}-{max_amt}")
                         patterns['behavioral_score'] += 0.25
                         patterns['amount_analysis'][f"range_{min_amt}-{max_amt}"] = {
                             "count": len(similar),
-                            "total": similar['Amount'].sum()
+                            "total": sum(similar)
                         }
 
             # Temporal patterns
@@ -278,21 +1389,22 @@ class SmurfingDetector:
                 patterns['temporal_flags'].append("late_night")
                 patterns['behavioral_score'] += 0.2
 
-            recent = history[history['DateTime'] >= transaction_time - timedelta(hours=1)]
-            if len(recent) >= 3:
-                patterns['temporal_flags'].append(f"rapid_{len(recent)}_txns")
-                patterns['behavioral_score'] += 0.1 * len(recent)
-                patterns['temporal_analysis']['last_hour'] = len(recent)
+            recent = len(times) - bisect.bisect_left(times, now_ns - int(3600 * 1e9))
+            if recent >= 3:
+                patterns['temporal_flags'].append(f"rapid_{recent}_txns")
+                patterns['behavioral_score'] += 0.1 * recent
+                patterns['temporal_analysis']['last_hour'] = recent
 
             # Merchant patterns
-            merchant_counts = history['Receiver_account'].value_counts()
-            if len(merchant_counts) > 0:
-                if merchant_counts.iloc[0]/len(history) > 0.7:
+            if merchants:
+                top_code, top_count = Counter(merchants).most_common(1)[0]
+                top_merchant = self.accounts.decode(top_code)
+                if top_count/len(merchants) > 0.7:
                     patterns['merchant_flags'].append(
-                        f"concentrated_{merchant_counts.index[0]}")
+                        f"concentrated_{top_merchant}")
                     patterns['behavioral_score'] += 0.2
                 
-                if any(x in merchant_counts.index[0].lower() 
+                if any(x in top_merchant.lower() 
                       for x in ['electronics', 'jewelry', 'crypto']):
                     patterns['merchant_flags'].append("high_risk_merchant")
                     patterns['behavioral_score'] += 0.3
@@ -308,151 +1420,1285 @@ class SmurfingDetector:
         if self.json_file_path and os.path.exists(self.json_file_path):
             with open(self.json_file_path, 'r') as f:
                 return json.load(f)
+        if COMMUNITY_PARAMS['enabled']:
+            print("ℹ️ No community JSON found, detecting communities on the transaction graph")
+            self.label_propagation = LabelPropagation()
+            self.label_propagation.fit(
+                self.df['Sender_account'].to_numpy(), self.df['Receiver_account'].to_numpy(),
+                np.ones(len(self.df)), len(self.accounts)
+            )
+            return self._community_data_from_labels(self.df['Sender_account'].to_numpy(),
+                                                    self.df['Is_fraud'].to_numpy())
         print("⚠ No community JSON found, using mock data")
         return {
             "fraud_communities": {
                 "1": {
-                    "Members": list(set(
-                        self.df['Sender_account'].dropna().astype(str).tolist() + 
-                        self.df['Receiver_account'].dropna().astype(str).tolist()
-                    ))[:20]
+                    "Members": self.accounts.decode_many(pd.unique(np.concatenate([
+                        self.df['Sender_account'].to_numpy(),
+                        self.df['Receiver_account'].to_numpy()
+                    ]))[:20])
                 }
             }
         }
 
-    def detect_smurfing(self) -> List[Dict]:
-        """Run smurfing detection analysis"""
-        if self.graph is None or self.df is None:
-            return []
+    def _community_data_from_labels(self, senders: np.ndarray, is_fraud: np.ndarray) -> Dict:
+        """`fraud_communities` in the community JSON schema from the current
+        labels: tight groups of a plausible ring size, highest fraud rate first.
+        `senders`/`is_fraud` are the transaction columns the rates come from."""
+        cohesion = self.label_propagation.cohesion()
+        groups = {
+            label: members for label, members in self.label_propagation.groups().items()
+            if COMMUNITY_PARAMS['min_size'] <= len(members) <= COMMUNITY_PARAMS['max_size']
+            and cohesion[label] >= COMMUNITY_PARAMS['min_cohesion']
+        }
+        # Transactions belong to their sender's community
+        stats = pd.DataFrame({
+            'community': self.label_propagation.labels[senders],
+            'Is_fraud': is_fraud
+        })
+        stats = stats[stats['community'].isin(list(groups))]
+        stats = stats.groupby('community')['Is_fraud'].agg(['size', 'mean'])
+        stats = stats.sort_values(['mean', 'size'], ascending=False).head(COMMUNITY_PARAMS['max_communities'])
         
-        results = []
-        for comm_id, comm_data in self.community_data.get('fraud_communities', {}).items():
-            members = [str(m) for m in comm_data.get('Members', [])]
-            comm_df = self.df[
-                (self.df['Sender_account'].astype(str).isin(members)) | 
-                (self.df['Receiver_account'].astype(str).isin(members))
-            ]
+        print(f"✅ Found {len(groups)} communities, reporting {len(stats)}")
+        return {
+            "fraud_communities": {
+                str(label): {
+                    "Members": self.accounts.decode_many(groups[label]),
+                    "Size": len(groups[label]),
+                    "Transactions": int(row['size']),
+                    "Fraud_rate": round(float(row['mean']), 4)
+                }
+                for label, row in stats.iterrows()
+            }
+        }
+
+    def _start_community_refresh(self):
+        """Refresh communities on a background thread unless one is running (caller holds the lock)"""
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+        self._refresh_thread = threading.Thread(target=self._refresh_communities, daemon=True)
+        self._refresh_thread.start()
+
+    def _refresh_communities(self):
+        """Fold buffered edges into the labels and re-index what changed.
+
+        Only taking the snapshot and swapping the new index in hold the
+        detector lock; propagation and indexing work on the rows that
+        existed at the snapshot, and rows recorded meanwhile are indexed
+        on swap.
+        """
+        try:
+            with self._lock:
+                edges = self.label_propagation.take_pending()
+                n_nodes = len(self.accounts)
+                frame, tail = self._df, list(self._tail)
+            columns = {
+                column: np.concatenate([frame[column].to_numpy(dtype=np.int64),
+                                        np.array([row[column] for row in tail], dtype=np.int64)])
+                for column in ['Sender_account', 'Receiver_account', 'Is_fraud']
+            }
+            snapshot_rows = len(columns['Sender_account'])
             
-            smurfing = self._detect_smurfing_patterns(comm_df, members)
-            structuring = self._detect_structuring_patterns(comm_df, members)
+            self.label_propagation.refresh(n_nodes, edges)
+            community_data = self._community_data_from_labels(columns['Sender_account'], columns['Is_fraud'])
+            member_ids, account_communities, rows = self._build_community_index(
+                community_data, columns['Sender_account'], columns['Receiver_account']
+            )
             
-            results.append({
-                "community_id": comm_id,
-                "smurfing_cases": smurfing,
-                "structuring_cases": structuring,
-                "member_count": len(members),
-                "transaction_count": len(comm_df)
-            })
+            with self._lock:
+                for row in range(snapshot_rows, self.row_count()):
+                    sender, receiver = self._row_parties(row)
+                    for comm_id in dict.fromkeys(account_communities.get(sender, []) +
+                                                 account_communities.get(receiver, [])):
+                        rows[comm_id].append(row)
+                self._install_community_index(community_data, member_ids, account_communities, rows)
+        except Exception as e:
+            print(f"⚠️ Community refresh failed: {e}")
+
+    def _row_parties(self, row: int) -> Tuple[int, int]:
+        """Sender and receiver of row position `row` (caller holds the lock)"""
+        n = 0 if self._df is None else len(self._df)
+        if row < n:
+            return int(self._df['Sender_account'].iat[row]), int(self._df['Receiver_account'].iat[row])
+        entry = self._tail[row - n]
+        return entry['Sender_account'], entry['Receiver_account']
+
+    def detect_smurfing(self, community_ids: Optional[List[str]] = None) -> List[Dict]:
+        """Run smurfing detection analysis (optionally for selected communities).
+
+        Results are cached per community and only recomputed after a new
+        transaction touches one of its members.
+        """
+        if self.graph is None or self._df is None:
+            return []
         
-        return results
+        with self._lock, timed('community_scan'):
+            selected = [comm_id for comm_id in self._community_member_ids
+                        if community_ids is None or comm_id in community_ids]
+            pending = [comm_id for comm_id in selected if comm_id not in self._community_results]
+            if self._use_pool(pending):
+                try:
+                    self._community_results.update(self._analyze_communities_parallel(pending))
+                except Exception as e:
+                    print(f"⚠️ Parallel community analysis failed, running sequentially: {e}")
+            for comm_id in pending:
+                if comm_id not in self._community_results:
+                    self._community_results[comm_id] = self._analyze_community(comm_id)
+            
+            return [self._community_results[comm_id] for comm_id in selected]
 
-    def _detect_smurfing_patterns(self, df: pd.DataFrame, members: List[str]) -> List[Dict]:
-        smurfing_cases = []
+    def _analyze_community(self, comm_id: str, smurfing: Optional[List[Dict]] = None) -> Dict:
+        """Community result; `smurfing` is passed in when a pool worker found it"""
+        members = self._community_member_ids[comm_id]
+        comm_df = self.df.iloc[self._community_rows[comm_id]]
         
-        # Pattern 1: Multiple small-medium transactions to same receiver
-        receiver_groups = df.groupby('Receiver_account')
-        for receiver, group in receiver_groups:
-            if len(group) >= SMURFING_PARAMS['min_transactions']:
-                amounts = group['Amount'].values
-                time_window = (group['DateTime'].max() - group['DateTime'].min()).total_seconds()/3600
-                
-                if (all(a < SMURFING_PARAMS['max_amount'] for a in amounts) and \
-                   (time_window < SMURFING_PARAMS['max_time_window']) and \
-                   (len(group['Sender_account'].unique()) >= SMURFING_PARAMS['min_senders'])):
-                    
-                    case = {
-                        "pattern_type": "Classic_Smurfing",
-                        "receiver": str(receiver),
-                        "transaction_count": len(group),
-                        "total_amount": sum(amounts),
-                        "time_window_hours": round(time_window, 2),
-                        "average_amount": round(np.mean(amounts), 2),
-                        "senders": [str(s) for s in group['Sender_account'].unique()],
-                        "first_transaction": group['DateTime'].min().strftime("%Y-%m-%d %H:%M"),
-                        "last_transaction": group['DateTime'].max().strftime("%Y-%m-%d %H:%M"),
-                        "suspicion_score": min(100, round((sum(amounts)/SMURFING_PARAMS['max_amount'])*100))
-                    }
-                    smurfing_cases.append(case)
-        
-        return smurfing_cases
-
-    def _detect_structuring_patterns(self, df: pd.DataFrame, members: List[str]) -> List[Dict]:
-        structuring_cases = []
-        
-        for node in members:
-            try:
-                successors = list(self.graph.successors(node))
-                if len(successors) >= STRUCTURING_PARAMS['min_split']:
-                    edges = [self.graph[node][s] for s in successors]
-                    amounts = [e['amount'] for e in edges]
-                    times = [e['timestamp'] for e in edges]
-                    time_window = (max(times) - min(times)).total_seconds()/3600
-                    
-                    if (time_window < STRUCTURING_PARAMS['max_time_window']) and \
-                       (max(amounts)/min(amounts) < STRUCTURING_PARAMS['amount_variation']) and \
-                       (sum(amounts) > STRUCTURING_PARAMS['min_total_amount']):
-                        
-                        case = {
-                            "pattern_type": "Transaction_Splitting",
-                            "main_account": str(node),
-                            "split_count": len(successors),
-                            "total_amount": sum(amounts),
-                            "time_window_hours": round(time_window, 2),
-                            "amount_range": f"{min(amounts):.2f}-{max(amounts):.2f}",
-                            "destination_accounts": [str(s) for s in successors],
-                            "suspicion_score": min(100, round((sum(amounts)/STRUCTURING_PARAMS['min_total_amount'])*20))
-                        }
-                        structuring_cases.append(case)
-            except:
-                continue
+        if smurfing is None:
+            smurfing = self._detect_smurfing_patterns(comm_df, members)
+        structuring = self._detect_structuring_patterns(comm_df, members)
+        
+        return {
+            "community_id": comm_id,
+            "smurfing_cases": smurfing,
+            "structuring_cases": structuring,
+            "member_count": len(members),
+            "transaction_count": len(comm_df)
+        }
+
+    def _use_pool(self, comm_ids: List[str]) -> bool:
+        return (PARALLEL_PARAMS['enabled'] and len(comm_ids) > 1 and
+                sum(len(self._community_rows[comm_id]) for comm_id in comm_ids) >= PARALLEL_PARAMS['min_rows'])
+
+    def _analyze_communities_parallel(self, comm_ids: List[str]) -> Dict[str, Dict]:
+        """Replay each community's transfers in a pool worker.
+
+        The replay columns go into shared memory once; each task carries only
+        the block names and its row positions. Results are collected in
+        `comm_ids` order, so the output does not depend on scheduling.
+        """
+        global _community_executor
+        if _community_executor is None:
+            _community_executor = process_pool(PARALLEL_PARAMS['workers'])
         
-        return structuring_cases
+        with SharedColumns(self.df, ['Sender_account', 'Receiver_account', 'DateTime', 'Amount']) as shared:
+            futures = [
+                _community_executor.submit(
+                    replay_shared_rows, shared.spec, np.asarray(self._community_rows[comm_id], dtype=np.int64)
+                )
+                for comm_id in comm_ids
+            ]
+            results = {}
+            for comm_id, future in zip(comm_ids, futures):
+                cases = future.result()
+                for case in cases:
+                    case['receiver'] = self.accounts.decode(case['receiver'])
+                    case['senders'] = self.accounts.decode_many(case['senders'])
+                results[comm_id] = self._analyze_community(comm_id, smurfing=cases)
+        return results
+
+    def _detect_smurfing_patterns(self, df: pd.DataFrame, members: List[int]) -> List[Dict]:
+        # Pattern 1: Multiple small-medium transactions to same receiver,
+        # found with a sliding window so bursts inside long histories count
+        return SmurfingStream.replay(df, decode=self.accounts.decode).all_cases()
+
+    def _detect_structuring_patterns(self, df: pd.DataFrame, members: List[int]) -> List[Dict]:
+        # Scanned for all accounts at once and reused until new data arrives
+        if self._structuring_scan is None:
+            self._structuring_scan = StructuringScan.from_frame(self.df)
+        return self._structuring_scan.cases(members, decode=self.accounts.decode)
 
 # ==================================================================
-# FRAUD DETECTION SYSTEM
+# PARALLEL COMMUNITY ANALYSIS
 # ==================================================================
-class PersistentAutoRetrainFraudDetector:
-    
-    def __init__(self, model_path='fraud_detection_model.pkl', 
-                 training_data_path='hackathon_ai_dataset.csv',
-                 state_path='fraud_detector_state.json'):
-        """Initialize with persistent counter"""
-        # Convert to absolute paths
-        self.model_path = os.path.abspath(model_path)
-        self.training_data_path = os.path.abspath(training_data_path)
-        self.state_path = os.path.abspath(state_path)
-        
-        self.retrain_interval = 3
-        self.original_df = pd.DataFrame(pd.read_csv(self.training_data_path))
-        
-        print(f"State file will be saved to: {self.state_path}")
-        print(f"Current working directory: {os.getcwd()}")
-        
+# Opt-in: spreads detect_smurfing's per-community replays over a process pool
+PARALLEL_PARAMS = {
+    'enabled': os.getenv('AI_SERVER_PARALLEL_COMMUNITIES') == '1',
+    'workers': None,     # None = one per CPU
+    'min_rows': 20000,   # below this many community rows the pool costs more than it saves
+    'start_method': 'forkserver'  # falls back to 'spawn' where forkserver is unavailable
+}
+
+_community_executor = None
+
+def process_pool(max_workers: Optional[int]) -> ProcessPoolExecutor:
+    """Process pool whose workers are not forked from this process.
+
+    Serving processes run scoring, analysis and OCR threads, so a fork can
+    copy a lock some other thread holds and deadlock the child; forkserver
+    and spawn children start from a fresh interpreter instead.
+    """
+    method = PARALLEL_PARAMS['start_method']
+    if method not in multiprocessing.get_all_start_methods():
+        method = 'spawn'
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(method))
+
+class SharedColumns:
+    """Frame columns copied once into shared memory for pool workers.
+
+    Workers attach to the blocks by name, so a task ships a few names and
+    its row positions instead of a pickled DataFrame.
+    """
+
+    def __init__(self, df: pd.DataFrame, columns: List[str]):
+        from multiprocessing import shared_memory
+        self._blocks = []
+        self.spec: Dict[str, Tuple[str, str, int]] = {}
+        try:
+            for column in columns:
+                values = np.ascontiguousarray(df[column].to_numpy())
+                block = shared_memory.SharedMemory(create=True, size=max(1, values.nbytes))
+                self._blocks.append(block)
+                np.ndarray(values.shape, values.dtype, buffer=block.buf)[:] = values
+                self.spec[column] = (block.name, values.dtype.str, len(values))
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def replay_shared_rows(spec: Dict[str, Tuple[str, str, int]], rows: np.ndarray) -> List[Dict]:
+    """Pool task: Classic_Smurfing cases for some rows of the shared columns,
+    with accounts left as ids for the parent to decode"""
+    from multiprocessing import shared_memory
+    columns = {}
+    for column, (name, dtype, length) in spec.items():
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            columns[column] = np.ndarray(length, dtype=dtype, buffer=block.buf)[rows]
+        finally:
+            block.close()
+    return SmurfingStream.replay(pd.DataFrame(columns), decode=int).all_cases()
+
+
+# ==================================================================
+# APPEND-ONLY TRANSACTION LOG
+# ==================================================================
+TRANSACTION_LOG_PARAMS = {
+    'compact_every': 1000,  # log rows folded back into the CSV at once
+    'fsync': False,         # fsync every append (durable, but slower)
+    'read_kwargs': {'low_memory': False}  # how the training CSV is parsed
+}
+
+class TransactionLog:
+    """Append-only JSON-lines segment kept next to the training CSV.
+
+    Scored transactions are written here one line at a time instead of
+    rewriting the whole CSV; `compact` periodically folds the segment back
+    into the CSV and starts a fresh one. The segment is shared by every
+    worker process, so appends hold an inter-process lock and compaction
+    rebuilds the CSV from disk, not from one worker's frame.
+
+    Compaction freezes the current segment (appends go on into a new one),
+    rebuilds the CSV without holding the append lock, then swaps it in. A
+    second lock, held for the whole compaction, keeps compactions apart and
+    lets `read` wait for a consistent CSV + segment view.
+    """
+
+    def __init__(self, csv_path: str, compact_every: int = TRANSACTION_LOG_PARAMS['compact_every'],
+                 fsync: bool = TRANSACTION_LOG_PARAMS['fsync']):
+        self.csv_path = csv_path
+        self.log_path = csv_path + '.log'
+        self.compacting_path = self.log_path + '.compacting'
+        self.tmp_path = csv_path + '.tmp'
+        self.lock_path = self.log_path + '.lock'
+        self.compact_lock_path = self.log_path + '.compact.lock'
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.pending = 0
+        self._compact_thread = None
+        self._thread_lock = threading.Lock()
+        with FileLock(self.compact_lock_path), FileLock(self.lock_path):
+            self._recover()
+
+    def _recover(self):
+        """Finish or roll back a compaction interrupted by a crash (caller holds both locks)"""
+        if os.path.exists(self.compacting_path):
+            if os.path.exists(self.tmp_path):
+                # CSV was never replaced: the rows are still only in the segment
+                os.remove(self.tmp_path)
+                with open(self.compacting_path, 'a', encoding='utf-8') as dst:
+                    if os.path.exists(self.log_path):
+                        with open(self.log_path, 'r', encoding='utf-8') as src:
+                            dst.write(src.read())
+                os.replace(self.compacting_path, self.log_path)
+                print("⚠️ Rolled back interrupted log compaction")
+            else:
+                # CSV already contains the rows
+                os.remove(self.compacting_path)
+                print("⚠️ Completed interrupted log compaction")
+        elif os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def read(self, **read_kwargs) -> Tuple[pd.DataFrame, List[Dict]]:
+        """The CSV and every row logged since it was written (from any worker).
+        Waits for a running compaction, so no row is in neither or both."""
+        with FileLock(self.compact_lock_path):
+            df = read_csv_cached(self.csv_path, **read_kwargs)
+            with FileLock(self.lock_path):
+                self._recover()
+                rows = self._read_rows(self.log_path)
+        if rows:
+            print(f"ℹ️ Replayed {len(rows)} rows from {self.log_path}")
+        return df, rows
+
+    def _read_rows(self, path: str) -> List[Dict]:
+        rows = []
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rows.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Torn final line from a crash mid-append
+                        print("⚠️ Skipping unreadable transaction log line")
+        return rows
+
+    def append(self, records: List[Dict]):
+        """Write only the new rows"""
+        lines = ''.join(json.dumps(record, default=str) + '\n' for record in records)
+        with FileLock(self.lock_path):
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+        self.pending += len(records)
+
+    def needs_compaction(self) -> bool:
+        return self.pending >= self.compact_every
+
+    def start_compaction(self):
+        """Run `compact` on a background thread unless one is already running"""
+        with self._thread_lock:
+            if self._compact_thread is not None and self._compact_thread.is_alive():
+                return
+            self.pending = 0
+            self._compact_thread = threading.Thread(target=self._compact_safely, daemon=True)
+            self._compact_thread.start()
+
+    def _compact_safely(self):
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"⚠️ Log compaction failed: {e}")
+
+    def compact(self, blocking: bool = False) -> bool:
+        """Rewrite the CSV as the CSV on disk plus every logged row (from any
+        worker). Returns False if another worker is already compacting."""
+        compact_lock = FileLock(self.compact_lock_path)
+        if not compact_lock.acquire(blocking):
+            return False
+        try:
+            with FileLock(self.lock_path):
+                self._recover()
+                if not os.path.exists(self.log_path) or not os.path.getsize(self.log_path):
+                    self.pending = 0
+                    return True
+                # Freeze the segment; the empty tmp file marks "CSV not replaced yet"
+                os.replace(self.log_path, self.compacting_path)
+                open(self.tmp_path, 'w').close()
+            
+            # The slow part runs while other workers keep appending
+            rows = self._read_rows(self.compacting_path)
+            df = read_csv_cached(self.csv_path, **TRANSACTION_LOG_PARAMS['read_kwargs'])
+            concat_compact(df, pd.DataFrame(rows)).to_csv(self.tmp_path, index=False)
+            
+            with FileLock(self.lock_path):
+                os.replace(self.tmp_path, self.csv_path)
+                os.remove(self.compacting_path)
+            print(f"✅ Compacted {len(rows)} logged rows into {self.csv_path}")
+            # Rebuild the columnar sidecar now rather than on the next read
+            read_csv_cached(self.csv_path, **TRANSACTION_LOG_PARAMS['read_kwargs'])
+            return True
+        finally:
+            compact_lock.release()
+
+
+# ==================================================================
+# CARD VELOCITY
+# ==================================================================
+# Rolling per-card aggregates over the card's earlier transactions. Training
+# computes them in bulk over the whole frame (velocity_feature_frame);
+# serving reads them from VelocityStore, which applies the same windows to
+# a live stream. Both see at most `max_events` earlier transactions per card.
+#
+# The store lives in one process and only sees the rows that process scored,
+# so serving with velocity features needs a single worker (gunicorn.conf.py
+# enforces it). AI_SERVER_VELOCITY=0 drops them from the model instead.
+VELOCITY_PARAMS = {
+    'enabled': os.getenv('AI_SERVER_VELOCITY', '1') != '0',
+    'windows': {'1h': 3600, '24h': 24 * 3600, '7d': 7 * 24 * 3600},  # seconds
+    'max_events': 256,  # ring buffer size per card
+    'max_cards': 200000,  # least recently active cards are dropped beyond this
+    'idle_seconds': 7 * 24 * 3600  # cards silent this long are dropped
+}
+
+VELOCITY_STATS = ['count', 'amt_sum', 'amt_mean', 'amt_max', 'merchants']
+VELOCITY_COLUMNS = [f"card_{stat}_{window}" for window in VELOCITY_PARAMS['windows'] for stat in VELOCITY_STATS]
+
+def card_key(value) -> Optional[str]:
+    """Normalize a card number from the CSV (int/float) or a request (str)"""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        value = int(value)
+    key = str(value).strip()
+    return key or None
+
+def merchant_keys(merchants: pd.Series) -> pd.Series:
+    """Merchant names as plain strings, missing ones as 'None'"""
+    merchants = merchants.astype(object)
+    return merchants.where(merchants.notna(), None).astype(str)
+
+def velocity_feature_frame(cards: pd.Series, times: pd.Series, amounts: pd.Series,
+                           merchants: pd.Series) -> pd.DataFrame:
+    """Velocity features for every row, using the frame itself as history.
+
+    Rows are ordered by (card, time), so each row's window is a contiguous
+    range [start, i) of the sorted rows: sums come from a cumulative sum,
+    maxima from a sparse table and distinct merchants from a difference
+    array over the rows each merchant occurrence is counted for.
+    """
+    n = len(cards)
+    out = np.zeros((n, len(VELOCITY_COLUMNS)), dtype=np.float64)
+    if n == 0:
+        return pd.DataFrame(out, columns=VELOCITY_COLUMNS, index=cards.index)
+    
+    card_codes = pd.factorize(cards.map(card_key))[0]
+    t = pd.to_datetime(times, errors='coerce').to_numpy(dtype='datetime64[ns]').view(np.int64)
+    order = np.lexsort((t, card_codes))
+    card = card_codes[order]
+    t = t[order]
+    amt = pd.to_numeric(amounts, errors='coerce').fillna(0).to_numpy(dtype=np.float64)[order]
+    position = np.arange(n)
+    
+    # Composite (card, time rank) keys for per-card searchsorted
+    unique_times = np.unique(t)
+    time_rank = np.searchsorted(unique_times, t)
+    keys = (card + 1).astype(np.int64) * (len(unique_times) + 1) + time_rank
+    cumulative = np.concatenate(([0.0], np.cumsum(amt)))
+    
+    # Sparse table over amounts; windows never exceed max_events rows
+    max_events = VELOCITY_PARAMS['max_events']
+    table = [amt]
+    while (1 << len(table)) <= max_events:
+        previous, step = table[-1], 1 << (len(table) - 1)
+        table.append(np.maximum(previous, np.concatenate((previous[step:], previous[-step:]))))
+    table = np.vstack(table)
+    
+    # Previous row with the same (card, merchant)
+    merchant_codes = pd.factorize(merchant_keys(merchants))[0][order]
+    pair = (card + 1).astype(np.int64) * (merchant_codes.max() + 1) + merchant_codes
+    by_pair = np.argsort(pair, kind='stable')
+    same = pair[by_pair[1:]] == pair[by_pair[:-1]]
+    previous_same = np.full(n, -1)
+    previous_same[by_pair[1:][same]] = by_pair[:-1][same]
+    
+    for w, seconds in enumerate(VELOCITY_PARAMS['windows'].values()):
+        first_rank = np.searchsorted(unique_times, t - seconds * 10**9, side='left')
+        start = np.searchsorted(keys, (card + 1).astype(np.int64) * (len(unique_times) + 1) + first_rank)
+        start = np.maximum(start, position - max_events)
+        start[card < 0] = position[card < 0]
+        
+        count = position - start
+        total = cumulative[position] - cumulative[start]
+        has = count > 0
+        level = np.zeros(n, dtype=np.int64)
+        level[has] = np.floor(np.log2(count[has])).astype(np.int64)
+        upper = np.where(has, position - (1 << level), position)
+        maximum = np.where(has, np.maximum(table[level, start], table[level, np.maximum(upper, 0)]), 0.0)
+        
+        # Row j counts towards rows i with start[i] in (previous_same[j], j]
+        first_row = np.maximum(position + 1, np.searchsorted(start, previous_same, side='right'))
+        last_row = np.searchsorted(start, position, side='right') - 1
+        counted = first_row <= last_row
+        delta = np.zeros(n + 1, dtype=np.int64)
+        np.add.at(delta, first_row[counted], 1)
+        np.add.at(delta, last_row[counted] + 1, -1)
+        distinct = np.cumsum(delta[:n])
+        
+        base = w * len(VELOCITY_STATS)
+        out[order, base] = count
+        out[order, base + 1] = total
+        out[order, base + 2] = np.divide(total, count, out=np.zeros(n), where=has)
+        out[order, base + 3] = maximum
+        out[order, base + 4] = distinct
+    return pd.DataFrame(out, columns=VELOCITY_COLUMNS, index=cards.index)
+
+class _VelocityWindow:
+    """Running aggregates over ring buffer entries [head, seq) of one window"""
+    __slots__ = ('head', 'count', 'total', 'maxima', 'merchants')
+
+    def __init__(self, head: int = 0):
+        self.head = head
+        self.count = 0
+        self.total = 0.0
+        self.maxima = deque()  # seqs with decreasing amounts
+        self.merchants = Counter()
+
+class CardVelocity:
+    """Ring buffer of one card's recent transactions, updated in O(1) amortized"""
+    __slots__ = ('times', 'amounts', 'merchants', 'seq', 'windows', 'last_time')
+
+    def __init__(self):
+        self.times: List[int] = []
+        self.amounts: List[float] = []
+        self.merchants: List[str] = []
+        self.seq = 0  # entries ever written; entry q lives at q % max_events
+        self.windows = [_VelocityWindow() for _ in VELOCITY_PARAMS['windows']]
+        self.last_time = None
+
+    def _evict(self, window: _VelocityWindow):
+        slot = window.head % VELOCITY_PARAMS['max_events']
+        window.count -= 1
+        window.total -= self.amounts[slot]
+        if window.maxima and window.maxima[0] == window.head:
+            window.maxima.popleft()
+        merchant = self.merchants[slot]
+        window.merchants[merchant] -= 1
+        if not window.merchants[merchant]:
+            del window.merchants[merchant]
+        window.head += 1
+
+    def features(self, time_ns: int) -> List[float]:
+        """Window aggregates as seen by a transaction at `time_ns` (read-only)"""
+        if self.last_time is not None:
+            time_ns = max(time_ns, self.last_time)
+        max_events = VELOCITY_PARAMS['max_events']
+        values = []
+        for window, seconds in zip(self.windows, VELOCITY_PARAMS['windows'].values()):
+            cutoff = time_ns - seconds * 10**9
+            head, count, total = window.head, window.count, window.total
+            expired = Counter()
+            while head < self.seq and self.times[head % max_events] < cutoff:
+                slot = head % max_events
+                count -= 1
+                total -= self.amounts[slot]
+                expired[self.merchants[slot]] += 1
+                head += 1
+            maximum = next((self.amounts[q % max_events] for q in window.maxima if q >= head), 0.0)
+            distinct = len(window.merchants) - sum(
+                1 for merchant, n in expired.items() if window.merchants[merchant] == n
+            )
+            values += [count, total if count else 0.0, total / count if count else 0.0, maximum, distinct]
+        return values
+
+    def observe(self, time_ns: int, amount: float, merchant: str):
+        """Add a transaction; late ones are treated as arriving at the card's latest time"""
+        if self.last_time is not None:
+            time_ns = max(time_ns, self.last_time)
+        self.last_time = time_ns
+        max_events = VELOCITY_PARAMS['max_events']
+        for window, seconds in zip(self.windows, VELOCITY_PARAMS['windows'].values()):
+            cutoff = time_ns - seconds * 10**9
+            while window.head < self.seq and (self.times[window.head % max_events] < cutoff or
+                                              window.head <= self.seq - max_events):
+                self._evict(window)
+        
+        slot = self.seq % max_events
+        if slot == len(self.times):
+            self.times.append(time_ns)
+            self.amounts.append(amount)
+            self.merchants.append(merchant)
+        else:
+            self.times[slot], self.amounts[slot], self.merchants[slot] = time_ns, amount, merchant
+        for window in self.windows:
+            window.count += 1
+            window.total += amount
+            while window.maxima and self.amounts[window.maxima[-1] % max_events] <= amount:
+                window.maxima.pop()
+            window.maxima.append(self.seq)
+            window.merchants[merchant] += 1
+        self.seq += 1
+
+class VelocityStore:
+    """In-process per-card velocity state for serving, bounded by idle eviction"""
+
+    def __init__(self):
+        self.cards: OrderedDict = OrderedDict()  # least recently active first
+        self.high_water = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.cards)
+
+    @staticmethod
+    def _rows(df: pd.DataFrame):
+        cards = df['cc_num'] if 'cc_num' in df else pd.Series(None, index=df.index, dtype=object)
+        times = pd.to_datetime(df['trans_date_trans_time'], errors='coerce')
+        amounts = pd.to_numeric(df['amt'], errors='coerce').fillna(0)
+        merchants = merchant_keys(df['merchant']) if 'merchant' in df else pd.Series('None', index=df.index)
+        valid = times.notna().to_numpy()
+        return zip(cards.map(card_key).tolist(), times.to_numpy(dtype='datetime64[ns]').view(np.int64).tolist(),
+                   amounts.astype(float).tolist(), merchants.tolist(), valid.tolist())
+
+    def features(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Velocity features for request rows, without recording them"""
+        rows = []
+        empty = [0.0] * len(VELOCITY_COLUMNS)
+        with self._lock:
+            for card, time_ns, _, _, valid in self._rows(df):
+                state = self.cards.get(card) if card is not None and valid else None
+                rows.append(state.features(time_ns) if state is not None else empty)
+        return pd.DataFrame(rows, columns=VELOCITY_COLUMNS, index=df.index, dtype=np.float64)
+
+    def observe(self, df: pd.DataFrame):
+        """Record transactions, in row order"""
+        with self._lock:
+            for card, time_ns, amount, merchant, valid in self._rows(df):
+                if card is None or not valid:
+                    continue
+                state = self.cards.get(card)
+                if state is None:
+                    state = self.cards[card] = CardVelocity()
+                else:
+                    self.cards.move_to_end(card)
+                state.observe(time_ns, amount, merchant)
+                self.high_water = time_ns if self.high_water is None else max(self.high_water, time_ns)
+            self._evict_idle()
+
+    def _evict_idle(self):
+        idle_before = self.high_water - VELOCITY_PARAMS['idle_seconds'] * 10**9 if self.high_water else None
+        while self.cards:
+            card, state = next(iter(self.cards.items()))
+            if len(self.cards) > VELOCITY_PARAMS['max_cards'] or \
+               (idle_before is not None and state.last_time < idle_before):
+                self.cards.popitem(last=False)
+            else:
+                break
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'VelocityStore':
+        """Seed from each card's latest transactions in a training frame"""
+        store = cls()
+        if df is None or df.empty or 'cc_num' not in df or 'trans_date_trans_time' not in df:
+            return store
+        frame = pd.DataFrame({
+            'cc_num': df['cc_num'].map(card_key),
+            'trans_date_trans_time': pd.to_datetime(df['trans_date_trans_time'], errors='coerce'),
+            'amt': df['amt'] if 'amt' in df else 0.0,
+            'merchant': df['merchant'] if 'merchant' in df else None
+        }).dropna(subset=['cc_num', 'trans_date_trans_time'])
+        frame = frame.sort_values(['trans_date_trans_time'], kind='stable')
+        longest = max(VELOCITY_PARAMS['windows'].values())
+        latest = frame.groupby('cc_num')['trans_date_trans_time'].transform('max')
+        recent = frame[frame['trans_date_trans_time'] >= latest - pd.Timedelta(seconds=longest)]
+        recent = recent.groupby('cc_num', sort=False).tail(VELOCITY_PARAMS['max_events'])
+        store.observe(recent)
+        print(f"ℹ️ Velocity store seeded with {len(store)} cards from {len(recent)} transactions")
+        return store
+
+def add_velocity_features(df: pd.DataFrame, velocity: Optional[VelocityStore] = None) -> pd.DataFrame:
+    """Fill velocity columns where missing: from `velocity` when serving,
+    otherwise in bulk with the frame as its own history"""
+    if not VELOCITY_PARAMS['enabled']:
+        return df
+    if all(c in df for c in VELOCITY_COLUMNS) and not df[VELOCITY_COLUMNS].isna().any().any():
+        return df
+    if velocity is not None:
+        values = velocity.features(df)
+    else:
+        cards = df['cc_num'] if 'cc_num' in df else pd.Series(None, index=df.index, dtype=object)
+        values = velocity_feature_frame(cards, df['trans_date_trans_time'], df['amt'], df['merchant'])
+    if not any(c in df for c in VELOCITY_COLUMNS):
+        # One block instead of 15 column inserts (most of a single request's cost)
+        return pd.concat([df, values], axis=1)
+    for column in VELOCITY_COLUMNS:
+        df[column] = values[column] if column not in df else pd.to_numeric(df[column], errors='coerce').fillna(values[column])
+    return df
+
+
+# ==================================================================
+# FEATURE SPEC
+# ==================================================================
+# Single source of truth for model features: training, /predict,
+# /detect_fraud and /analyze_transaction all go through build_feature_frame.
+FEATURE_SPEC = {
+    'numeric': ['amt', 'city_pop', 'lat', 'long', 'merch_lat', 'merch_long',
+                'distance_from_home', 'hour', 'day_of_week', 'is_night',
+                'is_weekend', 'age', 'amt_per_city_pop'] + (VELOCITY_COLUMNS if VELOCITY_PARAMS['enabled'] else []),
+    'categorical': ['merchant', 'category', 'gender'],
+    # Request field names -> training CSV column names
+    'aliases': {
+        'cardNum': 'cc_num',
+        'Amount': 'amt',
+        'amount': 'amt',
+        'transactionId': 'trans_num',
+        'transaction_num': 'trans_num'
+    },
+    # Raw numeric inputs and the value used when a request leaves them out
+    'defaults': {
+        'amt': 0.0, 'city_pop': 1, 'lat': 0.0, 'long': 0.0,
+        'merch_lat': 0.0, 'merch_long': 0.0
+    }
+}
+
+def _age(df: pd.DataFrame) -> pd.Series:
+    if 'dob' not in df:
+        return pd.Series(0, index=df.index)
+    dob = pd.to_datetime(df['dob'], errors='coerce')
+    return ((df['trans_date_trans_time'] - dob).dt.days // 365.25).fillna(0).astype(int)
+
+# Derived features in dependency order
+DERIVED_FEATURES = {
+    'hour': lambda df: df['trans_date_trans_time'].dt.hour,
+    'day_of_week': lambda df: df['trans_date_trans_time'].dt.dayofweek,
+    'is_night': lambda df: ((df['hour'] >= 22) | (df['hour'] <= 5)).astype(int),
+    'is_weekend': lambda df: (df['day_of_week'] >= 5).astype(int),
+    'distance_from_home': lambda df: pd.Series(
+        geo_distance(df['lat'], df['long'], df['merch_lat'], df['merch_long']), index=df.index
+    ).fillna(0),
+    'age': _age,
+    'amt_per_city_pop': lambda df: (df['amt'] / (df['city_pop'] + 1)).fillna(0)
+}
+
+def model_feature_columns() -> List[str]:
+    return FEATURE_SPEC['numeric'] + FEATURE_SPEC['categorical']
+
+def canonical_transaction(data: Dict) -> Dict:
+    """Flatten a request payload (and its optional `transaction_data`) into
+    training CSV column names; canonical names win over aliases and nested
+    values win over top-level ones"""
+    row = {}
+    for source in (data, data.get('transaction_data') or {}):
+        mapped = {}
+        for key, value in source.items():
+            if key == 'transaction_data':
+                continue
+            column = FEATURE_SPEC['aliases'].get(key, key)
+            if column == key or column not in source:
+                mapped[column] = value
+        row.update({k: v for k, v in mapped.items() if v is not None or k not in row})
+    return row
+
+def build_feature_frame(df: pd.DataFrame, velocity: Optional[VelocityStore] = None) -> pd.DataFrame:
+    """Coerce raw columns and fill in derived features; use the returned frame.
+
+    Derived columns that already exist (e.g. persisted with logged rows) are
+    only computed where they are missing, so every value is computed once.
+    Velocity features come from `velocity` if given, else from `df` itself.
+    """
+    for column, default in FEATURE_SPEC['defaults'].items():
+        df[column] = pd.to_numeric(df[column], errors='coerce').fillna(default) if column in df else default
+    for column in FEATURE_SPEC['categorical']:
+        if column not in df:
+            df[column] = None
+    
+    times = df['trans_date_trans_time'] if 'trans_date_trans_time' in df else pd.Series(pd.NaT, index=df.index)
+    df['trans_date_trans_time'] = pd.to_datetime(times, errors='coerce').fillna(pd.Timestamp.now())
+    
+    for column, compute in DERIVED_FEATURES.items():
+        if column in df and not df[column].isna().any():
+            continue
+        values = compute(df)
+        df[column] = values if column not in df else df[column].fillna(values)
+    return add_velocity_features(df, velocity)
+
+def build_request_features(records: List[Dict], velocity: Optional[VelocityStore] = None) -> pd.DataFrame:
+    """Feature frame for a batch of request payloads"""
+    return build_feature_frame(pd.DataFrame.from_records([canonical_transaction(r) for r in records]), velocity)
+
+
+# ==================================================================
+# MODEL TRAINING
+# ==================================================================
+
+RETRAIN_PARAMS = {
+    'interval': int(os.getenv('AI_SERVER_RETRAIN_INTERVAL', '1000')),  # new entries between retrains
+    'background': True,   # fit in a worker process instead of the request thread
+    'min_auc': 0.6,       # candidate must beat this on its holdout split
+    'max_auc_drop': 0.05,  # ...and stay within this of the current model
+    # 'full' refits on all history; 'warm_start' replaces the oldest trees
+    # with ones fitted on recent rows; 'reservoir' refits on a bounded sample
+    'mode': os.getenv('AI_SERVER_RETRAIN_MODE', 'warm_start'),
+    'warm_start_trees': 20,  # trees replaced per warm_start retrain
+    'recent_rows': 20000,  # warm_start: newest rows the new trees see
+    'reservoir_size': 50000,  # reservoir: cap on training rows
+    'reservoir_days': 90,  # reservoir: only rows this close to the newest one
+    'min_fraud_rows': 50,  # incremental samples are topped up with recent fraud rows
+    'full_every': 20  # every Nth retrain is a full refit (0: never), refreshing the scaler/encoder
+}
+
+RETRAIN_MODES = ('full', 'warm_start', 'reservoir')
+
+def select_training_rows(df: pd.DataFrame, mode: str) -> pd.DataFrame:
+    """Rows a retrain in `mode` fits on; incremental modes stay bounded in size"""
+    if mode == 'warm_start':
+        rows = df.tail(RETRAIN_PARAMS['recent_rows'])
+    elif mode == 'reservoir':
+        times = pd.to_datetime(df['trans_date_trans_time'], errors='coerce')
+        rows = df[(times >= times.max() - pd.Timedelta(days=RETRAIN_PARAMS['reservoir_days'])).to_numpy()]
+        size = RETRAIN_PARAMS['reservoir_size']
+        if len(rows) < size:
+            # Sparse recent history: fall back to the newest rows
+            rows = df.tail(size)
+        elif len(rows) > size:
+            # Keep the (rare) fraud rows, sample the rest
+            fraud = rows[rows['is_fraud'] == 1].tail(size // 2)
+            rest = rows[rows['is_fraud'] != 1]
+            rows = pd.concat([fraud, rest.sample(n=min(len(rest), size - len(fraud)), random_state=42)])
+    else:
+        return df
+    
+    missing = RETRAIN_PARAMS['min_fraud_rows'] - int((rows['is_fraud'] == 1).sum())
+    if missing > 0:
+        older_fraud = df.index[(df['is_fraud'] == 1).to_numpy()].difference(rows.index)
+        rows = pd.concat([df.loc[older_fraud[-missing:]], rows])
+    return rows
+
+def training_frame(df: pd.DataFrame, mode: str) -> pd.DataFrame:
+    """Model features and label for the rows a `mode` retrain fits on.
+
+    Rows are selected first and features built only for them, plus the
+    earlier transactions of the same cards that their velocity windows
+    reach back to, so an incremental retrain scales with the rows it fits
+    on rather than with the whole history. `df` is not modified.
+    """
+    rows = select_training_rows(df, mode)
+    if len(rows) < len(df):
+        # Same time fill as build_feature_frame, so the windows line up
+        times = pd.to_datetime(df['trans_date_trans_time'], errors='coerce').fillna(pd.Timestamp.now())
+        lookback = pd.Timedelta(seconds=max(VELOCITY_PARAMS['windows'].values()))
+        cards = df['cc_num'] if 'cc_num' in df else pd.Series(None, index=df.index, dtype=object)
+        selected_cards = cards.loc[rows.index].map(card_key).fillna('')
+        since = times.loc[rows.index].groupby(selected_cards).min() - lookback
+        
+        candidates = df.index[(times >= since.min()).to_numpy()]
+        card_since = cards.loc[candidates].map(card_key).fillna('').map(since)
+        context = candidates[(times.loc[candidates] >= card_since).to_numpy()].union(rows.index)
+        frame = build_feature_frame(df.loc[context].copy()).loc[rows.index]
+    else:
+        frame = build_feature_frame(df.copy())
+    return frame[model_feature_columns() + ['is_fraud']]
+
+def clean_training_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Add missing critical columns and give raw inputs their defaults.
+
+    Derived and velocity columns stay NaN where the CSV lacks them (logged
+    rows carry them), so build_feature_frame recomputes them rather than
+    training on zeros.
+    """
+    required_cols = ['amt', 'city_pop', 'lat', 'long', 'merch_lat', 'merch_long',
+                     'merchant', 'category', 'gender', 'trans_date_trans_time']
+    for col in required_cols:
+        if col not in df.columns:
+            df[col] = None
+    if 'is_fraud' not in df.columns:
+        df['is_fraud'] = 0
+    if 'fraud_probability' not in df.columns:
+        df['fraud_probability'] = 0.0
+    
+    df = df.dropna(subset=['is_fraud'])
+    defaults = {**FEATURE_SPEC['defaults'], 'fraud_probability': 0.0}
+    return df.fillna({c: v for c, v in defaults.items() if c in df})
+
+def load_training_frame(csv_path: str) -> pd.DataFrame:
+    """Every worker's rows: the CSV plus the whole transaction log, cleaned"""
+    df, rows = TransactionLog(csv_path).read(**TRANSACTION_LOG_PARAMS['read_kwargs'])
+    if rows:
+        df = concat_compact(df, pd.DataFrame(rows))
+    return clean_training_frame(df)
+
+def retrain_from_disk(csv_path: str, model_path: str, mode: str = 'full') -> Dict:
+    """Build the `mode` snapshot from disk and fit on it.
+
+    Runs in the retrain worker process: the serving process does no
+    snapshot work, and rows logged by other gunicorn workers are included.
+    """
+    return fit_fraud_model(training_frame(load_training_frame(csv_path), mode), model_path, mode)
+
+def extend_forest(model, X: pd.DataFrame, y: pd.Series, n_trees: int):
+    """Swap the `n_trees` oldest trees of a fitted pipeline for new ones fitted
+    on (X, y). The scaler and encoder are reused as they are."""
+    preprocessor = model.named_steps['preprocessor']
+    classifier = model.named_steps['classifier']
+    if set(np.unique(y)) != set(classifier.classes_):
+        raise ValueError("warm_start needs every class in the new rows")
+    
+    X_t = preprocessor.transform(X)
+    try:
+        X_t, y = model.named_steps['smote'].fit_resample(X_t, y)
+    except ValueError as e:
+        print(f"⚠️ Skipping SMOTE for warm start: {e}")
+    
+    # 'balanced' presets are recomputed per fit; pass the new rows' weights explicitly
+    from sklearn.utils.class_weight import compute_class_weight
+    class_weight = classifier.class_weight
+    if class_weight == 'balanced':
+        weights = compute_class_weight('balanced', classes=classifier.classes_, y=y)
+        classifier.set_params(class_weight=dict(zip(classifier.classes_, weights)))
+    
+    total = len(classifier.estimators_)
+    n_trees = min(n_trees, total)
+    classifier.set_params(warm_start=True, n_estimators=total + n_trees)
+    classifier.fit(X_t, y)
+    classifier.estimators_ = classifier.estimators_[n_trees:]
+    classifier.set_params(warm_start=False, n_estimators=total, class_weight=class_weight)
+    return model
+
+def build_fraud_pipeline() -> 'ImbPipeline':
+    """Preprocessing + SMOTE + random forest, unfitted"""
+    from sklearn.compose import ColumnTransformer
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.preprocessing import OneHotEncoder, StandardScaler
+    from imblearn.over_sampling import SMOTE
+    from imblearn.pipeline import Pipeline as ImbPipeline
+    
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('num', StandardScaler(), FEATURE_SPEC['numeric']),
+            ('cat', OneHotEncoder(handle_unknown='ignore'), FEATURE_SPEC['categorical'])
+        ])
+    
+    return ImbPipeline([
+        ('preprocessor', preprocessor),
+        ('smote', SMOTE(random_state=42, sampling_strategy=0.1)),
+        ('classifier', RandomForestClassifier(
+            n_estimators=200,
+            class_weight='balanced',
+            random_state=42,
+            n_jobs=-1
+        ))
+    ])
+
+def _holdout_auc(model, X_test: pd.DataFrame, y_test: pd.Series) -> Optional[float]:
+    from sklearn.metrics import roc_auc_score
+    try:
+        return float(roc_auc_score(y_test, model.predict_proba(X_test)[:, 1]))
+    except Exception:
+        return None
+
+def fit_fraud_model(data: pd.DataFrame, model_path: str, mode: str = 'full') -> Dict:
+    """Fit the pipeline on a data snapshot and save it as a candidate file.
+
+    Runs inside a worker process during background retraining, so it only
+    uses its arguments and the filesystem. The model currently at
+    `model_path` is scored on the same holdout split for comparison (its
+    score is optimistic, since it may have trained on some of those rows).
+    In 'warm_start' mode the candidate is that model with refreshed trees.
+    """
+    import joblib
+    from sklearn.model_selection import train_test_split
+    
+    X = data[model_feature_columns()]
+    y = data['is_fraud']
+    
+    # Train-test split
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=42, stratify=y
+    )
+    
+    started = time.perf_counter()
+    if mode == 'warm_start' and os.path.exists(model_path):
+        model = extend_forest(load_model_file(model_path), X_train, y_train,
+                              RETRAIN_PARAMS['warm_start_trees'])
+    else:
+        mode = 'full' if mode == 'warm_start' else mode
+        model = build_fraud_pipeline()
+        model.fit(X_train, y_train)
+    seconds = time.perf_counter() - started
+    
+    candidate_path = f"{model_path}.{os.getpid()}.candidate"
+    joblib.dump(model, candidate_path)
+    
+    baseline_auc = None
+    if os.path.exists(model_path):
+        try:
+            baseline_auc = _holdout_auc(load_model_file(model_path), X_test, y_test)
+        except Exception:
+            pass
+    
+    return {
+        'path': candidate_path,
+        'mode': mode,
+        'seconds': seconds,
+        'rows': len(data),
+        'auc': _holdout_auc(model, X_test, y_test),
+        'baseline_auc': baseline_auc
+    }
+
+def load_model_file(path: str):
+    import joblib
+    return joblib.load(path)
+
+def check_feature_parity(model) -> bool:
+    """True if a fitted pipeline was trained on exactly FEATURE_SPEC's columns"""
+    try:
+        preprocessor = model.named_steps['preprocessor']
+        columns = [c for name, _, cols in preprocessor.transformers_ if name != 'remainder' for c in cols]
+    except Exception:
+        return False
+    return columns == model_feature_columns()
+
+class FileLock:
+    """Inter-process lock held on a lock file (fcntl on POSIX, msvcrt on Windows)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        self._file = open(self.path, 'a+')
+        try:
+            if fcntl:
+                fcntl.flock(self._file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            self._file.close()
+            self._file = None
+            return False
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            if fcntl:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# ==================================================================
+# COMPILED INFERENCE
+# ==================================================================
+INFERENCE_PARAMS = {
+    'compiled': True  # score with CompiledFraudModel instead of the sklearn pipeline
+}
+
+class CompiledFraudModel:
+    """Inference-only copy of a fitted fraud pipeline.
+
+    The scaler constants, one-hot category→column dicts and every tree's
+    node arrays are pulled out of the pipeline once; the node arrays of all
+    trees are concatenated into a few contiguous numpy arrays, which stay
+    shared copy-on-write between preloaded workers. Rows are routed through
+    every tree at once, level by level, instead of going through
+    ColumnTransformer plus joblib's thread fan-out. Features are rounded to
+    float32 before the splits, as sklearn does, so probabilities match the
+    pipeline's. No reference to the pipeline is kept.
+    """
+
+    def __init__(self, pipeline):
+        preprocessor = pipeline.named_steps['preprocessor']
+        classifier = pipeline.named_steps['classifier']
+        
+        self.numeric_columns, self.categorical_columns = [], []
+        self.categories: List[Dict] = []
+        self.missing_index: List[Optional[int]] = []
+        offset = 0
+        for name, transformer, columns in preprocessor.transformers_:
+            if name == 'num':
+                self.numeric_columns = list(columns)
+                self.mean = np.asarray(transformer.mean_, dtype=np.float64)
+                self.scale = np.asarray(transformer.scale_, dtype=np.float64)
+                offset += len(columns)
+        for name, transformer, columns in preprocessor.transformers_:
+            if name == 'cat':
+                self.categorical_columns = list(columns)
+                for categories in transformer.categories_:
+                    mapping, missing = {}, None
+                    for i, category in enumerate(categories):
+                        if category is None or (isinstance(category, float) and np.isnan(category)):
+                            missing = offset + i
+                        else:
+                            mapping[category] = offset + i
+                    self.categories.append(mapping)
+                    self.missing_index.append(missing)
+                    offset += len(categories)
+        self.n_features = offset
+        self.classes_ = classifier.classes_
+        
+        # Node arrays of all trees back to back; child ids are global, -1 marks a leaf
+        trees = [estimator.tree_ for estimator in classifier.estimators_]
+        counts = np.array([tree.node_count for tree in trees], dtype=np.int64)
+        self.roots = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        self.left = np.concatenate([
+            np.where(tree.children_left == -1, -1, tree.children_left + root)
+            for tree, root in zip(trees, self.roots)
+        ]).astype(np.int64)
+        self.right = np.concatenate([tree.children_right + root for tree, root in zip(trees, self.roots)])
+        self.feature = np.concatenate([tree.feature for tree in trees]).astype(np.int32)
+        self.threshold = np.concatenate([tree.threshold for tree in trees])
+        self.missing_left = np.concatenate([
+            getattr(tree, 'missing_go_to_left', np.zeros(tree.node_count, dtype=np.uint8)) for tree in trees
+        ]).astype(bool)
+        values = np.concatenate([tree.value[:, 0, :] for tree in trees])
+        totals = values.sum(axis=1)
+        totals[totals == 0.0] = 1.0
+        self.proba = values / totals[:, None]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in
+                   ('roots', 'left', 'right', 'feature', 'threshold', 'missing_left', 'proba'))
+
+    def _feature_rows(self, X: pd.DataFrame) -> np.ndarray:
+        numeric = np.asarray(X[self.numeric_columns], dtype=np.float64)
+        numeric = (numeric - self.mean) / self.scale
+        rows = np.zeros((len(X), self.n_features), dtype=np.float64)
+        rows[:, :len(self.numeric_columns)] = numeric
+        for j, column in enumerate(self.categorical_columns):
+            mapping, missing = self.categories[j], self.missing_index[j]
+            for i, value in enumerate(X[column].tolist()):
+                if value is None or (isinstance(value, float) and value != value):
+                    index = missing
+                else:
+                    index = mapping.get(value)
+                if index is not None:
+                    rows[i, index] = 1.0
+        return rows.astype(np.float32)
+
+    def _leaves(self, rows: np.ndarray) -> np.ndarray:
+        """Leaf reached in every tree by every row, shape (rows, trees)"""
+        n_trees = len(self.roots)
+        flat = rows.ravel()
+        nodes = np.tile(self.roots, len(rows))
+        offsets = np.repeat(np.arange(0, flat.size, self.n_features), n_trees)
+        active = np.flatnonzero(self.left[nodes] != -1)
+        while active.size:
+            current = nodes[active]
+            x = flat[offsets[active] + self.feature[current]]
+            go_left = x <= self.threshold[current]
+            nan = np.isnan(x)
+            if nan.any():
+                go_left[nan] = self.missing_left[current[nan]]
+            current = np.where(go_left, self.left[current], self.right[current])
+            nodes[active] = current
+            active = active[self.left[current] != -1]
+        return nodes.reshape(len(rows), n_trees)
+
+    def predict_proba(self, X: pd.DataFrame) -> np.ndarray:
+        return self.proba[self._leaves(self._feature_rows(X))].mean(axis=1)
+
+
+def compile_fraud_model(model):
+    """CompiledFraudModel for `model`, or the model itself if it can't be compiled"""
+    if model is None or not INFERENCE_PARAMS['compiled']:
+        return model
+    try:
+        return CompiledFraudModel(model)
+    except Exception as e:
+        print(f"⚠️ Model compilation failed, using sklearn pipeline: {e}")
+        return model
+
+
+# ==================================================================
+# FRAUD DETECTION SYSTEM
+# ==================================================================
+class PersistentAutoRetrainFraudDetector:
+    
+    def __init__(self, model_path='fraud_detection_model.pkl', 
+                 training_data_path='hackathon_ai_dataset.csv',
+                 state_path='fraud_detector_state.json'):
+        """Initialize with persistent counter"""
+        # Convert to absolute paths
+        self.model_path = os.path.abspath(model_path)
+        self.training_data_path = os.path.abspath(training_data_path)
+        self.state_path = os.path.abspath(state_path)
+        
+        self.retrain_interval = RETRAIN_PARAMS['interval']
+        self.transaction_log = TransactionLog(self.training_data_path)
+        self._log_lock = threading.RLock()
+        self._model_lock = threading.Lock()
+        self._retrain_executor = None
+        self._retrain_future = None
+        self._reload_thread = None
+        self._model_mtime = None
+        self._retrains = 0
+        
+        print(f"State file will be saved to: {self.state_path}")
+        print(f"Current working directory: {os.getcwd()}")
+        
         # Load or initialize state
         self._load_state()
         
+        # Read the training data once, then clean it in memory
+        self._validate_and_repair_file()
+        self.velocity = VelocityStore.from_frame(self.original_df) if VELOCITY_PARAMS['enabled'] else None
+        self.idempotency = IdempotencyCache(IDEMPOTENCY_PARAMS['path']) if IDEMPOTENCY_PARAMS['enabled'] else None
+        
         # Load or create model
         if os.path.exists(self.model_path):
-            self.model = joblib.load(self.model_path)
+            model = load_model_file(self.model_path)
+            self._model_mtime = os.stat(self.model_path).st_mtime_ns
             print("✅ Loaded existing model")
+            if not check_feature_parity(model):
+                print("⚠️ Saved model does not match FEATURE_SPEC - retraining")
+                retrained = self._train_new_model()
+                model = model if retrained is None else retrained
+            self.model = model
         else:
             self.model = self._train_new_model()
             
-        self._validate_and_repair_file()
         print(f"✅ System initialized with auto-retraining every {self.retrain_interval} entries")
         print(f"ℹ️ Current entry count: {self.new_entry_count}/{self.retrain_interval}")
 
+    @property
+    def model(self):
+        """The serving scorer (the fitted pipeline itself only if it can't be compiled)"""
+        return self._scorer
+
+    @model.setter
+    def model(self, model):
+        """Compile a fitted pipeline and serve it; the pipeline is not kept"""
+        self._scorer = compile_fraud_model(model)
+
+    @property
+    def original_df(self) -> pd.DataFrame:
+        """Training frame; rows logged since the last access are folded in lazily"""
+        with self._log_lock:
+            if self._log_tail:
+                tail, self._log_tail = self._log_tail, []
+                self._original_df = concat_compact(self._original_df, pd.DataFrame(tail))
+            return self._original_df
+
+    @original_df.setter
+    def original_df(self, df: pd.DataFrame):
+        self._original_df = df
+
+    def _load_training_frame(self, **read_kwargs):
+        """Read the compacted CSV and queue any rows still in the log"""
+        self._original_df, self._log_tail = self.transaction_log.read(**read_kwargs)
+        self.transaction_log.pending = len(self._log_tail)
+
     def _load_state(self):
         """Load persistent state from file"""
         try:
             # Create directory if it doesn't exist
             os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
             
-            if os.path.exists(self.state_path):
-                with open(self.state_path, 'r') as f:
-                    state = json.load(f)
-                    self.new_entry_count = state.get('new_entry_count', 0)
-                    print(f"Loaded state: {state}")
+            with FileLock(self.state_path + '.lock'):
+                state = self._read_state()
+            if state is not None:
+                self.new_entry_count = state.get('new_entry_count', 0)
+                print(f"Loaded state: {state}")
             else:
                 self.new_entry_count = 0
                 # Initialize file with default values
@@ -467,55 +2713,54 @@ class PersistentAutoRetrainFraudDetector:
             except Exception as e2:
                 print(f"⚠️ Failed to save initial state: {e2}")
 
+    def _read_state(self) -> Optional[Dict]:
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, 'r') as f:
+            return json.load(f)
+
+    def _write_state(self):
+        """Write the state file atomically (caller holds the state lock)"""
+        state = {
+            'new_entry_count': self.new_entry_count,
+            'last_updated': datetime.now().isoformat()
+        }
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+        return state
+
     def _save_state(self):
         """Save current state to file"""
         try:
             # Create directory if it doesn't exist
             os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
             
-            state = {
-                'new_entry_count': self.new_entry_count,
-                'last_updated': datetime.now().isoformat()
-            }
-            with open(self.state_path, 'w') as f:
-                json.dump(state, f, indent=2)
+            with FileLock(self.state_path + '.lock'):
+                state = self._write_state()
             print(f"State saved: {state}")
         except Exception as e:
             print(f"⚠️ State saving error: {e}")
-            # Try with absolute path as fallback
+
+    def _update_entry_count(self, delta: int) -> int:
+        """Read-modify-write the shared counter under an inter-process lock"""
+        with FileLock(self.state_path + '.lock'):
             try:
-                abs_path = os.path.abspath(self.state_path)
-                os.makedirs(os.path.dirname(abs_path), exist_ok=True)
-                with open(abs_path, 'w') as f:
-                    json.dump(state, f, indent=2)
-                print(f"State saved to absolute path: {abs_path}")
-            except Exception as e2:
-                print(f"⚠️ Absolute path save also failed: {e2}")
+                state = self._read_state() or {}
+            except (OSError, ValueError):
+                state = {}
+            self.new_entry_count = max(0, state.get('new_entry_count', 0) + delta)
+            self._write_state()
+        return self.new_entry_count
 
     def _validate_and_repair_file(self):
         """Validate and prepare the training data file"""
         try:
             if os.path.exists(self.training_data_path):
-                self.original_df = pd.read_csv(self.training_data_path, low_memory=False)
+                self._load_training_frame(**TRANSACTION_LOG_PARAMS['read_kwargs'])
+                self.original_df = clean_training_frame(self.original_df)
                 
-                # Ensure critical columns exist
-                required_cols = ['amt', 'city_pop', 'lat', 'long', 'merch_lat', 'merch_long',
-                               'merchant', 'category', 'gender', 'trans_date_trans_time']
-                
-                for col in required_cols:
-                    if col not in self.original_df.columns:
-                        self.original_df[col] = None
-                
-                if 'is_fraud' not in self.original_df.columns:
-                    self.original_df['is_fraud'] = 0
-                if 'fraud_probability' not in self.original_df.columns:
-                    self.original_df['fraud_probability'] = 0.0
-                
-                # Clean data
-                self.original_df = self.original_df.dropna(subset=['is_fraud'])
-                numeric_cols = self.original_df.select_dtypes(include=['number']).columns
-                self.original_df[numeric_cols] = self.original_df[numeric_cols].fillna(0)
-                    
                 self.original_columns = self.original_df.columns.tolist()
                 print(f"ℹ️ Loaded dataset with {len(self.original_df)} clean entries")
             else:
@@ -525,48 +2770,24 @@ class PersistentAutoRetrainFraudDetector:
             print(f"⚠️ File validation error: {e}")
             raise
 
-    def _train_new_model(self):
-        """Train a new model from current data"""
-        print("⏳ Training new model...")
+    def _next_retrain_mode(self) -> str:
+        """RETRAIN_PARAMS['mode'], with a periodic full refit for incremental modes"""
+        mode = RETRAIN_PARAMS['mode'] if RETRAIN_PARAMS['mode'] in RETRAIN_MODES else 'full'
+        self._retrains += 1
+        full_every = RETRAIN_PARAMS['full_every']
+        if mode != 'full' and full_every and self._retrains % full_every == 0:
+            return 'full'
+        return mode
+
+    def _train_new_model(self, mode: str = 'full'):
+        """Train a new model from current data (blocking)"""
+        print(f"⏳ Training new model ({mode})...")
         
         try:
-            # Define features and preprocessing
-            numeric_features = ['amt', 'city_pop', 'cc_num','zip','lat','long','unix_time','merch_lat','merch_long']
-            categorical_features = ['merchant', 'category', 'gender']
-            
-            preprocessor = ColumnTransformer(
-                transformers=[
-                    ('num', StandardScaler(), numeric_features),
-                    ('cat', OneHotEncoder(handle_unknown='ignore'), categorical_features)
-                ])
-            
-            # Create pipeline
-            model = ImbPipeline([
-                ('preprocessor', preprocessor),
-                ('smote', SMOTE(random_state=42, sampling_strategy=0.1)),
-                ('classifier', RandomForestClassifier(
-                    n_estimators=200,
-                    class_weight='balanced',
-                    random_state=42,
-                    n_jobs=-1
-                ))
-            ])
-            
-            # Prepare data
-            features = numeric_features + categorical_features
-            X = self.original_df[features]
-            y = self.original_df['is_fraud']
-            
-            # Train-test split
-            X_train, X_test, y_train, y_test = train_test_split(
-                X, y, test_size=0.2, random_state=42, stratify=y
-            )
-            
-            # Train model
-            model.fit(X_train, y_train)
-            
-            # Save model
-            joblib.dump(model, self.model_path)
+            result = retrain_from_disk(self.training_data_path, self.model_path, mode)
+            model = load_model_file(result['path'])
+            os.replace(result['path'], self.model_path)
+            self._model_mtime = os.stat(self.model_path).st_mtime_ns
             print("✅ New model trained and saved")
             
             return model
@@ -575,168 +2796,721 @@ class PersistentAutoRetrainFraudDetector:
             print(f"🚨 Training failed: {e}")
             return self.model if hasattr(self, 'model') else None
 
-    # def _check_for_retrain(self):
-    #     """Check if we need to retrain the model"""
-    #     self.new_entry_count += 1
-    #     self._save_state()  # Persist the counter immediately
+    def _check_for_retrain(self, new_entries: int = 1) -> bool:
+        """Count new entries and start a background retrain when due"""
+        count = self._update_entry_count(new_entries)
+        print(f"ℹ️ Entry count: {count}/{self.retrain_interval}")
         
-    #     print(f"ℹ️ Entry count: {self.new_entry_count}/{self.retrain_interval}")
+        if count < self.retrain_interval:
+            return False
+        if not RETRAIN_PARAMS['background']:
+            self._retrain_sync()
+            return True
+        return self._start_background_retrain(count)
+
+    def _retrain_sync(self):
+        old_model = self.model
+        model = self._train_new_model(self._next_retrain_mode())
+        if model is not old_model:
+            with self._model_lock:
+                self.model = model
+            self._update_entry_count(-self.new_entry_count)
+            print("🔄 Model successfully retrained")
+
+    def _start_background_retrain(self, count: int) -> bool:
+        with self._model_lock:
+            if self._retrain_future is not None and not self._retrain_future.done():
+                return False
+            
+            # Only one worker process may retrain at a time
+            retrain_lock = FileLock(self.model_path + '.retrain.lock')
+            if not retrain_lock.acquire(blocking=False):
+                return False
+            
+            mode = self._next_retrain_mode()
+            print(f"🔁 Retraining ({mode}) in background after {count} new entries")
+            try:
+                if self._retrain_executor is None:
+                    self._retrain_executor = process_pool(1)
+                # The worker reads its own snapshot, so nothing heavy runs here
+                future = self._retrain_executor.submit(
+                    retrain_from_disk, self.training_data_path, self.model_path, mode
+                )
+            except Exception as e:
+                retrain_lock.release()
+                print(f"🚨 Could not start retraining: {e}")
+                return False
+            self._retrain_future = future
         
-    #     if self.new_entry_count >= self.retrain_interval:
-    #         print(f"🔁 Attempting retraining after {self.new_entry_count} new entries")
-    #         try:
-    #             old_model = self.model
-    #             self.model = self._train_new_model()
-                
-    #             if self.model is not old_model:
-    #                 print("🔄 Model successfully retrained")
-    #                 self.new_entry_count = 0
-    #                 self._save_state()  # Reset counter in persistent storage
-    #                 return True
-    #             else:
-    #                 print("⚠️ Retraining failed - using previous model")
-    #                 return False
-                    
-    #         except Exception as e:
-    #             print(f"🚨 Retraining failed: {e}")
-    #             return False
-    #     return False
+        future.add_done_callback(lambda f: self._finish_background_retrain(f, count, retrain_lock))
+        return True
+
+    def _finish_background_retrain(self, future, count: int, retrain_lock):
+        """Validate the candidate and swap it in; the old model serves until then"""
+        try:
+            result = future.result()
+            auc, baseline = result['auc'], result['baseline_auc']
+            if auc is None or auc < RETRAIN_PARAMS['min_auc'] or \
+               (baseline is not None and auc < baseline - RETRAIN_PARAMS['max_auc_drop']):
+                os.remove(result['path'])
+                self._update_entry_count(-count)
+                print(f"⚠️ Retrained model rejected (AUC {auc} vs current {baseline}) - keeping previous model")
+                return
+            
+            model = load_model_file(result['path'])
+            os.replace(result['path'], self.model_path)
+            with self._model_lock:
+                self.model = model
+                self._model_mtime = os.stat(self.model_path).st_mtime_ns
+            self._update_entry_count(-count)
+            print(f"🔄 Model hot-swapped after {result['mode']} retraining on {result['rows']} rows "
+                  f"in {result['seconds']:.1f}s (AUC {auc:.3f})")
+        except Exception as e:
+            print(f"🚨 Retraining failed: {e}")
+        finally:
+            retrain_lock.release()
+
+    def _current_model(self):
+        """The scorer to use; a model published by another worker is loaded
+        in the background while the current one keeps serving"""
+        try:
+            mtime = os.stat(self.model_path).st_mtime_ns
+            if self._model_mtime is not None and mtime != self._model_mtime:
+                self._start_model_reload(mtime)
+        except OSError:
+            pass
+        return self._scorer
+
+    def _start_model_reload(self, mtime: int):
+        with self._model_lock:
+            if mtime == self._model_mtime or (self._reload_thread is not None and self._reload_thread.is_alive()):
+                return
+            self._reload_thread = threading.Thread(target=self._reload_model, args=(mtime,), daemon=True)
+            self._reload_thread.start()
+
+    def _reload_model(self, mtime: int):
+        """Load and compile off the request path, then swap the reference"""
+        try:
+            scorer = compile_fraud_model(load_model_file(self.model_path))
+            with self._model_lock:
+                self._scorer = scorer
+                self._model_mtime = mtime
+            print("🔄 Reloaded model retrained by another worker")
+        except Exception as e:
+            with self._model_lock:
+                self._model_mtime = mtime  # don't retry the same file on every request
+            print(f"⚠️ Could not reload model: {e}")
 
     def preprocess_new_entry(self, data_dict):
         """Preprocess a new transaction entry"""
+        return self.preprocess_entries([data_dict])
+
+    def preprocess_entries(self, records: List[Dict]) -> Optional[pd.DataFrame]:
+        """Preprocess a batch of transaction entries as one frame"""
         try:
-            # Map incoming JSON to expected CSV structure
-            transaction_data = data_dict.get('transaction_data', {})
-            processed_data = {
-                'trans_date_trans_time': transaction_data.get('trans_date_trans_time'),
-                'cc_num': transaction_data.get('cardNum'),
-                'merchant': transaction_data.get('merchant'),
-                'category': transaction_data.get('category'),
-                'amt': transaction_data.get('Amount'),
-                'first': transaction_data.get('first'),
-                'last': transaction_data.get('last'),
-                'gender': transaction_data.get('gender'),
-                'street': transaction_data.get('street'),
-                'city': transaction_data.get('city'),
-                'state': transaction_data.get('state'),
-                'zip': transaction_data.get('zip'),
-                'lat': transaction_data.get('lat'),
-                'long': transaction_data.get('long'),
-                'city_pop': transaction_data.get('city_pop'),
-                'job': transaction_data.get('job'),
-                'dob': transaction_data.get('dob'),
-                'transaction_num': transaction_data.get('transactionId'),
-                'unix_time': transaction_data.get('unix_time'),
-                'merch_lat': transaction_data.get('merch_lat'),
-                'merch_long': transaction_data.get('merch_long'),
-                'is_fraud': transaction_data.get('is_fraud', 0)
-            }
-            # Default values
-            defaults = {
-                'amt': 0.0, 'city_pop': 1, 'lat': 0.0, 'long': 0.0,
-                'merch_lat': 0.0, 'merch_long': 0.0, 'hour': 0,
-                'day_of_week': 0, 'is_night': 0, 'distance_from_home': 0.0,
-                'age': 0, 'amt_per_city_pop': 0.0, 'is_weekend': 0
-            }
-            data_dict = {**defaults, **data_dict}
-            
-            df = pd.DataFrame([data_dict])
-            
-            # Feature engineering
-            df['trans_date_trans_time'] = pd.to_datetime(
-                df['trans_date_trans_time'], errors='coerce'
-            ).fillna(pd.Timestamp.now())
-            
-            df['hour'] = df['trans_date_trans_time'].dt.hour.fillna(0).astype(int)
-            df['day_of_week'] = df['trans_date_trans_time'].dt.dayofweek.fillna(0).astype(int)
-            df['is_night'] = ((df['hour'] >= 22) | (df['hour'] <= 5)).astype(int)
-            df['is_weekend'] = (df['day_of_week'] >= 5).astype(int)
-            
-            df['distance_from_home'] = df.apply(
-                lambda row: float(geodesic(
-                    (float(row['lat']), float(row['long'])),
-                    (float(row['merch_lat']), float(row['merch_long']))
-                ).km),
-                axis=1
-            ).fillna(0)
-            
-            current_year = datetime.now().year
-            df['age'] = (current_year - df['trans_date_trans_time'].dt.year.fillna(current_year)).astype(int)
-            df['amt_per_city_pop'] = (df['amt'] / (df['city_pop'] + 1)).fillna(0)
-            
-            return df
-            
+            with timed('preprocess'):
+                return build_request_features(records, velocity=self.velocity)
         except Exception as e:
             print(f"🚨 Preprocessing failed: {e}")
             return None
 
-    def predict_and_append(self, data_dict, threshold=0.2):
+    def predict_and_append(self, data_dict, threshold=0.2, features: Optional[pd.DataFrame] = None):
         """Process transaction with auto-retraining"""
         try:
-            # Preprocess
-            X_new = self.preprocess_new_entry(data_dict)
-            if X_new is None:
-                return "Error", 0.0
-                
-            # Predict
-            probability = float(self.model.predict_proba(X_new)[0][1])
-            prediction = 1 if probability >= threshold else 0
-            
-            # Prepare complete record
-            complete_data = {
-                **data_dict,
-                'hour': int(X_new['hour'].values[0]),
-                'day_of_week': int(X_new['day_of_week'].values[0]),
-                'is_night': int(X_new['is_night'].values[0]),
-                'is_weekend': int(X_new['is_weekend'].values[0]),
-                'distance_from_home': float(X_new['distance_from_home'].values[0]),
-                'age': int(X_new['age'].values[0]),
-                'amt_per_city_pop': float(X_new['amt_per_city_pop'].values[0]),
-                'is_fraud': int(prediction),
-                'fraud_probability': float(probability),
-                'processing_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
-            
-            # Append to dataset
-            new_row = pd.DataFrame([complete_data])
-            self.original_df = pd.concat([self.original_df, new_row], ignore_index=True)
-            self.original_df.to_csv(self.training_data_path, index=False)
-            
-            print(f"✅ Appended: {'Fraud' if prediction else 'Not Fraud'} ({probability:.2%})")
-            
-            # Check if we need to retrain
-            # self._check_for_retrain()
+            key = transaction_id(data_dict) if self.idempotency is not None else None
+            with self.idempotency.lock_for(key) if key else nullcontext():
+                stored = self.idempotency.get(key) if key else None
+                if stored is not None:
+                    print(f"♻️ Retried transaction {key}: returning stored score ({stored:.2%})")
+                    return ("Fraud" if stored >= threshold else "Not Fraud"), stored
+                result, probability = self.predict_many(
+                    [data_dict], threshold=threshold, append=True, features=features
+                )[0]
+            if result != "Error":
+                print(f"✅ Appended: {result} ({probability:.2%})")
             
-            return "Fraud" if prediction else "Not Fraud", probability
+            return result, probability
             
         except Exception as e:
             print(f"🚨 Processing failed: {e}")
             return "Error", 0.0
 
+    def predict_many(self, records: List[Dict], threshold=0.2, append=False,
+                     features: Optional[pd.DataFrame] = None) -> List[Tuple[str, float]]:
+        """Score a batch of transactions with a single predict_proba call.
+        Pass `features` if the caller already ran preprocess_entries.
+
+        With `append`, transactions whose id was already logged get their
+        stored probability back and are neither re-scored nor re-appended."""
+        if not records:
+            return []
+        
+        ids = [None] * len(records)
+        if append and self.idempotency is not None:
+            ids = [transaction_id(record) for record in records]
+        stored, first = {}, {}
+        for i, key in enumerate(ids):
+            if key is None or key in first:
+                continue
+            first[key] = i
+            probability = self.idempotency.get(key)
+            if probability is not None:
+                stored[key] = probability
+        # Score each new id once; rows without an id are always scored
+        fresh = [i for i, key in enumerate(ids) if key is None or (key not in stored and first[key] == i)]
+        if len(fresh) < len(records):
+            print(f"♻️ Returning stored scores for {len(records) - len(fresh)} retried transactions")
+        
+        probabilities = np.zeros(len(records))
+        if fresh:
+            # Preprocess
+            if features is not None:
+                X_new = features if len(fresh) == len(records) else features.iloc[fresh].reset_index(drop=True)
+            else:
+                X_new = self.preprocess_entries([records[i] for i in fresh])
+            if X_new is None:
+                return [("Error", 0.0)] * len(records)
+            
+            # Predict
+            with timed('inference'):
+                scored = self._current_model().predict_proba(X_new[model_feature_columns()])[:, 1].astype(float)
+            
+            if append:
+                self._append_records(X_new, scored, (scored >= threshold).astype(int))
+                if self.idempotency is not None:
+                    self.idempotency.put({ids[i]: float(p) for i, p in zip(fresh, scored) if ids[i] is not None})
+            probabilities[fresh] = scored
+        
+        scored_rows = set(fresh)
+        for i, key in enumerate(ids):
+            if key is not None and i not in scored_rows:
+                probabilities[i] = stored[key] if key in stored else probabilities[first[key]]
+        predictions = (probabilities >= threshold).astype(int)
+        
+        return [("Fraud" if prediction else "Not Fraud", float(probability))
+                for prediction, probability in zip(predictions, probabilities)]
+
+    def _append_records(self, X_new: pd.DataFrame, probabilities: np.ndarray, predictions: np.ndarray):
+        """Persist scored rows (canonical columns plus engineered features)"""
+        processing_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        complete_rows = X_new.assign(
+            is_fraud=predictions.astype(int),
+            fraud_probability=probabilities.astype(float),
+            processing_time=processing_time
+        ).to_dict('records')
+        
+        with timed('persistence'):
+            if self.velocity is not None:
+                self.velocity.observe(X_new)
+            # Append to dataset (only the new rows hit disk)
+            with self._log_lock:
+                self.transaction_log.append(complete_rows)
+                self._log_tail.extend(complete_rows)
+            # Folding the log into the CSV is a full rewrite: never on the request thread
+            if self.transaction_log.needs_compaction():
+                self.transaction_log.start_compaction()
+        
+        # Check if we need to retrain
+        try:
+            with timed('retrain_check'):
+                self._check_for_retrain(len(complete_rows))
+        except Exception as e:
+            print(f"⚠️ Retrain check failed: {e}")
+
 
 # ==================================================================
 # INITIALIZE SYSTEMS
 # ==================================================================
-try:
-    fraud_detector = PersistentAutoRetrainFraudDetector()
-    smurfing_detector = SmurfingDetector(
+# Each system is built on first use, once per process. Under
+# `gunicorn -c gunicorn.conf.py main:app` the master builds them before
+# forking (AI_SERVER_PRELOAD=1) and workers share the pages copy-on-write.
+SYSTEM_FACTORIES = {
+    'fraud_detector': lambda: PersistentAutoRetrainFraudDetector(),
+    'smurfing_detector': lambda: SmurfingDetector(
         csv_file_path='filtered_data (1).csv',
         json_file_path='fraud_community.json'
+    ),
+    'ocr': lambda: OcrClient(OCR_PARAMS['base_url'], os.getenv("GROQ_API_KEY")),
+    'analysis_cache': lambda: (
+        IdempotencyCache(IDEMPOTENCY_PARAMS['analysis_path']) if IDEMPOTENCY_PARAMS['enabled'] else None
     )
-except Exception as e:
-    print(f"Failed to initialize systems: {e}")
-    fraud_detector = None
-    smurfing_detector = None
+}
+_systems: Dict[str, object] = {}
+_system_locks = {name: threading.Lock() for name in SYSTEM_FACTORIES}
+_warm_up_thread = None
 
-# Initialize Groq-based LLM
-chat = ChatGroq(model_name="llama-3.3-70b-versatile", api_key=os.getenv("GROQ_API_KEY"))
+def get_system(name: str):
+    """The named system, building it on first use (None if that failed)"""
+    if name in _systems:
+        return _systems[name]
+    with _system_locks[name]:
+        if name not in _systems:
+            try:
+                _systems[name] = SYSTEM_FACTORIES[name]()
+            except Exception as e:
+                print(f"Failed to initialize {name}: {e}")
+                _systems[name] = None
+    return _systems[name]
+
+def get_fraud_detector() -> Optional['PersistentAutoRetrainFraudDetector']:
+    return get_system('fraud_detector')
+
+def get_smurfing_detector() -> Optional[SmurfingDetector]:
+    return get_system('smurfing_detector')
+
+def start_warm_up():
+    """Load the detectors in the background (first /ready call)"""
+    global _warm_up_thread
+    if _warm_up_thread is None:
+        _warm_up_thread = threading.Thread(
+            target=lambda: (get_fraud_detector(), get_smurfing_detector()), daemon=True
+        )
+        _warm_up_thread.start()
+
+def preload():
+    """Build the detectors now, e.g. in a pre-fork master process"""
+    get_fraud_detector()
+    get_smurfing_detector()
+    # Keep the loaded objects out of the collector so workers don't
+    # dirty the shared pages during GC passes
+    gc.freeze()
+
+# Pool workers re-import this module; they must not load the detectors too
+if os.getenv('AI_SERVER_PRELOAD') == '1' and multiprocessing.parent_process() is None:
+    preload()
+
+# ==================================================================
+# SERVING
+# ==================================================================
+# `python main.py` is the dev server. In production gunicorn runs threaded
+# workers (gunicorn.conf.py) and every scoring endpoint hands its work to
+# one bounded executor per process: a burst queues up to `max_queue`
+# requests and the rest get an immediate 503, so latency stays bounded
+# instead of every request slowing down together. Requests read shared
+# state through snapshots: the model/scorer pair is swapped as a whole
+# and both detectors fold in new rows under their own locks.
+SERVING_PARAMS = {
+    'scoring_threads': int(os.getenv('AI_SERVER_SCORING_THREADS', '4')),
+    'max_queue': int(os.getenv('AI_SERVER_MAX_QUEUE', '16')),  # waiting requests before 503
+    'queue_timeout': 2.0  # seconds a request may wait for a thread before 503
+}
+
+class Overloaded(Exception):
+    """No scoring capacity left for this request"""
+
+class BoundedExecutor:
+    """Thread pool that refuses work instead of queueing without limit"""
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.capacity = max_workers + max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scoring')
+        self._slots = threading.BoundedSemaphore(self.capacity)
+
+    def _release(self, _future):
+        self._slots.release()
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise Overloaded(f"{self.capacity} requests already running or queued")
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, fn, *args, timeout: Optional[float] = None, **kwargs):
+        """Submit and wait; work still queued after `timeout` is dropped"""
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            if future.cancel():
+                raise Overloaded(f"no scoring thread free within {timeout}s")
+            return future.result()  # already running, let it finish
+
+scoring_executor = BoundedExecutor(SERVING_PARAMS['scoring_threads'], SERVING_PARAMS['max_queue'])
+
+def bounded(view):
+    """Run a view on the scoring executor; 503 with Retry-After when saturated"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            return scoring_executor.run(copy_current_request_context(view), *args,
+                                        timeout=SERVING_PARAMS['queue_timeout'], **kwargs)
+        except Overloaded as e:
+            return jsonify({"error": f"Server busy: {e}"}), 503, {'Retry-After': '1'}
+    return wrapper
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None and request.url_rule is not None:
+        REQUEST_SECONDS.observe(request.url_rule.rule, time.perf_counter() - started)
+    return response
+
+# Subsystem fan-out for /analyze_transaction. Separate from the scoring pool
+# because the view itself already holds a scoring thread while it waits.
+ANALYSIS_PARAMS = {
+    'threads': int(os.getenv('AI_SERVER_ANALYSIS_THREADS', '8')),
+    'max_queue': 16,
+    'budgets': {  # seconds, measured from when the subsystems are started
+        'ml_fraud_detection': float(os.getenv('AI_SERVER_ML_BUDGET', '1.0')),
+        'smurfing_detection': float(os.getenv('AI_SERVER_SMURFING_BUDGET', '2.0'))
+    }
+}
+
+analysis_executor = BoundedExecutor(ANALYSIS_PARAMS['threads'], ANALYSIS_PARAMS['max_queue'])
+
+def gather_with_budgets(futures: Dict[str, object], started: float) -> Tuple[Dict, Dict]:
+    """Wait for each subsystem until its own deadline.
+
+    Returns (results, errors). A subsystem that misses its budget is left
+    running in the background and reported as a timeout; one that raised is
+    reported with its exception.
+    """
+    results, errors = {}, {}
+    for name, future in futures.items():
+        remaining = ANALYSIS_PARAMS['budgets'][name] - (time.perf_counter() - started)
+        try:
+            results[name] = future.result(timeout=max(remaining, 0))
+        except FutureTimeout:
+            future.cancel()
+            errors[name] = {"error": f"timed out after {ANALYSIS_PARAMS['budgets'][name]}s", "timed_out": True}
+        except Exception as e:
+            errors[name] = {"error": str(e)}
+    return results, errors
+
+# ==================================================================
+# ID CARD OCR
+# ==================================================================
+OCR_PARAMS = {
+    'base_url': os.getenv('OCR_BASE_URL', 'https://api.groq.com/openai/v1'),  # any OpenAI-compatible API
+    'model': os.getenv('OCR_MODEL', 'meta-llama/llama-4-scout-17b-16e-instruct'),
+    'timeout': 30.0,  # seconds per LLM call
+    'max_connections': 10,  # pooled keep-alive connections to the LLM
+    'max_side': 1600,  # px, longest image side sent for OCR
+    'jpeg_quality': 85,
+    'cache_size': 1024,  # results kept, keyed on image SHA-256
+    'cache_ttl': 24 * 3600  # seconds
+}
+
+OCR_PROMPT = """
+Perform OCR on the given image of a government ID card and extract:
+- Full Name
+- Date of Birth (DOB)
+
+Response format: {"name": "<full_name>", "dob": "<YYYY-MM-DD>"}
+"""
+
+_MISSING = object()
+
+class TTLCache:
+    """Thread-safe LRU map whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires, value = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+def _pillow():
+    """PIL.Image if Pillow is installed, else None (images go up as-is)"""
+    try:
+        from PIL import Image
+        return Image
+    except ImportError:
+        return None
+
+IMAGE_SIGNATURES = {
+    b'\x89PNG': 'image/png',
+    b'GIF8': 'image/gif',
+    b'RIFF': 'image/webp'
+}
+
+def downscale_image(image_bytes: bytes) -> Tuple[bytes, str]:
+    """Shrink to OCR_PARAMS['max_side'] as JPEG; returns (bytes, mime type)"""
+    mime = next((m for sig, m in IMAGE_SIGNATURES.items() if image_bytes.startswith(sig)), 'image/jpeg')
+    Image = _pillow()
+    if Image is None:
+        return image_bytes, mime
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            max_side = OCR_PARAMS['max_side']
+            if max(img.size) <= max_side and img.format == 'JPEG':
+                return image_bytes, mime
+            img.thumbnail((max_side, max_side))
+            out = io.BytesIO()
+            img.convert('RGB').save(out, format='JPEG', quality=OCR_PARAMS['jpeg_quality'])
+            return out.getvalue(), 'image/jpeg'
+    except Exception as e:
+        print(f"⚠️ Could not downscale image, sending original: {e}")
+        return image_bytes, mime
+
+def parse_ocr_response(response_text: str) -> Dict:
+    """First JSON object in the model's reply (tolerates code fences and chatter)"""
+    match = re.search(r'\{.*\}', response_text or '', re.DOTALL)
+    if not match:
+        return {"error": "Invalid OCR response format"}
+    try:
+        return json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {"error": "Invalid OCR response format"}
+
+class OcrClient:
+    """Async OCR against an OpenAI-compatible chat completions API.
+
+    A single event loop thread owns a pooled httpx.AsyncClient, and request
+    threads hand it work with run_coroutine_threadsafe. Uploads of the same
+    image share one in-flight call and then a TTL cache entry.
+    """
+
+    def __init__(self, base_url: str, api_key: Optional[str], params: Dict = OCR_PARAMS):
+        import httpx
+        self.params = params
+        self.cache = TTLCache(params['cache_size'], params['cache_ttl'])
+        self._in_flight: Dict[str, asyncio.Future] = {}  # only touched on the loop
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            headers={'Authorization': f'Bearer {api_key}'} if api_key else {},
+            timeout=params['timeout'],
+            limits=httpx.Limits(max_connections=params['max_connections'],
+                                max_keepalive_connections=params['max_connections'])
+        )
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name='ocr-loop', daemon=True).start()
+
+    def extract(self, image_bytes: bytes) -> Dict:
+        """Blocking entry point for request threads"""
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        cached = self.cache.get(digest)
+        if cached is None:
+            future = asyncio.run_coroutine_threadsafe(self._extract(digest, image_bytes), self._loop)
+            cached = future.result(timeout=self.params['timeout'] * 2)
+        return dict(cached)
+
+    async def _extract(self, digest: str, image_bytes: bytes) -> Dict:
+        cached = self.cache.get(digest)
+        if cached is not None:
+            return cached
+        task = self._in_flight.get(digest)
+        if task is None:
+            task = self._loop.create_task(self._call(digest, image_bytes))
+            self._in_flight[digest] = task
+            task.add_done_callback(lambda _task: self._in_flight.pop(digest, None))
+        return await asyncio.shield(task)
+
+    async def _call(self, digest: str, image_bytes: bytes) -> Dict:
+        image, mime = await self._loop.run_in_executor(None, downscale_image, image_bytes)
+        image_url = f"data:{mime};base64,{base64.b64encode(image).decode('ascii')}"
+        response = await self._client.post('/chat/completions', json={
+            'model': self.params['model'],
+            'temperature': 0,
+            'messages': [
+                {'role': 'system', 'content': "You are an OCR expert specializing in ID cards."},
+                {'role': 'user', 'content': [
+                    {'type': 'text', 'text': OCR_PROMPT},
+                    {'type': 'image_url', 'image_url': {'url': image_url}}
+                ]}
+            ]
+        })
+        response.raise_for_status()
+        result = parse_ocr_response(response.json()['choices'][0]['message']['content'])
+        if 'error' not in result:
+            self.cache.set(digest, result)
+        return result
+
+# ==================================================================
+# IDEMPOTENT SCORING
+# ==================================================================
+IDEMPOTENCY_PARAMS = {
+    'enabled': os.getenv("AI_SERVER_IDEMPOTENCY", "1") != "0",
+    'max_entries': 100000,
+    'ttl': 24 * 3600,                                 # how long a retry gets the stored score
+    'path': os.getenv("AI_SERVER_IDEMPOTENCY_FILE"),  # JSON-lines file shared by workers; unset = memory only
+    'analysis_path': os.getenv("AI_SERVER_ANALYSIS_IDEMPOTENCY_FILE"),  # same, for /analyze_transaction responses
+    'lock_stripes': 64,
+    'compact_every': 20000  # lines appended by a worker between compaction checks
+}
+
+def transaction_id(data: Dict) -> Optional[str]:
+    """Client transaction id (`transactionId`/`trans_num`, nested or not)"""
+    value = canonical_transaction(data).get('trans_num')
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    value = str(value).strip()
+    return value or None
+
+class IdempotencyCache:
+    """Results of already-processed transactions, keyed on transaction id.
+
+    A retried request gets the stored result (a fraud probability, or a whole
+    /analyze_transaction response) back instead of being scored and appended
+    to the training data again. With `path` set, entries are also
+    appended to a JSON-lines file that is replayed on start-up and re-read on
+    a miss, so gunicorn workers see each other's scores.
+    """
+
+    def __init__(self, path: Optional[str] = None, params: Dict = IDEMPOTENCY_PARAMS):
+        self.path = os.path.abspath(path) if path else None
+        self.ttl = params['ttl']
+        self.max_entries = params['max_entries']
+        self.cache = TTLCache(params['max_entries'], params['ttl'])
+        self._key_locks = [threading.Lock() for _ in range(params['lock_stripes'])]
+        self._file_lock = threading.Lock()
+        self._offset = 0
+        self._inode = None
+        self._appended = 0
+        self._compact_every = params['compact_every']
+        self._compact_thread = None
+        if self.path:
+            self._compact()
+            self._catch_up()
+            print(f"ℹ️ Loaded {len(self.cache)} idempotency entries from {self.path}")
+
+    def lock_for(self, key: str) -> threading.Lock:
+        """Serialises a retry that arrives while the original is still scoring"""
+        return self._key_locks[hash(key) % len(self._key_locks)]
+
+    def get(self, key: str):
+        value = self.cache.get(key)
+        if value is None and self.path:
+            self._catch_up()
+            value = self.cache.get(key)
+        return value
+
+    def put(self, entries: Dict[str, object]):
+        """Store JSON-serialisable values"""
+        if not entries:
+            return
+        now = time.time()
+        for key, value in entries.items():
+            self.cache.set(key, value)
+        if self.path:
+            try:
+                # Same lock as _compact, so no append lands between its read and replace
+                with FileLock(self.path + '.lock'), open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps({'id': key, 'p': value, 't': now}) + '\n'
+                                    for key, value in entries.items()))
+            except OSError as e:
+                print(f"⚠️ Could not persist idempotency entries: {e}")
+                return
+            with self._file_lock:
+                self._appended += len(entries)
+                if self._appended < self._compact_every or (
+                        self._compact_thread is not None and self._compact_thread.is_alive()):
+                    return
+                self._appended = 0
+                self._compact_thread = threading.Thread(target=self._compact, daemon=True)
+                self._compact_thread.start()
+
+    def _catch_up(self):
+        """Load lines appended (by any worker) since the last read"""
+        with self._file_lock:
+            try:
+                with open(self.path, 'rb') as f:
+                    stat = os.fstat(f.fileno())
+                    if stat.st_ino != self._inode or stat.st_size < self._offset:
+                        # Replaced by a compaction: read the new file from the start
+                        self._inode, self._offset = stat.st_ino, 0
+                    f.seek(self._offset)
+                    now = time.time()
+                    for line in f:
+                        if not line.endswith(b'\n'):
+                            break  # another worker is mid-append; read it next time
+                        self._offset += len(line)
+                        try:
+                            entry = json.loads(line)
+                            remaining = self.ttl - (now - entry['t'])
+                            if remaining > 0:
+                                self.cache.set(entry['id'], entry['p'], ttl=remaining)
+                        except (ValueError, KeyError, TypeError):
+                            print("⚠️ Skipping unreadable idempotency line")
+            except FileNotFoundError:
+                pass
+
+    def _compact(self):
+        """Drop expired and superseded lines once the file is twice the cache size.
+        Runs at start-up and in the background every `compact_every` appends."""
+        if not os.path.exists(self.path):
+            return
+        # Cheap check first, so appends are only blocked when there is work to do
+        with open(self.path, 'rb') as f:
+            if sum(1 for _ in f) <= 2 * self.max_entries:
+                return
+        with FileLock(self.path + '.lock'):
+            live, lines = {}, 0
+            now = time.time()
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                        if now - entry['t'] < self.ttl:
+                            live[entry['id']] = entry
+                    except (ValueError, KeyError, TypeError):
+                        continue
+            if lines <= 2 * self.max_entries:
+                return
+            newest = sorted(live.values(), key=lambda entry: entry['t'])[-self.max_entries:]
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(entry) + '\n' for entry in newest))
+            os.replace(tmp_path, self.path)
+            print(f"✅ Compacted idempotency file: {lines} -> {len(newest)} lines")
 
 # ==================================================================
 # API ENDPOINTS
 # ==================================================================
+BATCH_PARAMS = {
+    'max_batch_size': 10000,
+    'threshold': 0.2
+}
+
+def risk_category(risk_score: float) -> str:
+    """Map a model probability onto the /predict risk bands"""
+    if risk_score >= 0.7:
+        return "High Risk"
+    elif risk_score >= 0.3:
+        return "Suspicious"
+    return "Legitimate"
+
 @app.route('/predict', methods=['POST'])
+@bounded
 def analyze_transaction():
     """Analyze transaction risk using ML model"""
+    fraud_detector = get_fraud_detector()
     if fraud_detector is None:
         return jsonify({"error": "Fraud detection system not available"}), 500
     
@@ -745,35 +3519,24 @@ def analyze_transaction():
         return jsonify({"error": "No transaction data provided"}), 400
     
     try:
-        preprocessed_data = fraud_detector.preprocess_new_entry(data)
-        if preprocessed_data is None:
+        # Same preprocess/inference path (and timers) as the batch endpoints
+        [(result, risk_score)] = fraud_detector.predict_many([data])
+        if result == "Error":
             return jsonify({"error": "Error processing transaction data"}), 400
         
-        features = ['amt', 'city_pop', 'distance_from_home', 'hour', 'day_of_week',
-                   'is_night', 'age', 'amt_per_city_pop', 'merchant', 'category', 'gender']
-        X = preprocessed_data[features]
-        
-        probability = fraud_detector.model.predict_proba(X)[0][1]
-        risk_score = float(probability)
-        
-        if risk_score >= 0.7:
-            risk_type = "High Risk"
-        elif risk_score >= 0.3:
-            risk_type = "Suspicious"
-        else:
-            risk_type = "Legitimate"
-        
         return jsonify({
             "Transaction_ID": data.get('Transaction_ID', 'N/A'),
             "risk_score": risk_score,
-            "category": risk_type
+            "category": risk_category(risk_score)
         })
     except Exception as e:
         return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
 
 @app.route('/detect_fraud', methods=['POST'])
+@bounded
 def detect_fraud():
     """Comprehensive fraud detection with auto-retraining"""
+    fraud_detector = get_fraud_detector()
     if fraud_detector is None:
         return jsonify({"error": "Fraud detection system not available"}), 500
     
@@ -792,9 +3555,53 @@ def detect_fraud():
     except Exception as e:
         return jsonify({"error": f"Fraud detection failed: {str(e)}"}), 500
 
+@app.route('/predict_batch', methods=['POST'])
+@bounded
+def predict_batch():
+    """Score many transactions with one model call"""
+    fraud_detector = get_fraud_detector()
+    if fraud_detector is None:
+        return jsonify({"error": "Fraud detection system not available"}), 500
+    
+    data = request.get_json()
+    transactions = data.get('transactions') if isinstance(data, dict) else data
+    if not transactions or not isinstance(transactions, list):
+        return jsonify({"error": "No transactions provided"}), 400
+    if len(transactions) > BATCH_PARAMS['max_batch_size']:
+        return jsonify({
+            "error": f"Batch too large: {len(transactions)} > {BATCH_PARAMS['max_batch_size']}"
+        }), 413
+    
+    options = data if isinstance(data, dict) else {}
+    threshold = options.get('threshold', BATCH_PARAMS['threshold'])
+    if isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or not 0 <= threshold <= 1:
+        return jsonify({"error": "threshold must be a number between 0 and 1"}), 400
+    append = options.get('append', False)
+    if not isinstance(append, bool):
+        return jsonify({"error": "append must be true or false"}), 400
+    
+    try:
+        scored = fraud_detector.predict_many(transactions, threshold=float(threshold), append=append)
+        if scored and scored[0][0] == "Error":
+            return jsonify({"error": "Error processing transaction data"}), 400
+        
+        return jsonify({
+            "count": len(scored),
+            "results": [{
+                "Transaction_ID": txn.get('transactionId', txn.get('Transaction_ID', 'N/A')),
+                "Final Result": result,
+                "risk_score": probability,
+                "category": risk_category(probability)
+            } for txn, (result, probability) in zip(transactions, scored)]
+        })
+    except Exception as e:
+        return jsonify({"error": f"Batch prediction failed: {str(e)}"}), 500
+
 @app.route('/detect_smurfing', methods=['GET'])
+@bounded
 def detect_smurfing_patterns():
     """Detect smurfing/structuring patterns"""
+    smurfing_detector = get_smurfing_detector()
     if smurfing_detector is None:
         return jsonify({"error": "Smurfing detection system not available"}), 500
     
@@ -803,6 +3610,7 @@ def detect_smurfing_patterns():
         return jsonify({
             "status": "success",
             "analysis": results,
+            "streaming_cases": smurfing_detector.streaming_cases(),
             "timestamp": datetime.now().isoformat()
         })
     except Exception as e:
@@ -811,6 +3619,32 @@ def detect_smurfing_patterns():
             "message": str(e)
         }), 500
 
+@app.route('/health', methods=['GET'])
+def health():
+    """Liveness: the process is up"""
+    return jsonify({"status": "ok"})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Request and stage latency histograms in the Prometheus text format"""
+    lines = REQUEST_SECONDS.render() + STAGE_SECONDS.render()
+    return '\n'.join(lines) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/ready', methods=['GET'])
+def readiness():
+    """Readiness: 200 once the detectors are loaded, 503 while loading"""
+    start_warm_up()
+    systems = {
+        name: ("loading" if name not in _systems else
+               "ready" if _systems[name] is not None else "failed")
+        for name in ('fraud_detector', 'smurfing_detector')
+    }
+    ready = all(state == "ready" for state in systems.values())
+    return jsonify({
+        "status": "ready" if ready else "loading",
+        "systems": systems
+    }), 200 if ready else 503
+
 @app.route('/extract_id', methods=['POST'])
 def extract_id_details():
     """Extract name & DOB from ID card image"""
@@ -820,27 +3654,48 @@ def extract_id_details():
     image_file = request.files['image']
     extracted_data = extract_text_from_id(image_file)
     return jsonify(extracted_data)
-from math import radians, sin, cos, sqrt, atan2
 
-# Add this haversine distance calculation function
-def haversine(lat1, lon1, lat2, lon2):
-    """
-    Calculate the great circle distance between two points 
-    on the earth (specified in decimal degrees)
-    """
-    # Convert decimal degrees to radians 
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    
-    # Haversine formula 
-    dlat = lat2 - lat1 
-    dlon = lon2 - lon1 
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a)) 
-    r = 3956  # Radius of Earth in miles
-    return c * r
+def score_smurfing_candidate(smurfing_detector, candidate: Dict) -> Tuple[Dict, int]:
+    """Score a candidate against the graph, then add it for the next request"""
+    results = smurfing_detector.detect_smurfing_enhanced(candidate)
+    transaction_count = smurfing_detector.row_count() + 1
+    with timed('graph_update'):
+        smurfing_detector.add_transaction(candidate)
+    return results, transaction_count
 
 @app.route('/analyze_transaction', methods=['POST'])
+@bounded
 def unified_analysis():
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "No transaction data provided"}), 400
+    
+    # Retries are answered before any feature engineering or graph update
+    analysis_cache = get_system('analysis_cache')
+    key = transaction_id(data) if analysis_cache is not None else None
+    with analysis_cache.lock_for(key) if key else nullcontext():
+        cached = analysis_cache.get(key) if key else None
+        if cached is not None:
+            print(f"♻️ Retried transaction {key}: returning stored analysis")
+            return jsonify(cached)
+        
+        response = run_unified_analysis(data)
+        if key and is_final_analysis(response):
+            analysis_cache.put({key: json.loads(app.json.dumps(response))})
+    return jsonify(response)
+
+def is_final_analysis(response: Dict) -> bool:
+    """Only complete, error-free analyses are replayed to retries; a timeout,
+    overload or failed subsystem is transient and gets re-run instead"""
+    if response["partial"]:
+        return False
+    parts = [response["fraud_detection"], response["smurfing_detection"]]
+    if any(part is None or "error" in part for part in parts):
+        return False
+    return not any("error" in case for case in response["smurfing_detection"].get("analysis") or [])
+
+def run_unified_analysis(data: Dict) -> Dict:
+    """ML score, rule flags and graph checks for one transaction"""
     # Configuration (adjust these based on your model performance)
     FRAUD_THRESHOLD = 0.7  # Lowered from 0.9 to improve sensitivity
     SMURFING_THRESHOLD = 0.5
@@ -848,69 +3703,27 @@ def unified_analysis():
     HIGH_AMOUNT_THRESHOLD = 1000  # Dollars
     NIGHT_HOURS = (0, 6)  # 12am-6am
     
-    data = request.get_json()
-    if not data:
-        return jsonify({"error": "No transaction data provided"}), 400
-    
     response = {
         "timestamp": datetime.now().isoformat(),
         "fraud_detection": None,
         "smurfing_detection": None
     }
+    fraud_detector = get_fraud_detector()
+    smurfing_detector = get_smurfing_detector()
+    started = time.perf_counter()  # budgets start once the systems are loaded
+    futures = {}
+    features = None
 
-    # 1. Enhanced Fraud Detection
+    # 1. Start the ML model and the graph checks side by side
     if fraud_detector:
         try:
-            # Get base prediction
-            result, base_confidence = fraud_detector.predict_and_append(data)
-            fraud_flags = []
-            adjusted_confidence = float(base_confidence)
-            
-            # Rule-based confidence adjustments
-            amount = float(data.get('amount', 0))
-            transaction_time = pd.to_datetime(data.get('trans_date_trans_time'))
-            
-            # High amount flag
-            if amount > HIGH_AMOUNT_THRESHOLD:
-                fraud_flags.append(f"high_amount_{amount}")
-                adjusted_confidence = min(adjusted_confidence + 0.25, 1.0)
-            
-            # Geographic check
-            if all(k in data for k in ['lat', 'long', 'merch_lat', 'merch_long']):
-                try:
-                    distance = haversine(
-                        float(data['lat']), float(data['long']),
-                        float(data['merch_lat']), float(data['merch_long'])
-                    )
-                    if distance > GEO_DISTANCE_ALERT:
-                        fraud_flags.append(f"geolocation_mismatch_{distance:.1f}_miles")
-                        adjusted_confidence = min(adjusted_confidence + 0.3, 1.0)
-                except (ValueError, TypeError) as e:
-                    print(f"Geolocation error: {str(e)}")
-            
-            # Late night transaction
-            if transaction_time.hour in range(*NIGHT_HOURS):
-                fraud_flags.append(f"late_night_{transaction_time.hour}h")
-                adjusted_confidence = min(adjusted_confidence + 0.15, 1.0)
-            
-            # High-risk merchant pattern
-            merchant = str(data.get('merchant', '')).lower()
-            if any(term in merchant for term in ['highrisk', 'fraud', 'electronics']):
-                fraud_flags.append("high_risk_merchant")
-                adjusted_confidence = min(adjusted_confidence + 0.2, 1.0)
-            
-            response["fraud_detection"] = {
-                "system": "ml_fraud_detection",
-                "result": "Fraud" if adjusted_confidence >= FRAUD_THRESHOLD else "Not Fraud",
-                "base_confidence": float(base_confidence),
-                "adjusted_confidence": float(adjusted_confidence),
-                "threshold": FRAUD_THRESHOLD,
-                "flags": fraud_flags,
-                "is_above_threshold": adjusted_confidence >= FRAUD_THRESHOLD,
-                "amount": amount,
-                "rules_applied": len(fraud_flags)
-            }
-
+            # Features are built once and shared by the model and the rules
+            features = fraud_detector.preprocess_entries([data])
+            if features is None:
+                raise ValueError("Error processing transaction data")
+            futures['ml_fraud_detection'] = analysis_executor.submit(
+                fraud_detector.predict_and_append, data, features=features
+            )
         except Exception as e:
             response["fraud_detection"] = {
                 "error": str(e),
@@ -919,64 +3732,117 @@ def unified_analysis():
 
     if smurfing_detector:
         try:
-            temp_df = pd.DataFrame([{
+            candidate = {
                 'Sender_account': data.get('cardNum'),
                 'Receiver_account': data.get('merchant'),
                 'Amount': float(data.get('amount', 0)),
-                'DateTime': pd.to_datetime(data.get('trans_date_trans_time')),
-                'Transaction_ID': data.get('transactionId')
-            }])
-            
-            # Store original data
-            original_df = smurfing_detector.df
-            
-            # Perform analysis with temporary data
-            smurfing_detector.df = pd.concat([original_df, temp_df], ignore_index=True)
-            
-            # Use enhanced detection
-            results = smurfing_detector.detect_smurfing_enhanced(temp_df.iloc[0].to_dict())
-            
-            response["smurfing_detection"] = {
-                "system": "smurfing_detection",
-                "threshold": SMURFING_THRESHOLD,
-                "analysis": results,
-                "transaction_count": len(smurfing_detector.df),
-                "detection_method": "enhanced_pattern_analysis"
+                'DateTime': to_timestamp(data.get('trans_date_trans_time')),
+                'Transaction_ID': transaction_id(data)
             }
-            
-            # Restore original data
-            smurfing_detector.df = original_df
-            
+            futures['smurfing_detection'] = analysis_executor.submit(
+                score_smurfing_candidate, smurfing_detector, candidate
+            )
         except Exception as e:
             response["smurfing_detection"] = {
                 "error": str(e),
                 "system": "smurfing_detection"
             }
-    
-    return jsonify(response)
+
+    # 2. Rule-based confidence adjustments, on this thread while the others run
+    fraud_flags = []
+    rule_boost = 0.0
+    with timed('rules'):
+        if features is not None:
+            row = features.iloc[0]
+            amount = float(row['amt'])
+            transaction_time = row['trans_date_trans_time']
+        
+            # High amount flag
+            if amount > HIGH_AMOUNT_THRESHOLD:
+                fraud_flags.append(f"high_amount_{amount}")
+                rule_boost += 0.25
+        
+            # Geographic check
+            if all(k in data for k in ['lat', 'long', 'merch_lat', 'merch_long']):
+                distance = float(row['distance_from_home']) / KM_PER_MILE
+                if distance > GEO_DISTANCE_ALERT:
+                    fraud_flags.append(f"geolocation_mismatch_{distance:.1f}_miles")
+                    rule_boost += 0.3
+        
+            # Late night transaction
+            if transaction_time.hour in range(*NIGHT_HOURS):
+                fraud_flags.append(f"late_night_{transaction_time.hour}h")
+                rule_boost += 0.15
+        
+            # High-risk merchant pattern
+            merchant = str(data.get('merchant', '')).lower()
+            if any(term in merchant for term in ['highrisk', 'fraud', 'electronics']):
+                fraud_flags.append("high_risk_merchant")
+                rule_boost += 0.2
+
+    # 3. Collect each subsystem within its budget; late ones come back partial
+    results, errors = gather_with_budgets(futures, started)
+    if results.get('ml_fraud_detection', ('',))[0] == "Error":
+        # predict_and_append reports failures as ("Error", 0.0), not a score
+        del results['ml_fraud_detection']
+        errors['ml_fraud_detection'] = {"error": "Fraud scoring failed"}
+
+    if 'ml_fraud_detection' in results:
+        result, base_confidence = results['ml_fraud_detection']
+        adjusted_confidence = min(float(base_confidence) + rule_boost, 1.0)
+        response["fraud_detection"] = {
+            "system": "ml_fraud_detection",
+            "result": "Fraud" if adjusted_confidence >= FRAUD_THRESHOLD else "Not Fraud",
+            "base_confidence": float(base_confidence),
+            "adjusted_confidence": float(adjusted_confidence),
+            "threshold": FRAUD_THRESHOLD,
+            "flags": fraud_flags,
+            "is_above_threshold": adjusted_confidence >= FRAUD_THRESHOLD,
+            "amount": amount,
+            "rules_applied": len(fraud_flags)
+        }
+    elif 'ml_fraud_detection' in errors:
+        # The rules do not need the model, so report them even without it
+        response["fraud_detection"] = {
+            "system": "ml_fraud_detection",
+            **errors['ml_fraud_detection'],
+            "flags": fraud_flags,
+            "rules_applied": len(fraud_flags)
+        }
+
+    if 'smurfing_detection' in results:
+        analysis, transaction_count = results['smurfing_detection']
+        response["smurfing_detection"] = {
+            "system": "smurfing_detection",
+            "threshold": SMURFING_THRESHOLD,
+            "analysis": analysis,
+            "transaction_count": transaction_count,
+            "detection_method": "enhanced_pattern_analysis"
+        }
+    elif 'smurfing_detection' in errors:
+        response["smurfing_detection"] = {
+            "system": "smurfing_detection",
+            **errors['smurfing_detection']
+        }
+
+    response["partial"] = any(e.get("timed_out") for e in errors.values())
+    response["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return response
 
 # ==================================================================
 # HELPER FUNCTIONS
 # ==================================================================
 def extract_text_from_id(image_file):
     """OCR for ID cards using Groq API"""
-    image_data = base64.b64encode(image_file.read()).decode('utf-8')
-
-    prompt = """
-    Perform OCR on the given image of a government ID card and extract:
-    - Full Name
-    - Date of Birth (DOB)
-    
-    Response format: {"name": "<full_name>", "dob": "<YYYY-MM-DD>"}
-    """
-
-    response = chat([
-        SystemMessage(content="You are an OCR expert specializing in ID cards."),
-        HumanMessage(content=prompt, attachments=[{"type": "image", "data": image_data}])
-    ])
-
-    response_text = response.content.strip()
-    return json.loads(response_text) if response_text else {"error": "Invalid OCR response format"}
+    ocr = get_system('ocr')
+    if ocr is None:
+        return {"error": "OCR service not available"}
+    try:
+        with timed('ocr'):
+            return ocr.extract(image_file.read())
+    except Exception as e:
+        print(f"🚨 OCR failed: {e}")
+        return {"error": f"OCR request failed: {e}"}
 
 def extract_risk_details(response_text):
     """Extract risk_score and type from API response"""
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Tests import main.py and benchmark.py from ai_server/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GROQ_API_KEY', 'test')
@@ -0,0 +1,64 @@
+"""Communities detected by label propagation must recover planted rings."""
+import numpy as np
+import pytest
+
+import main
+from benchmark import make_transactions, plant_rings
+
+
+@pytest.fixture(scope='module')
+def detector(tmp_path_factory):
+    data, rings = plant_rings(make_transactions(20000), rings=10)
+    csv_path = tmp_path_factory.mktemp('communities') / 'transactions.csv'
+    data.to_csv(csv_path, index=False)
+    detector = main.SmurfingDetector(str(csv_path))
+    detector.rings = rings
+    return detector
+
+
+def best_overlap(ring, communities):
+    return max(len(ring & members) / len(ring | members) for members in communities)
+
+
+def test_label_propagation_converges(detector):
+    assert detector.label_propagation.converged
+
+
+def test_planted_rings_are_reported(detector):
+    communities = [set(c['Members']) for c in detector.community_data['fraud_communities'].values()]
+    overlaps = [best_overlap(ring, communities) for ring in detector.rings]
+    # Plain label propagation merges most rings into the background (mean ~0.2)
+    assert np.mean(overlaps) >= 0.7
+
+
+def test_background_traffic_is_not_a_ring(detector):
+    # Ordinary cards and merchants stay out of the reported communities
+    rings = set().union(*detector.rings)
+    for community in detector.community_data['fraud_communities'].values():
+        assert set(community['Members']) <= rings
+
+
+def test_reported_communities_are_analyzed(detector):
+    results = detector.detect_smurfing()
+    assert results
+    assert {result['community_id'] for result in results} == set(detector.community_data['fraud_communities'])
+
+
+def test_refresh_runs_off_the_request_path(tmp_path):
+    data, rings = plant_rings(make_transactions(5000), rings=4)
+    csv_path = tmp_path / 'transactions.csv'
+    data.to_csv(csv_path, index=False)
+    detector = main.SmurfingDetector(str(csv_path))
+    members = sorted(rings[0])
+    for i in range(main.COMMUNITY_PARAMS['refresh_every']):
+        assert detector.add_transaction({
+            'Sender_account': members[i % len(members)],
+            'Receiver_account': members[(i + 1) % len(members)],
+            'Amount': 950.0,
+            'DateTime': '2024-01-01 12:00:00',
+        })
+    detector._refresh_thread.join()
+    # The background index must match a full rebuild over the same rows
+    refreshed = detector._community_rows
+    detector._index_communities()
+    assert refreshed == detector._community_rows
@@ -0,0 +1,54 @@
+"""Training (build_feature_frame) and serving (build_request_features with
+the detector's VelocityStore) must build the same model features."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark import make_transactions, request_payloads, serve_one_by_one
+from main import VELOCITY_COLUMNS, VelocityStore, build_feature_frame, build_request_features, model_feature_columns
+
+
+@pytest.fixture(scope='module')
+def data():
+    data = make_transactions(600)
+    # Few cards, so every velocity window has history in it
+    data['cc_num'] = np.random.default_rng(3).integers(0, 12, len(data))
+    return data
+
+
+@pytest.fixture(scope='module')
+def training(data):
+    return build_feature_frame(data.copy())[model_feature_columns()]
+
+
+def assert_same_columns(training, serving):
+    assert list(serving.columns) == list(training.columns)
+    for column in training.columns:
+        pd.testing.assert_series_equal(
+            serving[column].reset_index(drop=True), training[column].reset_index(drop=True),
+            check_dtype=False, check_categorical=False, rtol=1e-9, obj=column
+        )
+
+
+def test_store_backed_serving_matches_training(data, training):
+    serving = serve_one_by_one(request_payloads(data))[model_feature_columns()]
+    assert_same_columns(training, serving)
+    assert (training[VELOCITY_COLUMNS].to_numpy() > 0).any(axis=0).all()
+
+
+def test_store_seeded_from_history_matches_training(data, training):
+    # A restarted detector seeds the store from the training frame, then serves
+    history, recent = data.iloc[:400], data.iloc[400:]
+    store = VelocityStore.from_frame(build_feature_frame(history.copy()))
+    rows = []
+    for payload in request_payloads(recent):
+        row = build_request_features([payload], velocity=store)
+        store.observe(row)
+        rows.append(row)
+    serving = pd.concat(rows, ignore_index=True)[model_feature_columns()]
+    assert_same_columns(training.iloc[400:], serving)
+
+
+def test_batch_without_store_matches_training(data, training):
+    serving = build_request_features(request_payloads(data))[model_feature_columns()]
+    assert_same_columns(training, serving)
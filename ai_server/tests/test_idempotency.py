@@ -0,0 +1,36 @@
+"""The shared idempotency file is compacted while the server runs."""
+import threading
+
+import main
+from main import IDEMPOTENCY_PARAMS, IdempotencyCache
+
+
+def test_file_is_compacted_between_restarts(tmp_path):
+    path = tmp_path / 'idempotency.jsonl'
+    params = {**IDEMPOTENCY_PARAMS, 'max_entries': 10, 'compact_every': 5}
+    cache = IdempotencyCache(str(path), params)
+    for i in range(40):
+        cache.put({f"txn-{i}": i / 100})
+        if cache._compact_thread is not None:
+            cache._compact_thread.join()
+    
+    lines = path.read_text().splitlines()
+    assert len(lines) <= 2 * params['max_entries'] + params['compact_every']
+    # Other workers (a fresh cache) still see the newest entries
+    assert IdempotencyCache(str(path), params).get('txn-39') == 0.39
+
+
+def test_put_waits_for_the_file_lock(tmp_path):
+    path = tmp_path / 'idempotency.jsonl'
+    cache = IdempotencyCache(str(path))
+    lock = main.FileLock(str(path) + '.lock')
+    assert lock.acquire()
+    try:
+        writer = threading.Thread(target=cache.put, args=({'txn-1': 0.5},))
+        writer.start()
+        writer.join(timeout=0.2)
+        assert writer.is_alive() and not path.exists()
+    finally:
+        lock.release()
+    writer.join()
+    assert '"txn-1"' in path.read_text()
@@ -0,0 +1,32 @@
+"""A restarted detector must train on the same features as a fresh one."""
+import pandas as pd
+
+import main
+from benchmark import make_transactions, request_payloads
+from main import build_feature_frame, load_training_frame, model_feature_columns, training_frame
+
+
+def test_restart_with_log_keeps_derived_features(tmp_path):
+    data = make_transactions(3000)
+    csv_path = tmp_path / 'transactions.csv'
+    data.iloc[:2995].to_csv(csv_path, index=False)
+    paths = dict(model_path=str(tmp_path / 'model.pkl'), training_data_path=str(csv_path),
+                 state_path=str(tmp_path / 'state.json'))
+    
+    detector = main.PersistentAutoRetrainFraudDetector(**paths)
+    for payload in request_payloads(data.iloc[2995:]):
+        assert detector.predict_and_append(payload)[0] != "Error"
+    
+    # Logged rows carry derived and velocity columns, the CSV rows don't
+    restarted = main.PersistentAutoRetrainFraudDetector(**paths)
+    # The CSV is read back with float32 amounts, hence the looser tolerance
+    expected = build_feature_frame(data.copy())[model_feature_columns()]
+    # Both the restarted detector's frame and the retrain worker's disk snapshot
+    for frame in (restarted.original_df, load_training_frame(str(csv_path))):
+        snapshot = training_frame(frame, 'full')
+        assert len(snapshot) == len(expected)
+        for column in model_feature_columns():
+            pd.testing.assert_series_equal(
+                snapshot[column].reset_index(drop=True), expected[column].reset_index(drop=True),
+                check_dtype=False, check_categorical=False, rtol=1e-5, obj=column
+            )
@@ -0,0 +1,38 @@
+"""Incremental retrains build features for their rows only, with the same values."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import main
+from benchmark import make_transactions
+from main import build_feature_frame, model_feature_columns, select_training_rows, training_frame
+
+
+@pytest.fixture(scope='module')
+def history():
+    data = make_transactions(6000)
+    # Few cards, so velocity windows reach back past the selected rows
+    data['cc_num'] = np.random.default_rng(5).integers(0, 30, len(data))
+    return data
+
+
+@pytest.mark.parametrize('mode', ['warm_start', 'reservoir'])
+def test_incremental_rows_match_full_build(history, mode, monkeypatch):
+    monkeypatch.setitem(main.RETRAIN_PARAMS, 'recent_rows', 500)
+    monkeypatch.setitem(main.RETRAIN_PARAMS, 'reservoir_size', 800)
+    monkeypatch.setitem(main.RETRAIN_PARAMS, 'reservoir_days', 30)
+    monkeypatch.setitem(main.RETRAIN_PARAMS, 'min_fraud_rows', 60)
+    
+    expected = build_feature_frame(history.copy()).loc[select_training_rows(history, mode).index]
+    frame = training_frame(history, mode)
+    assert len(frame) < len(history)
+    assert list(frame.index) == list(expected.index)
+    for column in model_feature_columns() + ['is_fraud']:
+        pd.testing.assert_series_equal(frame[column], expected[column], check_dtype=False,
+                                       check_categorical=False, rtol=1e-9, obj=column)
+
+
+def test_history_is_not_modified(history):
+    before = history.copy()
+    training_frame(history, 'warm_start')
+    pd.testing.assert_frame_equal(history, before)
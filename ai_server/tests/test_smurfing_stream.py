@@ -0,0 +1,51 @@
+"""Lazily snapshotted Classic_Smurfing bursts must match copying the window."""
+import numpy as np
+
+import main
+
+
+def copied_cases(rows, params=main.SMURFING_PARAMS):
+    """Reference: copy the whole window on every qualifying push"""
+    window_ns = int(params['max_time_window'] * 3600 * 1e9)
+    windows, cases = {}, {}
+    for receiver, sender, time_ns, amount in rows:
+        window = windows.setdefault(receiver, [])
+        latest = max([time_ns] + [entry[0] for entry in window])
+        window[:] = [entry for entry in window if entry[0] >= latest - window_ns]
+        if time_ns < latest - window_ns:
+            continue
+        window.append((time_ns, sender, amount))
+        window.sort(key=lambda entry: entry[0])
+        if (len(window) < params['min_transactions'] or
+                any(entry[2] >= params['max_amount'] for entry in window) or
+                len({entry[1] for entry in window}) < params['min_senders']):
+            continue
+        bursts = cases.setdefault(receiver, [])
+        if bursts and bursts[-1][-1][0] >= window[0][0]:
+            if len(window) >= len(bursts[-1]):
+                bursts[-1] = list(window)
+        else:
+            bursts.append(list(window))
+    return [(receiver, burst) for receiver, bursts in cases.items() for burst in bursts]
+
+
+def test_bursts_match_copied_windows():
+    rng = np.random.default_rng(0)
+    n = 5000
+    times = np.cumsum(rng.integers(0, 600, n)) * 10**9
+    # Some transfers arrive up to an hour late
+    times += rng.integers(-3600, 3600, n) * 10**9 * (rng.random(n) < 0.2)
+    rows = list(zip(rng.integers(0, 40, n).tolist(), rng.integers(0, 200, n).tolist(),
+                    times.tolist(), np.round(rng.gamma(2, 3000, n), 2).tolist()))
+    stream = main.SmurfingStream()
+    for row in rows:
+        stream.push(*row)
+    
+    expected = copied_cases(rows)
+    cases = stream.all_cases()
+    assert len(cases) == len(expected) > 0
+    for case, (receiver, burst) in zip(cases, expected):
+        assert case['receiver'] == str(receiver)
+        assert case['transaction_count'] == len(burst)
+        assert case['total_amount'] == sum(entry[2] for entry in burst)
+        assert sorted(case['senders']) == sorted({str(entry[1]) for entry in burst})
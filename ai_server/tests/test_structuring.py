@@ -0,0 +1,58 @@
+"""An incrementally updated StructuringScan must match a full rebuild."""
+import numpy as np
+import pandas as pd
+
+import main
+from benchmark import make_transactions
+from main import StructuringScan
+
+
+def splitting_frame(rows, accounts=2000, seed=7):
+    rng = np.random.default_rng(seed)
+    senders = rng.integers(0, accounts, rows)
+    # Few receivers per sender, so later rows overwrite earlier edges
+    receivers = accounts + (senders * 7 + rng.integers(0, 6, rows)) % 500
+    amounts = np.where(senders % 20 == 0, rng.uniform(1000, 1800, rows), rng.gamma(2.0, 60.0, rows))
+    hours = np.where(senders % 20 == 0, rng.uniform(0, 6, rows), rng.uniform(0, 24 * 30, rows))
+    times = pd.to_datetime(pd.Timestamp('2025-01-01').value + (hours * 3.6e12).astype(np.int64))
+    times = times.where(rng.random(rows) > 0.01)
+    return pd.DataFrame({'Sender_account': senders, 'Receiver_account': receivers,
+                         'Amount': amounts, 'DateTime': times})
+
+
+def test_updates_match_rebuild():
+    df = splitting_frame(20000)
+    scan = StructuringScan.from_frame(df.iloc[:15000])
+    for row in df.iloc[15000:].itertuples(index=False):
+        scan.update(row.Sender_account, row.Receiver_account, row.Amount, row.DateTime.value)
+    
+    members = np.unique(df['Sender_account']).tolist()
+    expected = StructuringScan.from_frame(df).cases(members)
+    assert expected
+    assert scan.cases(members) == expected
+
+
+def test_update_from_empty_scan():
+    df = splitting_frame(3000)
+    scan = StructuringScan.from_frame(df.iloc[:0])
+    for row in df.itertuples(index=False):
+        scan.update(row.Sender_account, row.Receiver_account, row.Amount, row.DateTime.value)
+    
+    members = np.unique(df['Sender_account']).tolist()
+    assert scan.cases(members) == StructuringScan.from_frame(df).cases(members)
+
+
+def test_add_transaction_without_time(tmp_path):
+    csv_path = tmp_path / 'transactions.csv'
+    make_transactions(2000).to_csv(csv_path, index=False)
+    detector = main.SmurfingDetector(str(csv_path))
+    detector.detect_smurfing()  # builds the structuring scan
+    assert detector._structuring_scan is not None
+    
+    candidate = {'Sender_account': 'card-1', 'Receiver_account': 'fraud_Mule', 'Amount': 1500.0,
+                 'DateTime': None, 'Transaction_ID': 'no-time-1'}
+    rows = detector.row_count()
+    assert detector.add_transaction(candidate)
+    assert not detector.add_transaction(candidate)
+    assert detector.row_count() == rows + 1
+    assert pd.isna(detector.df['DateTime'].iloc[-1])